@@ -0,0 +1,60 @@
+"""
+Time and memory to map coordinate-keyed results (autodetect_query_nl) to point ids,
+for the old tuple dict and for SpatialIndex.
+
+    python benchmarks/coords_mapping_benchmark.py --points 3000000 --selection 1000000
+"""
+import argparse
+import tracemalloc
+from time import time
+
+import numpy as np
+
+from threedont.app.spatial_index import SpatialIndex
+
+
+def timed(label, func, *args):
+    tracemalloc.start()
+    start = time()
+    result = func(*args)
+    elapsed = time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<28} {elapsed:7.3f} s {peak / 2**20:8.1f} MB")
+    return result, elapsed
+
+
+def dict_ids(coords_to_id, coords):
+    ids = []
+    for coord in coords:
+        try:
+            ids.append(coords_to_id[tuple(coord)])
+        except KeyError:
+            continue
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=3000000)
+    parser.add_argument("--selection", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"Generating {args.points} points...")
+    rng = np.random.default_rng(0)
+    coords = (rng.random((args.points, 3)) * 100).astype(np.float32)
+    selected = rng.choice(args.points, args.selection, replace=False)
+    query = coords[selected]
+
+    coords_to_id, old_build = timed(
+        "build, tuple dict", lambda: {tuple(c): i for i, c in enumerate(coords)}
+    )
+    _, old_query = timed("map, tuple dict", dict_ids, coords_to_id, query)
+    index, new_build = timed("build, SpatialIndex", SpatialIndex, coords)
+    ids, new_query = timed("map, SpatialIndex", index.get_ids, query)
+    assert (ids == selected).all()
+    print(f"speedup: {(old_build + old_query) / (new_build + new_query):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+// Time of the frustum culling and LOD selection of Octree::getIndices on
+// synthetic terrain-like clouds, on one thread and on one thread per core.
+//
+//     cmake -DTHREEDONT_BUILD_BENCHMARKS=ON .. && make octree_traversal_benchmark
+//     ./benchmarks/octree_traversal_benchmark 1000000 10000000 50000000
+#include "octree.h"
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <vector>
+
+static double now() {
+  return std::chrono::duration<double>(
+                 std::chrono::steady_clock::now().time_since_epoch())
+          .count();
+}
+
+static void generate(std::vector<float> &xyz, std::size_t num_points) {
+  // rolling ground over a 1 km square with some scatter above it
+  std::mt19937 random(0);
+  std::uniform_real_distribution<float> plane(0.0f, 1000.0f);
+  std::normal_distribution<float> scatter(0.0f, 0.5f);
+  xyz.resize(3 * num_points);
+  for (std::size_t i = 0; i < num_points; i++) {
+    float x = plane(random);
+    float y = plane(random);
+    float z = 20.0f * sinf(x / 80.0f) * cosf(y / 120.0f) + scatter(random);
+    xyz[3 * i + 0] = x;
+    xyz[3 * i + 1] = y;
+    xyz[3 * i + 2] = z;
+  }
+}
+
+static double timeTraversal(const Octree &octree, const Camera &camera,
+                            float fudge_factor, std::vector<Octree::Range> &ranges) {
+  // best of a few runs, in milliseconds
+  double best = 1e30;
+  for (int run = 0; run < 5; run++) {
+    double t = now();
+    octree.getIndices(ranges, camera, PI / 4.0f, -0.1f, 1920, 1080,
+                      fudge_factor);
+    best = (std::min) (best, now() - t);
+  }
+  return 1000.0 * best;
+}
+
+int main(int argc, char **argv) {
+  std::vector<std::size_t> sizes;
+  for (int i = 1; i < argc; i++) sizes.push_back(std::strtoull(argv[i], nullptr, 10));
+  if (sizes.empty()) sizes = {1000000, 10000000, 50000000};
+
+  struct View {
+    const char *name;
+    float distance; // of the widest span
+    float theta;
+  };
+  const View views[] = {{"overview", 1.0f, PI / 4.0f},
+                        {"oblique", 0.3f, PI / 12.0f},
+                        {"close-up", 0.05f, PI / 6.0f}};
+
+  std::printf("%10s %-9s %6s %9s %10s %10s %10s %7s\n", "points", "view",
+              "fudge", "ranges", "selected", "1 thread", "all", "speedup");
+  for (std::size_t num_points : sizes) {
+    std::vector<float> xyz, sizes_out;
+    generate(xyz, num_points);
+    Octree octree;
+    double t = now();
+    octree.buildTree(xyz, sizes_out, 32);
+    std::printf("%zu points, octree built in %.2f s\n", num_points, now() - t);
+
+    for (const View &view : views) {
+      Camera camera(0.0f, 1000.0f, 0.0f, 1000.0f, -20.0f, 20.0f);
+      camera.setCameraDistance(view.distance * 1000.0f);
+      camera.setTheta(view.theta);
+      for (float fudge_factor : {0.25f, 1.0f}) {
+        std::vector<Octree::Range> ranges;
+        octree.setNumThreads(1);
+        double single = timeTraversal(octree, camera, fudge_factor, ranges);
+        octree.setNumThreads(0);
+        double all = timeTraversal(octree, camera, fudge_factor, ranges);
+        std::size_t selected = 0;
+        for (const Octree::Range &r : ranges) selected += r.count;
+        std::printf("%10zu %-9s %6.2f %9zu %10zu %8.2f ms %7.2f ms %6.2fx\n",
+                    num_points, view.name, fudge_factor, ranges.size(), selected,
+                    single, all, single / all);
+      }
+    }
+  }
+  return 0;
+}
@@ -0,0 +1,128 @@
+"""
+Compares the SPARQL result formats used to load the points.
+
+Without arguments the decoders are timed on synthetic responses, with --endpoint
+the whole round trip is timed against a real server, the same measure used by
+SparqlEndpoint to choose the result format.
+
+    python benchmarks/result_format_benchmark.py --rows 1000000
+    python benchmarks/result_format_benchmark.py --endpoint http://localhost:8890 --graph http://localhost:8890/Nettuno
+"""
+import argparse
+import io
+import json
+from email.message import Message
+from time import time
+
+import numpy as np
+from SPARQLWrapper import CSV, JSON, TSV, TURTLE
+
+from threedont.app.db import IRI_COLUMNS, NUMERIC_COLUMNS, SparqlEndpoint
+from threedont.app.turtle_parse import QueryResultWithTurtle
+from turtle_parse_benchmark import make_fixture as make_turtle_fixture
+
+NAMESPACE = "http://3DOntCore#"
+XSD_DECIMAL = "http://www.w3.org/2001/XMLSchema#decimal"
+CONTENT_TYPES = {
+    TSV: "text/tab-separated-values; charset=UTF-8",
+    CSV: "text/csv; charset=UTF-8",
+    JSON: "application/sparql-results+json; charset=UTF-8",
+    TURTLE: "text/turtle; charset=UTF-8",
+}
+
+
+class FixtureResponse(io.BytesIO):
+    def __init__(self, data, content_type):
+        super().__init__(data)
+        self.content_type = content_type
+
+    def info(self):
+        message = Message()
+        message["Content-Type"] = self.content_type
+        return message
+
+
+def make_rows(rows):
+    rng = np.random.default_rng(0)
+    xyz = rng.uniform(-100, 100, (rows, 3)).round(4).tolist()
+    rgb = rng.integers(0, 256, (rows, 3)).tolist()
+    return [(f"{NAMESPACE}Point_{i}", *c, *k) for i, (c, k) in enumerate(zip(xyz, rgb))]
+
+
+def make_tsv(rows):
+    lines = ["\t".join("?" + var for var in ("p",) + NUMERIC_COLUMNS)]
+    lines += [f'<{p}>\t"{x}"^^<{XSD_DECIMAL}>\t{y}\t{z}\t{r}\t{g}\t{b}' for p, x, y, z, r, g, b in rows]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def make_csv(rows):
+    lines = [",".join(("p",) + NUMERIC_COLUMNS)]
+    lines += [",".join(map(str, row)) for row in rows]
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+def make_json(rows):
+    def literal(value):
+        return {"type": "typed-literal", "datatype": XSD_DECIMAL, "value": str(value)}
+
+    bindings = [
+        {"p": {"type": "uri", "value": row[0]}, **{var: literal(v) for var, v in zip(NUMERIC_COLUMNS, row[1:])}}
+        for row in rows
+    ]
+    results = {"head": {"vars": ["p", *NUMERIC_COLUMNS]}, "results": {"bindings": bindings}}
+    return json.dumps(results).encode("utf-8")
+
+
+def decode(data, result_format):
+    response = FixtureResponse(data, CONTENT_TYPES[result_format])
+    result = QueryResultWithTurtle((response, result_format), NUMERIC_COLUMNS, 0, IRI_COLUMNS)
+    start = time()
+    out = result.convert()
+    return out, time() - start
+
+
+def run_offline(rows):
+    print(f"Generating {rows} rows...")
+    table = make_rows(rows)
+    fixtures = {
+        "tsv": (make_tsv(table), TSV),
+        "csv": (make_csv(table), CSV),
+        "json": (make_json(table), JSON),
+        "turtle": (make_turtle_fixture(rows), TURTLE),
+    }
+    reference = None
+    for name, (data, result_format) in fixtures.items():
+        out, elapsed = decode(data, result_format)
+        if reference is None:
+            reference = out
+        # the turtle fixture has its own random values, only the shape is comparable
+        assert list(out.keys()) == list(reference.keys())
+        assert all(len(out[key]) == rows for key in out)
+        print(f"{name:>6}: {len(data) / (1 << 20):8.1f} MiB {elapsed:6.2f} s")
+
+
+def run_online(endpoint, graph, namespace, repeat):
+    client = SparqlEndpoint(graph, endpoint, namespace)
+    for _ in range(repeat):
+        timings = client.probe_result_formats()
+        print(", ".join(f"{name}: {'-' if t is None else f'{t:.3f} s'}" for name, t in timings.items()))
+    print("Chosen format:", client.negotiate_result_format())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--endpoint", help="url of the database, without /sparql")
+    parser.add_argument("--graph")
+    parser.add_argument("--namespace", default=NAMESPACE)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.endpoint:
+        run_online(args.endpoint, args.graph, args.namespace, args.repeat)
+    else:
+        run_offline(args.rows)
+
+
+if __name__ == "__main__":
+    main()
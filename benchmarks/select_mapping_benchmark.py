@@ -0,0 +1,85 @@
+"""
+Latency from a parsed select/scalar result to the bytes sent to the viewer,
+for the old per-row dict mapping and for SparqlEndpoint.
+
+    python benchmarks/select_mapping_benchmark.py --points 5000000 --selection 1000000
+"""
+import argparse
+from time import time
+
+import numpy as np
+
+from threedont.app.db import SparqlEndpoint
+
+NAMESPACE = "http://3DOntCore#"
+HIGHLIGHT_COLOR = [1.0, 0.0, 0.0]
+
+
+def to_viewer(array):
+    # what Viewer.attributes does with every attribute, highlight masks are sent as they are
+    if array.dtype == np.uint8:
+        return array.tobytes()
+    return np.asarray(array, dtype=np.float32).tobytes()
+
+
+def dict_select(iri_to_id, colors, iris):
+    colors = np.copy(colors)
+    for p in iris:
+        try:
+            i = iri_to_id[p]
+        except KeyError:
+            continue
+        colors[i] = HIGHLIGHT_COLOR
+    return colors
+
+
+def dict_scalar(iri_to_id, colors, iris, values):
+    values = [float(v) for v in values]
+    minimum, maximum = min(values), max(values)
+    scalars = np.full(len(colors), minimum - (maximum - minimum) / 10, dtype=np.float32)
+    for subject, scalar in zip(iris, values):
+        scalars[iri_to_id[subject]] = scalar
+    return scalars
+
+
+def timed(label, func, *args):
+    start = time()
+    to_viewer(func(*args))
+    elapsed = time() - start
+    print(f"{label:<28} {elapsed:7.3f} s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=5000000)
+    parser.add_argument("--selection", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"Generating {args.points} points...")
+    rng = np.random.default_rng(0)
+    iris = [f"<{NAMESPACE}Point_{i}>" for i in range(args.points)]
+    colors = rng.random((args.points, 3), dtype=np.float32)
+    selected = rng.choice(args.points, args.selection, replace=False)
+    # a select also returns some IRIs that are not points
+    select_column = [iris[i] for i in selected] + [f"<{NAMESPACE}Part_{i}>" for i in range(1000)]
+    scalar_values = [str(v) for v in rng.random(args.selection).round(6)]
+    scalar_column = [iris[i] for i in selected]
+
+    iri_to_id = {p: i for i, p in enumerate(iris)}
+    client = SparqlEndpoint("http://example.org/graph", "http://localhost:8890", result_format="turtle")
+    client.set_points(np.zeros((args.points, 3), dtype=np.float32), colors, iris)
+
+    client._execute_chunked_query = lambda query: {"p": select_column}
+    old = timed("select, dict per row", dict_select, iri_to_id, colors, select_column)
+    new = timed("select, SparqlEndpoint", client.execute_select_query, "")
+    print(f"select speedup: {old / new:.1f}x")
+
+    client._execute_chunked_query = lambda query: {"s": scalar_column, "x": scalar_values}
+    old = timed("scalar, dict per row", dict_scalar, iri_to_id, colors, scalar_column, scalar_values)
+    new = timed("scalar, SparqlEndpoint", client.execute_scalar_query, "")
+    print(f"scalar speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
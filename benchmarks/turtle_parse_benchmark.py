@@ -0,0 +1,92 @@
+"""
+Compares the line by line Turtle result parser with the streaming one
+on a synthetic result set shaped like the response to SELECT_ALL_QUERY.
+
+    python benchmarks/turtle_parse_benchmark.py --rows 3000000
+"""
+import argparse
+import io
+from email.message import Message
+from time import time
+
+import numpy as np
+
+from threedont.app.turtle_parse import QueryResultWithTurtle
+
+NUMERIC_COLUMNS = ("x", "y", "z", "r", "g", "b")
+
+HEADER = b"""@prefix res: <http://www.w3.org/2005/sparql-results#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+_:_ a res:ResultSet .
+_:_ res:resultVariable "p" , "x" , "y" , "z" , "r" , "g" , "b" .
+@prefix ns0:\t<http://3DOntCore#> .
+"""
+
+SOLUTION = (
+    '_:_ res:solution [\n'
+    '      res:binding [ res:variable "p" ; res:value ns0:Point_{i} ] ;\n'
+    '      res:binding [ res:variable "x" ; res:value {x} ] ;\n'
+    '      res:binding [ res:variable "y" ; res:value "{y}"^^xsd:decimal ] ;\n'
+    '      res:binding [ res:variable "z" ; res:value {z} ] ;\n'
+    '      res:binding [ res:variable "r" ; res:value {r} ] ;\n'
+    '      res:binding [ res:variable "g" ; res:value {g} ] ;\n'
+    '      res:binding [ res:variable "b" ; res:value {b} ] ] .\n'
+)
+
+
+class FixtureResponse(io.BytesIO):
+    def info(self):
+        message = Message()
+        message["Content-Type"] = "text/turtle; charset=UTF-8"
+        return message
+
+
+def make_fixture(rows):
+    rng = np.random.default_rng(0)
+    xyz = rng.uniform(-100, 100, (rows, 3)).round(4)
+    rgb = rng.integers(0, 256, (rows, 3))
+    body = "".join(
+        SOLUTION.format(i=i, x=x, y=y, z=z, r=r, g=g, b=b)
+        for i, ((x, y, z), (r, g, b)) in enumerate(zip(xyz.tolist(), rgb.tolist()))
+    )
+    return HEADER + body.encode("utf-8")
+
+
+def run(fixture, numeric_columns):
+    result = QueryResultWithTurtle(
+        (FixtureResponse(fixture), "turtle"), numeric_columns, len(fixture) // 400
+    )
+    start = time()
+    out = result._convertN3()
+    return out, time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000000)
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} rows...")
+    fixture = make_fixture(args.rows)
+    print(f"Fixture size: {len(fixture) / (1 << 20):.1f} MiB")
+
+    lines, lines_time = run(fixture, None)
+    # the line parser returns strings, converting them was part of the loading time
+    start = time()
+    for key in NUMERIC_COLUMNS:
+        values = [v.split('"')[1] if v.startswith('"') else v for v in lines[key]]
+        lines[key] = np.array(values).astype(np.float64)
+    lines_time += time() - start
+    streaming, streaming_time = run(fixture, NUMERIC_COLUMNS)
+
+    assert lines["p"] == streaming["p"]
+    for key in NUMERIC_COLUMNS:
+        assert np.array_equal(lines[key], streaming[key])
+
+    print(f"line parser + conversion: {lines_time:.2f} s")
+    print(f"streaming parser:         {streaming_time:.2f} s ({lines_time / streaming_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
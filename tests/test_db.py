@@ -0,0 +1,185 @@
+import re
+
+import numpy as np
+import pytest
+
+from threedont.app import db
+from threedont.app.db import SparqlEndpoint
+
+
+def unpack(mask, n):
+    return np.flatnonzero(np.unpackbits(mask, bitorder="little")[:n])
+
+
+@pytest.fixture
+def endpoint():
+    endpoint = SparqlEndpoint("http://graph", "http://localhost:8890")
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-10, 10, (100, 3)).astype(np.float32)
+    colors = np.zeros((100, 3), dtype=np.uint8)
+    iris = [f"<http://3DOntCore#Point_{i}>" for i in range(100)]
+    endpoint.set_points(coords, colors, iris)
+    return endpoint
+
+
+def answer(endpoint, monkeypatch, result):
+    monkeypatch.setattr(endpoint, "_execute_chunked_query", lambda query: result)
+
+
+def coord_columns(endpoint, ids):
+    # as the parsers return them, lists of terms
+    return {
+        key: [str(value) for value in endpoint.coords[ids, axis]]
+        for axis, key in enumerate(("x1", "y1", "z1"))
+    }
+
+
+def test_select_ordinals(endpoint, monkeypatch):
+    queries = []
+
+    def execute(query):
+        queries.append(query)
+        return {"k": ['"50"^^xsd:integer', "3", "7", "1000"]}
+
+    monkeypatch.setattr(endpoint, "_execute_chunked_query", execute)
+    mask = endpoint.execute_select_query("SELECT DISTINCT ?p WHERE { ?p a ?c }")
+    np.testing.assert_array_equal(unpack(mask, 100), [3, 7, 50])
+    assert queries[0].startswith("SELECT DISTINCT (COALESCE(")
+    assert 'STRAFTER(STR(?p), "http://3DOntCore#Point_")' in queries[0]
+    assert queries[0].endswith("AS ?k) WHERE { ?p a ?c }")
+
+
+def test_select_iris(endpoint, monkeypatch):
+    names = [f"<http://3DOntCore#Wall_{i}_north>" for i in range(100)]
+    endpoint.set_points(endpoint.coords, endpoint.colors, names)
+    answer(endpoint, monkeypatch, {"p": [names[9], "<http://other#x>", names[0]]})
+    mask = endpoint.execute_select_query("SELECT ?p WHERE { ?p a ?c }")
+    assert len(mask) == 13
+    np.testing.assert_array_equal(unpack(mask, 100), [0, 9])
+
+
+def test_select_no_points(endpoint, monkeypatch):
+    answer(endpoint, monkeypatch, {"k": ["-1", "-1"]})
+    mask = endpoint.execute_select_query("SELECT ?p WHERE { ?p a ?c }")
+    assert len(mask) == 13 and not mask.any()
+
+
+def test_select_wrong_columns(endpoint, monkeypatch):
+    answer(endpoint, monkeypatch, {"s": ["<http://3DOntCore#Point_1>"]})
+    with pytest.raises(db.WrongResultFormatException):
+        endpoint.execute_select_query("SELECT ?s WHERE { ?s a ?c }")
+
+
+def test_scalar(endpoint, monkeypatch):
+    result = {
+        "s": ["<http://3DOntCore#Point_4>", "<http://other#x>", "<http://3DOntCore#Point_2>"],
+        "x": np.array([10.0, 0.0, 20.0]),
+    }
+    answer(endpoint, monkeypatch, result)
+    scalars = endpoint.execute_scalar_query("")
+    assert scalars.dtype == np.float32 and len(scalars) == 100
+    np.testing.assert_array_equal(scalars[[4, 2]], [10, 20])
+    # the points without a value are below the minimum of the results
+    others = np.setdiff1d(np.arange(100), [2, 4])
+    np.testing.assert_array_equal(scalars[others], -2)
+
+
+def test_nl_select(endpoint, monkeypatch):
+    ids = [3, 50, 7]
+    result = coord_columns(endpoint, ids)
+    result["points1"] = [f"<http://3DOntCore#Point_{i}>" for i in ids]
+    answer(endpoint, monkeypatch, result)
+    mask, query_type = endpoint.autodetect_query_nl("")
+    assert query_type == "select"
+    np.testing.assert_array_equal(unpack(mask, 100), sorted(ids))
+
+
+def test_nl_scalar(endpoint, monkeypatch):
+    ids = [3, 50, 7]
+    result = coord_columns(endpoint, ids)
+    result["grouped_x"] = ['"1.5"^^xsd:decimal', "2", "4"]
+    answer(endpoint, monkeypatch, result)
+    scalars, query_type = endpoint.autodetect_query_nl("")
+    assert query_type == "scalar"
+    assert len(scalars) == 100
+    np.testing.assert_array_equal(scalars[ids], [1.5, 2, 4])
+    others = np.setdiff1d(np.arange(100), ids)
+    assert (scalars[others] < 1.5).all()
+
+
+def test_nl_tabular(endpoint, monkeypatch):
+    result = {"count": ["42"]}
+    answer(endpoint, monkeypatch, result)
+    assert endpoint.autodetect_query_nl("") == (result, "tabular")
+
+
+def test_nl_coordinates_that_are_not_points(endpoint, monkeypatch):
+    result = {"x1": ["1000"], "y1": ["1000"], "z1": ["1000"]}
+    answer(endpoint, monkeypatch, result)
+    assert endpoint.autodetect_query_nl("")[1] == "tabular"
+
+
+class FakeStore:
+    """
+    Answers the queries of get_all from a list of points, the filters on ?p are
+    evaluated like the store would, on the IRIs in their order.
+    """
+
+    def __init__(self, n):
+        self.iris = sorted(f"<http://3DOntCore#Point_{i}>" for i in range(n))
+        self.coords = {iri: float(i) for i, iri in enumerate(self.iris)}
+        self.pages = 0
+
+    def query(self, query):
+        if "COUNT(DISTINCT" in query:
+            return {"count": [f'"{len(self.iris)}"^^xsd:integer']}
+        offset = int(re.search(r"OFFSET (\d+)", query).group(1))
+        return {"p": self.iris[offset:offset + 1]}
+
+    def page(self, query):
+        self.pages += 1
+        rows = self.iris
+        after = re.search(r"\?p > (<[^>]*>)", query)
+        if after:
+            rows = [iri for iri in rows if iri > after.group(1)]
+        until = re.search(r"\?p <= (<[^>]*>)", query)
+        if until:
+            rows = [iri for iri in rows if iri <= until.group(1)]
+        rows = rows[:int(re.search(r"LIMIT (\d+)", query).group(1))]
+        if not rows:
+            return {}
+        values = np.array([self.coords[iri] for iri in rows])
+        results = {"p": rows}
+        for key in ("x", "y", "z", "r", "g", "b"):
+            results[key] = values
+        return results
+
+
+class FakeClient:
+    def __init__(self, store):
+        self.store = store
+
+    def setQuery(self, query):
+        self.query = query
+
+    def queryAndConvert(self):
+        return self.store.page(self.query)
+
+
+@pytest.mark.parametrize("n, workers", [(2500, 4), (3, 4), (1, 1), (1000, 3)])
+def test_get_all_partitions(monkeypatch, n, workers):
+    monkeypatch.setattr(db, "CHUNK_SIZE", 100)
+    store = FakeStore(n)
+    endpoint = SparqlEndpoint(
+        "http://graph", "http://localhost:8890", workers=workers, result_format="tsv"
+    )
+    monkeypatch.setattr(endpoint, "_query", store.query)
+    monkeypatch.setattr(endpoint, "_new_load_client", lambda: FakeClient(store))
+    coords, colors = endpoint.get_all()
+    loaded = [endpoint.iris[i] for i in range(len(endpoint.iris))]
+    assert sorted(loaded) == store.iris
+    np.testing.assert_array_equal(
+        coords[:, 0], [store.coords[iri] for iri in loaded]
+    )
+    # every page but the last of each partition is full
+    assert store.pages <= n // 100 + 2 * workers
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from threedont.app.iri_index import IriIndex
+
+PREFIX = "<http://3DOntCore#"
+
+
+def point_iris(n):
+    return [f"{PREFIX}Point_{i}>" for i in range(n)]
+
+
+def named_iris(n):
+    # local names longer than 8 characters go through the hash
+    return [f"{PREFIX}Wall_{i:x}_{i * 7919 % 1000}_segment>" for i in range(n)]
+
+
+@pytest.mark.parametrize("make_iris", [point_iris, named_iris])
+def test_lookup(make_iris):
+    iris = make_iris(5000)
+    index = IriIndex(iris)
+    assert len(index) == len(iris)
+    order = np.random.default_rng(0).permutation(len(iris))
+    np.testing.assert_array_equal(index.get_ids([iris[i] for i in order]), order)
+    np.testing.assert_array_equal(index.get_ids(np.array([iri.encode() for iri in iris])), np.arange(len(iris)))
+    assert [index[i] for i in range(len(iris))] == iris
+
+
+def test_unknown_iris():
+    index = IriIndex(point_iris(100))
+    unknown = [
+        f"{PREFIX}Point_100>",
+        f"{PREFIX}Point_1000000000000>",
+        "<http://other#Point_1>",
+        "<h>",
+        '"a literal"',
+        "",
+    ]
+    assert (index.get_ids(unknown) == -1).all()
+    assert index.get_ids([]).shape == (0,)
+
+
+def test_duplicates_resolve_to_the_first_id():
+    iris = named_iris(50)
+    index = IriIndex(iris + iris[::-1] + iris)
+    np.testing.assert_array_equal(index.get_ids(iris), np.arange(50))
+
+
+def test_empty_index():
+    index = IriIndex([])
+    assert len(index) == 0
+    assert not index.has_ordinals()
+    assert (index.get_ids(point_iris(3)) == -1).all()
+    assert (index.get_ids_by_ordinal([0, 1]) == -1).all()
+
+
+def test_prefix_keeps_the_first_digits():
+    index = IriIndex([f"{PREFIX}Point_{i}>" for i in range(10, 20)])
+    assert index.prefix == f"{PREFIX}Point_".encode()
+    assert index.get_ordinal_prefix() == "http://3DOntCore#Point_"
+
+
+def test_no_hash_without_collisions(monkeypatch):
+    monkeypatch.setattr(IriIndex, "_has_collisions", lambda self, keys: True)
+    with pytest.raises(ValueError):
+        IriIndex(named_iris(10))
+    # names of up to 8 characters are their own code
+    assert len(IriIndex(point_iris(10))) == 10
+
+
+def test_ordinals():
+    iris = point_iris(1000)
+    order = np.random.default_rng(1).permutation(len(iris))
+    index = IriIndex([iris[i] for i in order])
+    assert index.has_ordinals()
+    ids = index.get_ids_by_ordinal(np.arange(len(iris)))
+    np.testing.assert_array_equal(order[ids], np.arange(len(iris)))
+    assert (index.get_ids_by_ordinal([-1, 1000, 10 ** 17]) == -1).all()
+
+
+def test_duplicate_ordinals_resolve_to_the_first_id():
+    index = IriIndex(point_iris(10) + point_iris(10))
+    np.testing.assert_array_equal(index.get_ids_by_ordinal(np.arange(10)), np.arange(10))
+
+
+@pytest.mark.parametrize("names", [
+    ["Point_1", "Point_07"],  # leading zeros
+    ["Point_1", "Point_1a"],
+    ["Point_1", "Point_" + "9" * 19],  # overflows int64
+])
+def test_not_canonical_ordinals(names):
+    index = IriIndex([PREFIX + name + ">" for name in names])
+    assert not index.has_ordinals()
+    assert (index.get_ids_by_ordinal([1, 7]) == -1).all()
+    np.testing.assert_array_equal(index.get_ids([PREFIX + name + ">" for name in names]), [0, 1])
+
+
+def test_zero_is_an_ordinal():
+    index = IriIndex([f"{PREFIX}Point_{i}>" for i in (0, 5, 10)])
+    assert index.has_ordinals()
+    np.testing.assert_array_equal(index.get_ids_by_ordinal([10, 0, 5]), [2, 0, 1])
+
+
+@pytest.mark.parametrize("make_iris", [point_iris, named_iris])
+def test_arrays_round_trip(make_iris):
+    iris = make_iris(300)
+    index = IriIndex(iris)
+    copy = IriIndex.from_arrays(index.prefix.decode(), index.to_arrays())
+    assert len(copy) == len(index)
+    assert copy.has_ordinals() == index.has_ordinals()
+    np.testing.assert_array_equal(copy.get_ids(iris), np.arange(len(iris)))
+    assert copy[299] == iris[299]
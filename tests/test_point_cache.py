@@ -0,0 +1,91 @@
+import json
+
+import numpy as np
+import pytest
+
+from threedont.app.iri_index import IriIndex
+from threedont.app.state.point_cache import CACHE_VERSION, META_FILE, PointCache
+
+SOURCE = {
+    "graphUri": "http://example.org/graph",
+    "dbUrl": "http://localhost:8890/sparql",
+    "graphNamespace": "http://3DOntCore#",
+}
+
+
+def iris_of(n):
+    return [f"<http://3DOntCore#Point_{i}>" for i in range(n)]
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    coords = rng.uniform(-10, 10, (200, 3)).astype(np.float32)
+    colors = rng.integers(0, 256, (200, 3), dtype=np.uint8)
+    iris = IriIndex(iris_of(200))
+    return coords, colors, iris
+
+
+def test_round_trip(tmp_path, points):
+    coords, colors, iris = points
+    cache = PointCache(tmp_path / "cache")
+    cache.save(SOURCE, "fingerprint", coords, colors, iris)
+
+    assert cache.get_fingerprint(SOURCE) == "fingerprint"
+    loaded_coords, loaded_colors, loaded_iris = cache.load(SOURCE)
+    np.testing.assert_array_equal(loaded_coords, coords)
+    np.testing.assert_array_equal(loaded_colors, colors)
+    assert loaded_colors.dtype == np.uint8
+    assert loaded_iris.has_ordinals()
+    np.testing.assert_array_equal(loaded_iris.get_ids_by_ordinal([5, 199]), [5, 199])
+    assert loaded_iris[42] == "<http://3DOntCore#Point_42>"
+
+
+def test_save_over_a_loaded_cache(tmp_path, points):
+    coords, colors, iris = points
+    cache = PointCache(tmp_path)
+    cache.save(SOURCE, "old", coords, colors, iris)
+    old_coords = cache.load(SOURCE)[0]
+    cache.save(SOURCE, "new", coords[:10] + 1, colors[:10], IriIndex(iris_of(10)))
+    # the memory map of the old file is still valid
+    np.testing.assert_array_equal(old_coords, coords)
+    assert cache.get_fingerprint(SOURCE) == "new"
+    np.testing.assert_array_equal(cache.load(SOURCE)[0], coords[:10] + 1)
+
+
+def test_other_source(tmp_path, points):
+    cache = PointCache(tmp_path)
+    cache.save(SOURCE, "fingerprint", *points)
+    other = dict(SOURCE, graphUri="http://example.org/other")
+    assert cache.load(other) is None
+    assert cache.get_fingerprint(other) is None
+
+
+def test_other_version(tmp_path, points):
+    cache = PointCache(tmp_path)
+    cache.save(SOURCE, "fingerprint", *points)
+    meta_path = tmp_path / META_FILE
+    meta = json.loads(meta_path.read_text())
+    meta["version"] = CACHE_VERSION - 1
+    meta_path.write_text(json.dumps(meta))
+    assert cache.load(SOURCE) is None
+    assert cache.get_fingerprint(SOURCE) is None
+
+
+def test_missing_or_broken_cache(tmp_path, points):
+    cache = PointCache(tmp_path)
+    assert cache.load(SOURCE) is None
+    cache.save(SOURCE, "fingerprint", *points)
+    (tmp_path / "coords.npy").write_bytes(b"not an array")
+    assert cache.load(SOURCE) is None
+    (tmp_path / META_FILE).write_text("{")
+    assert cache.get_fingerprint(SOURCE) is None
+
+
+def test_clear(tmp_path, points):
+    cache = PointCache(tmp_path / "cache")
+    cache.save(SOURCE, "fingerprint", *points)
+    assert cache.get_octree_path().parent == tmp_path / "cache"
+    cache.clear()
+    assert not (tmp_path / "cache").exists()
+    assert cache.load(SOURCE) is None
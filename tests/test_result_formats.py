@@ -0,0 +1,139 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from threedont.app.result_formats import decode_csv, decode_json, decode_tsv, parse_numbers, read_blocks
+
+
+class ChunkedResponse(io.BytesIO):
+    """
+    A response that never returns more than `chunk` bytes per read, like a slow socket.
+    """
+
+    def __init__(self, data, chunk):
+        super().__init__(data)
+        self.chunk = chunk
+
+    def read(self, size=-1):
+        return super().read(self.chunk)
+
+
+def make_tsv(rows):
+    lines = ["?p\t?x\t?y"]
+    for i in range(rows):
+        lines.append(f'<http://3DOntCore#Point_{i}>\t{i * 0.5}\t"{-i}"^^<http://www.w3.org/2001/XMLSchema#decimal>')
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def test_parse_numbers():
+    values = [b"42", b'"2.48e-05"^^xsd:decimal', b"-1"]
+    np.testing.assert_array_equal(parse_numbers(values), [42, 2.48e-05, -1])
+
+
+def test_parse_numbers_unbound():
+    np.testing.assert_array_equal(parse_numbers([b"42", b""]), [42, np.nan])
+    np.testing.assert_array_equal(parse_numbers([b'"1"', b""]), [1, np.nan])
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 7, 64, 1 << 20])
+def test_read_blocks_keeps_lines_whole(chunk):
+    data = make_tsv(20)
+    blocks = list(read_blocks(ChunkedResponse(data, chunk)))
+    assert b"".join(blocks) == data
+    assert all(block.endswith(b"\n") for block in blocks)
+
+
+def test_read_blocks_without_final_newline():
+    data = make_tsv(5).rstrip(b"\n")
+    blocks = list(read_blocks(ChunkedResponse(data, 16)))
+    assert b"".join(blocks) == data
+    assert all(block.endswith(b"\n") for block in blocks[:-1])
+
+
+@pytest.mark.parametrize("chunk", [1, 5, 33, 1 << 20])
+def test_tsv_block_boundaries(chunk):
+    response = ChunkedResponse(make_tsv(50), chunk)
+    results = decode_tsv(response, "utf-8", ("x", "y"), expected_rows=10)
+    assert results["p"] == [f"<http://3DOntCore#Point_{i}>" for i in range(50)]
+    np.testing.assert_array_equal(results["x"], np.arange(50) * 0.5)
+    np.testing.assert_array_equal(results["y"], -np.arange(50))
+
+
+def test_tsv_strings_and_unbound():
+    data = b'?p\t?x\t?l\n<a>\t1\t"one"@en\n<b>\t\t\n'
+    results = decode_tsv(io.BytesIO(data), "utf-8", ("x",))
+    assert results["p"] == ["<a>", "<b>"]
+    np.testing.assert_array_equal(results["x"], [1, np.nan])
+    assert results["l"] == ['"one"@en', ""]
+
+
+def test_tsv_empty():
+    assert decode_tsv(io.BytesIO(b""), "utf-8", ("x",)) == {}
+    assert decode_tsv(io.BytesIO(b"?p\t?x\n"), "utf-8", ("x",)) == {}
+
+
+def test_tsv_malformed():
+    with pytest.raises(ValueError):
+        decode_tsv(io.BytesIO(b"?p\t?x\n<a>\t1\t2\n"), "utf-8")
+
+
+def test_csv():
+    data = b"p,x,l\r\nhttp://a,1,one\r\nhttp://b,2,two\r\n"
+    results = decode_csv(io.BytesIO(data), "utf-8", ("x",), ("p",))
+    assert results["p"] == ["<http://a>", "<http://b>"]
+    np.testing.assert_array_equal(results["x"], [1, 2])
+    assert results["l"] == ["one", "two"]
+
+
+def test_csv_quoted_fields():
+    data = b'p,l\nhttp://a,"a, b"\nhttp://b,"two\nlines"\n'
+    results = decode_csv(io.BytesIO(data), "utf-8", iri_columns=("p",))
+    assert results["p"] == ["<http://a>", "<http://b>"]
+    assert results["l"] == ["a, b", "two\nlines"]
+
+
+def test_csv_empty():
+    assert decode_csv(io.BytesIO(b""), "utf-8") == {}
+    assert decode_csv(io.BytesIO(b"p,x\n"), "utf-8", ("x",)) == {}
+
+
+def test_csv_malformed():
+    with pytest.raises(ValueError):
+        decode_csv(io.BytesIO(b"p,x\na,1,2\n"), "utf-8")
+
+
+def test_json_terms():
+    data = {
+        "head": {"vars": ["s", "x", "l", "b", "unbound"]},
+        "results": {"bindings": [
+            {
+                "s": {"type": "uri", "value": "http://a"},
+                "x": {"type": "literal", "value": "1.5",
+                      "datatype": "http://www.w3.org/2001/XMLSchema#decimal"},
+                "l": {"type": "literal", "value": "one", "xml:lang": "en"},
+                "b": {"type": "bnode", "value": "b0"},
+            },
+            {
+                "s": {"type": "uri", "value": "http://b"},
+                "x": {"type": "typed-literal", "value": "2",
+                      "datatype": "http://www.w3.org/2001/XMLSchema#integer"},
+                "l": {"type": "literal", "value": "two"},
+            },
+        ]},
+    }
+    response = io.BytesIO(json.dumps(data).encode("utf-8"))
+    results = decode_json(response, "utf-8", ("x",))
+    assert results["s"] == ["<http://a>", "<http://b>"]
+    np.testing.assert_array_equal(results["x"], [1.5, 2])
+    assert results["l"] == ['"one"@en', '"two"']
+    assert results["b"] == ["_:b0"]
+    assert "unbound" not in results
+
+
+def test_json_empty():
+    empty = {"head": {"vars": ["s"]}, "results": {"bindings": []}}
+    assert decode_json(io.BytesIO(json.dumps(empty).encode("utf-8")), "utf-8") == {}
+    ask = {"head": {}, "boolean": True}
+    assert decode_json(io.BytesIO(json.dumps(ask).encode("utf-8")), "utf-8") == {}
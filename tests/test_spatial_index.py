@@ -0,0 +1,44 @@
+import numpy as np
+
+from threedont.app.spatial_index import SpatialIndex
+
+
+def random_points(n, seed=0):
+    return np.random.default_rng(seed).uniform(-100, 100, (n, 3)).astype(np.float32)
+
+
+def test_exact_coordinates():
+    points = random_points(10000)
+    index = SpatialIndex(points)
+    order = np.random.default_rng(1).permutation(len(points))
+    np.testing.assert_array_equal(index.get_ids(points[order]), order)
+
+
+def test_within_tolerance():
+    points = random_points(10000)
+    index = SpatialIndex(points)
+    # rounding differences, also across the boundaries of the cells
+    offsets = np.random.default_rng(2).uniform(-0.5, 0.5, points.shape)
+    moved = points + (offsets * index.tolerance).astype(np.float32)
+    np.testing.assert_array_equal(index.get_ids(moved), np.arange(len(points)))
+
+
+def test_outside_tolerance():
+    points = random_points(1000)
+    index = SpatialIndex(points)
+    far = points + np.float32(1.0)
+    assert (index.get_ids(far) == -1).all()
+
+
+def test_closest_point_wins():
+    points = np.array([[0, 0, 0], [1e-6, 0, 0]], dtype=np.float32)
+    index = SpatialIndex(points, tolerance=1e-5)
+    np.testing.assert_array_equal(
+        index.get_ids([[9e-7, 0, 0], [-1e-7, 0, 0]]), [1, 0]
+    )
+
+
+def test_empty():
+    index = SpatialIndex(random_points(10))
+    assert len(index.get_ids(np.empty((0, 3)))) == 0
+    assert (SpatialIndex(np.empty((0, 3))).get_ids([[0, 0, 0]]) == -1).all()
@@ -0,0 +1,105 @@
+import io
+from email.message import Message
+
+import numpy as np
+import pytest
+
+from threedont.app.turtle_parse import QueryResultWithTurtle
+
+NUMERIC_COLUMNS = ("x", "y", "z")
+
+HEADER = b"""@prefix res: <http://www.w3.org/2005/sparql-results#> .
+@prefix rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+_:_ a res:ResultSet .
+_:_ res:resultVariable "p" , "x" , "y" , "z" .
+@prefix ns0:\t<http://3DOntCore#> .
+"""
+
+SOLUTION = (
+    '_:_ res:solution [\n'
+    '      res:binding [ res:variable "p" ; res:value ns0:Point_{i} ] ;\n'
+    '      res:binding [ res:variable "x" ; res:value {x} ] ;\n'
+    '      res:binding [ res:variable "y" ; res:value "{y}"^^xsd:decimal ] ;\n'
+    '      res:binding [ res:variable "z" ; res:value {z} ] ] .\n'
+)
+
+
+class FixtureResponse(io.BytesIO):
+    """
+    A response that returns the first `cut` bytes on the first read, so that
+    the streaming parser sees a block boundary there.
+    """
+
+    def __init__(self, data, cut=None):
+        super().__init__(data)
+        self.cut = cut
+
+    def read(self, size=-1):
+        if self.cut is not None:
+            size, self.cut = self.cut, None
+        return super().read(size)
+
+    def info(self):
+        message = Message()
+        message["Content-Type"] = "text/turtle; charset=UTF-8"
+        return message
+
+
+def make_fixture(rows):
+    body = "".join(
+        SOLUTION.format(i=i, x=i * 0.5, y=-i, z=i + 0.25) for i in range(rows)
+    )
+    return HEADER + body.encode("utf-8")
+
+
+def convert(data, numeric_columns=NUMERIC_COLUMNS, cut=None):
+    response = FixtureResponse(data, cut)
+    return QueryResultWithTurtle((response, "turtle"), numeric_columns).convert()
+
+
+def line_starts(data):
+    return [i + 1 for i, char in enumerate(data) if char == ord("\n")][:-1]
+
+
+def check_points(results, rows):
+    assert results["p"] == [f"<http://3DOntCore#Point_{i}>" for i in range(rows)]
+    np.testing.assert_array_equal(results["x"], np.arange(rows) * 0.5)
+    np.testing.assert_array_equal(results["y"], -np.arange(rows))
+    np.testing.assert_array_equal(results["z"], np.arange(rows) + 0.25)
+
+
+def test_streaming_parser():
+    check_points(convert(make_fixture(10)), 10)
+
+
+def test_line_parser_matches_streaming_parser():
+    fixture = make_fixture(10)
+    lines = convert(fixture, numeric_columns=None)
+    streaming = convert(fixture)
+    assert lines["p"] == streaming["p"]
+    for var in NUMERIC_COLUMNS:
+        np.testing.assert_array_equal(
+            np.array([float(v.strip('"').split('"')[0]) for v in lines[var]]),
+            streaming[var],
+        )
+
+
+@pytest.mark.parametrize("rows", [1, 3])
+def test_every_block_boundary(rows):
+    # the last block can hold fewer bindings than variables
+    fixture = make_fixture(rows)
+    for cut in line_starts(fixture):
+        check_points(convert(fixture, cut=cut), rows)
+
+
+def test_block_boundary_just_before_the_end():
+    fixture = make_fixture(100)
+    cut = fixture.rfind(b"\n", 0, len(fixture) - 30) + 1
+    assert fixture[cut:].count(b"res:binding") == 1
+    check_points(convert(fixture, cut=cut), 100)
+
+
+def test_empty_result():
+    assert convert(HEADER) == {}
+    assert convert(HEADER, numeric_columns=None) == {}
@@ -1,11 +1,13 @@
 import logging
 import sys
 from queue import Queue
+from threading import Thread
 from urllib.error import URLError
 
 from SPARQLWrapper.SPARQLExceptions import QueryBadFormed
 
 from .db import SparqlEndpoint, WrongResultFormatException, EmptyResultSetException
+from .scheduler import CommandScheduler, check_cancelled
 from .viewer import Viewer, get_color_map
 from ..gui import GuiWrapper
 from .state import Project
@@ -22,10 +24,42 @@ __all__ = ["Controller"]
     The commands_pipe will transport function calls from the GUI to the Controller.
     A functions here is a tuple of the form (function_name, args).
     ActionController is just a middleman to help with the transport between the processes, a facade.
+    The event loop hands the calls to a CommandScheduler, see COMMAND_GROUPS.
 """
 
 NUMBER_OF_LABELS_IN_LEGEND = 5
 
+# commands of different groups run concurrently, the ones not listed are
+# in the "default" group and keep running one at a time in order
+COMMAND_GROUPS = {
+    "view_point_details": "interactive",
+    "view_node_details": "interactive",
+    "update_project_list": "interactive",
+    "set_color_scale": "interactive",
+    "select_query": "query",
+    "scalar_query": "query",
+    "scalar_with_predicate": "query",
+    "select_all_subjects": "query",
+    "tabular_query": "query",
+    "natural_language_query": "query",
+    "connect_to_server": "load",
+    "reload_points": "load",
+    "open_project": "load",
+    "create_project": "load",
+}
+# a new query cancels the previous one, new points make every query stale
+SUPERSEDED_GROUPS = {
+    "query": ("query",),
+    "load": ("load", "query"),
+}
+# one worker per group, an interactive command never waits for a free worker
+COMMAND_WORKERS = 4
+
+
+def _hex_to_rgba(color):
+    color = color.lstrip("#")
+    return [int(color[i : i + 2], 16) / 255 for i in (0, 2, 4)] + [1.0]
+
 
 class ActionController:
     def __init__(self, commands_queue, start_func):
@@ -81,6 +115,9 @@ class Controller:
         self.sparql_client = None
         self.Args = cl.Args()
         self.project = None
+        self.point_cache = None
+        self.point_cache_source = None
+        self.scheduler = CommandScheduler(COMMAND_WORKERS, SUPERSEDED_GROUPS)
 
     def stop(self):
         print("Stopping controller...")
@@ -92,54 +129,73 @@ class Controller:
 
     def run_event_loop(self):
         print("Running controller")
-        self.update_project_list()
+        self.submit("update_project_list")
         if self.config.get_general_loadLastProject():
             last_project = self.app_state.get_projectName()
             if last_project and Project.exists(last_project):
-                self.open_project(last_project)
+                self.submit("open_project", last_project)
 
         command = self.commands_queue.get()
         while command is not None:
             function_name, args = command
-            try:
-                getattr(self, function_name)(*args)
-            except Exception:
-                logging.exception(
-                    "Error in controller running function %s", function_name
-                )
-
+            self.submit(function_name, *args)
             command = self.commands_queue.get()
+        self.scheduler.shutdown()
+
+    def submit(self, function_name, *args):
+        """
+        Schedules a command, returns a Future of its result.
+        """
+        group = COMMAND_GROUPS.get(function_name, "default")
+        return self.scheduler.submit(group, getattr(self, function_name), *args)
+
+    def _points_loaded(self):
+        if self.sparql_client is None:
+            print("No connection to server")
+            return False
+        if self.sparql_client.colors is None:
+            self.gui.set_statusbar_content("Points are still loading", 5)
+            return False
+        return True
 
     @report_errors_to_gui
     def select_query(self, query):
         print("Controller: ", query)
-        if self.sparql_client is None:
-            print("No connection to server")
+        if not self._points_loaded():
             return
 
-        colors = self.sparql_client.execute_select_query(query)
-        self.viewer_client.attributes(colors)
+        mask = self.sparql_client.execute_select_query(query)
+        check_cancelled()  # don't show the result of a superseded query
+        self._show_highlight(mask)
+
+    def _show_highlight(self, mask):
+        """
+        Highlights the points of a select on top of their colors.
+        """
+        self.viewer_client.highlight(mask)
         self.viewer_client.set(curr_attribute_id=0)
 
     @report_errors_to_gui
     def scalar_query(self, query):
         print("Controller: ", query)
-        if self.sparql_client is None:
-            print("No connection to server")
+        if not self._points_loaded():
             return
 
         scalars = self.sparql_client.execute_scalar_query(query)
+        check_cancelled()
+        self.viewer_client.highlight()
         self.viewer_client.attributes(self.sparql_client.colors, scalars)
         self.viewer_client.set(curr_attribute_id=1)
         self._send_legend(scalars)
 
     def scalar_with_predicate(self, predicate):
         print("Controller: ", predicate)
-        if self.sparql_client is None:
-            print("No connection to server")
+        if not self._points_loaded():
             return
 
         scalars = self.sparql_client.execute_predicate_query(predicate)
+        check_cancelled()
+        self.viewer_client.highlight()
         self.viewer_client.attributes(self.sparql_client.colors, scalars)
         self.viewer_client.set(curr_attribute_id=1)
         self._send_legend(scalars)
@@ -148,13 +204,49 @@ class Controller:
     def connect_to_server(self, graph_url, db_url, namespace):
         print("Loading all the points... ", graph_url)
         self.gui.set_statusbar_content("Connecting to server...", 5)
-        self.sparql_client = SparqlEndpoint(graph_url, db_url, namespace)
+        self.sparql_client = SparqlEndpoint(
+            graph_url,
+            db_url,
+            namespace,
+            self.config.get_general_loadWorkers(),
+            self.config.get_general_resultFormat(),
+        )
         print("Connected to server")
-        self.gui.set_statusbar_content("Loading points from server...", 60)
-        coords, colors = self.sparql_client.get_all()
-        print("Points received from db")
+        self.point_cache = None
+        if self.project is not None and self.config.get_general_usePointCache():
+            self.point_cache = self.project.get_point_cache()
+        self.point_cache_source = {
+            "graphUri": graph_url,
+            "dbUrl": db_url,
+            "graphNamespace": namespace,
+        }
+
+        # applies to the points loaded next, streamed ones too
+        self.viewer_client.set(
+            quantize_positions=self.config.get_visualizer_quantizePositions(),
+            gpu_point_budget=self.config.get_visualizer_gpuPointBudget(),
+        )
+        octree_path = ""
+        if self.point_cache is not None:
+            octree_path = str(self.point_cache.get_octree_path())
+        self.viewer_client.set(octree_cache=octree_path)
+        cached = None
+        if self.point_cache is not None:
+            cached = self.point_cache.load(self.point_cache_source)
+        if cached is not None:
+            coords, colors, iris = cached
+            self.sparql_client.set_points(coords, colors, iris)
+            print("Points loaded from cache")
+            fingerprint = self.point_cache.get_fingerprint(self.point_cache_source)
+            Thread(
+                target=self._check_point_cache,
+                args=(self.sparql_client, fingerprint),
+                daemon=True,
+            ).start()
+            self.viewer_client.load(coords, colors)
+        else:
+            self._load_points_from_server()
         self.gui.set_statusbar_content("Points loaded", 5)
-        self.viewer_client.load(coords, colors)
         self.viewer_client.set(point_size=0.01)
         #######################################################################################
         # self.Args.graph_uri = url
@@ -169,8 +261,74 @@ class Controller:
         #######################################################################################
         print("Point size is ", self.config.get_visualizer_pointsSize())
         self.viewer_client.set(point_size=self.config.get_visualizer_pointsSize())
+        self.viewer_client.set(
+            highlight_color=_hex_to_rgba(self.config.get_visualizer_highlightColor())
+        )
+
+    def _load_points_from_server(self):
+        """
+        Loads the points from the server and sends them to the viewer, with
+        general.streamPoints the viewer shows every page as soon as it arrives.
+        """
+        self.gui.set_statusbar_content("Loading points from server...", 60)
+        fingerprint = None
+        if self.point_cache is not None:
+            # taken before the points, a change while loading is caught next time
+            fingerprint = self.sparql_client.get_fingerprint()
+        stream = self.config.get_general_streamPoints()
+        if stream:
+            self.viewer_client.clear()
+        coords, colors = self.sparql_client.get_all(
+            self._report_load_progress, self.viewer_client.append if stream else None
+        )
+        print("Points received from db")
+        check_cancelled()
+        if stream:
+            self.viewer_client.append(coords[:0], colors[:0], last=True)
+            # the colors of the pages were compacted one page at a time
+            self.viewer_client.attributes(colors)
+            self.viewer_client.color_map("jet")
+        else:
+            self.viewer_client.load(coords, colors)
+        if self.point_cache is not None:
+            self.point_cache.save(
+                self.point_cache_source,
+                fingerprint,
+                coords,
+                colors,
+                self.sparql_client.iris,
+            )
+        return coords, colors
+
+    def _check_point_cache(self, sparql_client, fingerprint):
+        # runs in a background thread, the reload goes through the commands queue
+        try:
+            current = sparql_client.get_fingerprint()
+        except Exception:
+            logging.exception("Error checking the point cache")
+            return
+        if current != fingerprint and sparql_client is self.sparql_client:
+            print("Point cache is stale: ", fingerprint, current)
+            self.commands_queue.put(("reload_points", ()))
+
+    @report_errors_to_gui
+    def reload_points(self):
+        self._load_points_from_server()
+        self.gui.set_statusbar_content("Points updated from server", 5)
+        self.viewer_client.set(point_size=self.config.get_visualizer_pointsSize())
+
+    def _report_load_progress(self, loaded, total):
+        self.gui.set_statusbar_content(
+            f"Loading points from server... {loaded}/{total}", 60
+        )
 
     def view_point_details(self, id):
+        # while points load the viewer can show points the IRI index doesn't have yet
+        if not self._points_loaded():
+            return
+        if self.scheduler.running("load"):
+            self.gui.set_statusbar_content("Points are still loading", 5)
+            return
         iri = self.sparql_client.get_point_iri(id)
         details = self.sparql_client.get_node_details(iri)
         self.gui.view_node_details(details, iri)
@@ -192,13 +350,16 @@ class Controller:
         smf.command_manual_annotation(self.Args, subject, predicate, obj, author_name)
 
     def select_all_subjects(self, predicate, object):
-        colors = self.sparql_client.select_all_subjects(predicate, object)
-        self.viewer_client.attributes(colors)
-        self.viewer_client.set(curr_attribute_id=0)
+        if not self._points_loaded():
+            return
+        mask = self.sparql_client.select_all_subjects(predicate, object)
+        check_cancelled()
+        self._show_highlight(mask)
 
     @report_errors_to_gui
     def tabular_query(self, query):
         result = self.sparql_client.raw_query(query)
+        check_cancelled()
         header = list(result.keys())
         rows = list(zip(*(result[key] for key in result)))
         self.gui.plot_tabular(header, rows)
@@ -314,18 +475,21 @@ class Controller:
             self.gui,
         )
         query = "\n".join(query)
+        if not self._points_loaded():
+            return
         result, query_type = self.sparql_client.autodetect_query_nl(query)
+        check_cancelled()
         if query_type == "tabular":
             header = list(result.keys())
             rows = list(zip(*(result[key] for key in result)))
             self.gui.plot_tabular(header, rows)
         elif query_type == "scalar":
+            self.viewer_client.highlight()
             self.viewer_client.attributes(self.sparql_client.colors, result)
             self.viewer_client.set(curr_attribute_id=1)
             self._send_legend(result)
         elif query_type == "select":
-            self.viewer_client.attributes(result)
-            self.viewer_client.set(curr_attribute_id=0)
+            self._show_highlight(result)
         else:
             print(
                 "Error, unknown query type: ", query_type
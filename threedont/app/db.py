@@ -1,15 +1,34 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from time import time
 from urllib.parse import urlparse
 
 import numpy as np
-from SPARQLWrapper import TURTLE
+from SPARQLWrapper import CSV, JSON, TSV, TURTLE
 
+from .iri_index import IriIndex
 from .queries import *
+from .result_formats import parse_numbers
+from .scheduler import check_cancelled, current_task
+from .spatial_index import SpatialIndex
 from .turtle_parse import SPARQLWrapperWithTurtle as SPARQLWrapper
 
 TEST_FAST = False  # remove true before commit
 CHUNK_SIZE = 1000000 if not TEST_FAST else 1000
-HIGHLIGHT_COLOR = [1.0, 0.0, 0.0]  # TODO make this a parameter
+LOAD_WORKERS = 4
+NUMERIC_COLUMNS = ("x", "y", "z", "r", "g", "b")
+# coordinates of the points in the results of the natural language queries
+NL_COORD_COLUMNS = ("x1", "y1", "z1")
+IRI_COLUMNS = ("p",)
+# values of general.resultFormat, on equal probe times the first one wins
+RESULT_FORMATS = {"tsv": TSV, "csv": CSV, "json": JSON, "turtle": TURTLE}
+FORMAT_PROBE_ROWS = 20000
+# a SELECT clause that projects only ?p, it can be rewritten to return the point ordinals
+SELECT_POINTS_REGEX = re.compile(
+    r"(\bSELECT\s+(?:DISTINCT\s+|REDUCED\s+)?)\?p(?=\s*(?:FROM|WHERE|\{))",
+    re.IGNORECASE,
+)
 
 
 class WrongResultFormatException(Exception):
@@ -24,8 +43,79 @@ class EmptyResultSetException(Exception):
         super().__init__(message)
 
 
+def _page_filter(cursor, last):
+    # the points after `cursor` up to `last` included, None for no bound. The range
+    # and the cursor are plain comparisons on ?p, so the store can seek to them in its
+    # index instead of scanning the graph for every page
+    bounds = []
+    if cursor is not None:
+        bounds.append(f"?p > {cursor}")
+    if last is not None:
+        bounds.append(f"?p <= {last}")
+    return " && ".join(bounds) or "true"
+
+
+def _merge_pages(pages):
+    # numeric columns are arrays, the others lists of strings
+    results = {}
+    for key in pages[0].keys():
+        columns = [page[key] for page in pages]
+        if isinstance(columns[0], np.ndarray):
+            results[key] = np.concatenate(columns)
+        else:
+            results[key] = [value for column in columns for value in column]
+    return results
+
+
+def _page_points(results):
+    coords = np.array((results["x"], results["y"], results["z"])).T.astype(np.float32)
+    colors = np.array((results["r"], results["g"], results["b"])).T.astype(np.float32)
+    return coords, colors
+
+
+def _compact_colors(colors):
+    # colors are kept as 8 or 16 bit integers, the viewer normalizes them on the
+    # gpu. A single page of a 16 bit cloud can look like 8 bit, the colors of
+    # the whole cloud are compacted again once it's loaded
+    if len(colors) > 0 and colors.max() > 255:
+        return np.clip(np.rint(colors), 0, 65535).astype(np.uint16)  # 16 bit color
+    return np.clip(np.rint(colors), 0, 255).astype(np.uint8)  # 8 bit color
+
+
+def _numeric_column(column):
+    # numeric result columns are arrays with the streaming parsers, lists of terms otherwise
+    if isinstance(column, np.ndarray):
+        return column.astype(np.float32)
+    return parse_numbers("\n".join(column).encode("utf-8").split(b"\n")).astype(
+        np.float32
+    )
+
+
+def _integer_column(column):
+    if isinstance(column, np.ndarray):
+        return column.astype(np.int64)
+    # float64 is exact for the ordinals, they are at most MAX_ORDINAL_DIGITS digits
+    return parse_numbers("\n".join(column).encode("utf-8").split(b"\n")).astype(
+        np.int64
+    )
+
+
+def _literal_value(value):
+    # values in form '"2.48e-05"^^xsd:decimal' or '"42"'
+    if value.startswith('"'):
+        return value.split('"')[1]
+    return value
+
+
 class SparqlEndpoint:
-    def __init__(self, graph_url, db_url, namespace="http://3DOntCore#"):
+    def __init__(
+        self,
+        graph_url,
+        db_url,
+        namespace="http://3DOntCore#",
+        workers=LOAD_WORKERS,
+        result_format="auto",
+    ):
         self.graph = graph_url
         if namespace.endswith("#"):
             self.namespace = namespace
@@ -33,24 +123,103 @@ class SparqlEndpoint:
             self.namespace = namespace + "#"
         # TODO generalize outside of virtuoso
         self.endpoint = db_url + "/sparql"
-        self.sparql = SPARQLWrapper(self.endpoint)
-        self.sparql.setReturnFormat(
-            TURTLE
-        )  # works with virtuoso even if the header sent is accept */* (RuntimeWarning)
-        self.iri_to_id = {}
-        self.coords_to_id = {}
-        self.id_to_iri = []
+        self.workers = workers
+        # load_format is used for the points, query_format for everything else
+        self.result_format = result_format
+        self.load_format = TURTLE
+        self.query_format = TURTLE
+        if result_format != "auto":
+            self.set_result_format(result_format)
+        self.iris = IriIndex()
+        self.coords = None
+        self._spatial_index = None
         self.colors = None
 
+    def _new_client(self, result_format=None):
+        client = SPARQLWrapper(self.endpoint)
+        client.setReturnFormat(
+            result_format or self.query_format
+        )  # turtle works with virtuoso even if the header sent is accept */* (RuntimeWarning)
+        return client
+
+    def _new_load_client(self, result_format=None):
+        client = self._new_client(result_format or self.load_format)
+        client.setNumericColumns(NUMERIC_COLUMNS, CHUNK_SIZE, IRI_COLUMNS)
+        return client
+
+    def set_result_format(self, name):
+        if name not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format: {name}")
+        self.result_format = name
+        self.load_format = RESULT_FORMATS[name]
+        # CSV doesn't tell IRIs from literals, it's only good for the points
+        self.query_format = self.load_format if self.load_format != CSV else TURTLE
+
+    def probe_result_formats(self):
+        """
+        Times a page of the points in every result format, unsupported formats are None.
+        """
+        query = SELECT_ALL_PARTITION_QUERY.format(
+            graph=self.graph,
+            namespace=self.namespace,
+            filter="true",
+            limit=FORMAT_PROBE_ROWS,
+        )
+        # run it once before timing, so that the first format doesn't pay for a cold cache
+        warm_up = self._new_client(TURTLE)
+        warm_up.setQuery(query)
+        warm_up.query().convert()
+
+        timings = {}
+        for name, result_format in RESULT_FORMATS.items():
+            client = self._new_load_client(result_format)
+            client.setQuery(query)
+            start = time()
+            try:
+                result = client.query()
+                if result._get_responseFormat() != result_format:
+                    raise WrongResultFormatException(
+                        result_format, result._get_responseFormat()
+                    )
+                result.convert()
+            except Exception as e:
+                print(f"Result format {name} not supported: {e}")
+                timings[name] = None
+                continue
+            timings[name] = time() - start
+        return timings
+
+    def negotiate_result_format(self):
+        timings = self.probe_result_formats()
+        print("Result format timings: ", timings)
+        supported = {name: t for name, t in timings.items() if t is not None}
+        if not supported:
+            print("No result format could be probed, falling back to turtle")
+            self.set_result_format("turtle")
+            return self.result_format
+
+        self.set_result_format(min(supported, key=supported.get))
+        typed = {name: t for name, t in supported.items() if name != "csv"}
+        if typed:
+            self.query_format = RESULT_FORMATS[min(typed, key=typed.get)]
+        return self.result_format
+
+    def _query(self, query):
+        # a client per query, the commands of the controller run concurrently
+        # and SPARQLWrapper is not thread safe
+        client = self._new_client()
+        client.setQuery(query)
+        return client.queryAndConvert()
+
     def _execute_chunked_query(self, query):
         offset = 0
         all_results = {}
         while True:
+            check_cancelled()
             chunked_query = (
                 query + " OFFSET " + str(offset) + " LIMIT " + str(CHUNK_SIZE)
             )
-            self.sparql.setQuery(chunked_query)
-            results = self.sparql.queryAndConvert()
+            results = self._query(chunked_query)
             for key in results.keys():
                 if key not in all_results:
                     all_results[key] = []
@@ -68,79 +237,213 @@ class SparqlEndpoint:
             offset += CHUNK_SIZE
         return all_results
 
-    def get_all(self):
-        query = SELECT_ALL_QUERY.format(graph=self.graph, namespace=self.namespace)
+    def _partition_bounds(self, total):
+        """
+        Splits the points in `self.workers` ranges of about the same size, returns
+        the (first, last) IRIs of every range, first excluded and last included,
+        None where the range is open.
+        """
+        bounds = []
+        for k in range(1, self.workers):
+            results = self._query(
+                PARTITION_BOUND_QUERY.format(
+                    graph=self.graph,
+                    namespace=self.namespace,
+                    offset=total * k // self.workers,
+                )
+            )
+            if "p" in results and results["p"]:
+                bounds.append(results["p"][0])
+        bounds = list(dict.fromkeys(bounds))  # few points, the same bound twice
+        return list(zip([None] + bounds, bounds + [None]))
+
+    def _fetch_partition(self, first, last, on_page):
+        # every worker needs its own client, SPARQLWrapper is not thread safe
+        client = self._new_load_client()
+        cursor = first
+        while True:
+            query = SELECT_ALL_PARTITION_QUERY.format(
+                graph=self.graph,
+                namespace=self.namespace,
+                filter=_page_filter(cursor, last),
+                limit=CHUNK_SIZE,
+            )
+            client.setQuery(query)
+            results = client.queryAndConvert()
+            if len(results) == 0:
+                break  # empty partition or exact multiple of CHUNK_SIZE
+
+            on_page(results)
+            page_size = len(results["p"])
+            if page_size < CHUNK_SIZE or TEST_FAST:
+                break
+            cursor = results["p"][-1]
+
+    def count_points(self):
+        query = COUNT_POINTS_QUERY.format(graph=self.graph, namespace=self.namespace)
+        results = self._query(query)
+        if "count" not in results:
+            raise WrongResultFormatException(["count"], list(results.keys()))
+        return int(_literal_value(results["count"][0]))
+
+    def get_fingerprint(self):
+        results = self._query(
+            POINTS_FINGERPRINT_QUERY.format(graph=self.graph, namespace=self.namespace)
+        )
+        if "count" not in results:
+            raise WrongResultFormatException(["count"], list(results.keys()))
+        return _literal_value(results["count"][0])
+
+    def get_all(self, progress=None, on_points=None):
+        """
+        Loads all the points of the graph, the points are split in `self.workers`
+        ranges of IRIs that are fetched concurrently, each one page by page with a
+        keyset cursor on ?p.
+        `progress` is called with (loaded, total) every time a page is received,
+        `on_points` with the (coords, colors) of the page, the pages are in the same
+        order as the returned points.
+        When called by a scheduled command, a cancellation stops every partition
+        at its next page.
+        """
+        if self.result_format == "auto":
+            self.negotiate_result_format()
         start = time()
-        results = self._execute_chunked_query(query)
+        total = self.count_points()
+        loaded = 0
+        pages = []
+        lock = Lock()
+        # the partitions run in other threads, they check the task of this one
+        task = current_task()
+
+        def on_page(results):
+            nonlocal loaded
+            if task is not None:
+                task.check()
+            with lock:
+                pages.append(results)
+                loaded += len(results["p"])
+                if on_points is not None:
+                    coords, colors = _page_points(results)
+                    on_points(coords, _compact_colors(colors))
+                if progress is not None:
+                    progress(loaded, total)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._fetch_partition, first, last, on_page)
+                for first, last in self._partition_bounds(total)
+            ]
+            for future in futures:
+                future.result()
+
+        if len(pages) == 0:
+            raise EmptyResultSetException(SELECT_ALL_PARTITION_QUERY)
+        results = _merge_pages(pages)
         print("Time to query: ", time() - start)
         start = time()
 
-        # fix values in form '"2.48e-05"^^xsd:decimal'
-        for k, v in results.items():
-            for i, x in enumerate(v):
-                if x.endswith("^^xsd:decimal"):
-                    v[i] = x.split('"')[1]
-
-        coords = np.array((results["x"], results["y"], results["z"])).T.astype(
-            np.float32
-        )
-        colors = np.array((results["r"], results["g"], results["b"])).T.astype(
-            np.float32
-        )
-        self.iri_to_id = {p: i for i, p in enumerate(results["p"])}
-        self.coords_to_id = {tuple(c): i for i, c in enumerate(coords)}
-        self.id_to_iri = results["p"]
-
-        if colors.max() > 255:
-            colors = colors / (1 << 16)  # 16 bit color
-        else:
-            colors = colors / (1 << 8)  # 8 bit color
-        self.colors = colors
+        coords, colors = _page_points(results)
+        colors = _compact_colors(colors)
+        self.set_points(coords, colors, results["p"])
         print("Time to process query result: ", time() - start)
         return coords, colors
 
-    # returns the colors with highlighted points
-    def execute_select_query(self, query):
-        results = self._execute_chunked_query(query)
+    def set_points(self, coords, colors, iris):
+        """
+        Uses points that were already loaded, e.g. from the project cache.
+        `colors` are uint8 or uint16 colors, or floats between 0 and 1, `iris` is
+        a list of IRIs or an IriIndex.
+        """
+        self.iris = iris if isinstance(iris, IriIndex) else IriIndex(iris)
+        self.coords = coords
+        self._spatial_index = None  # built by the first query that needs it
+        self.colors = colors
+
+    def _map_coords_to_point_ids(self, coords, values=None):
+        """
+        Like `_map_to_point_ids`, for results that identify the points by their coordinates.
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.coords)
+        ids = self._spatial_index.get_ids(coords)
+        found = ids >= 0
+        if values is None:
+            return ids[found]
+        return ids[found], values[found]
+
+    def _map_to_point_ids(self, iris, values=None):
+        """
+        Resolves a result column of IRIs to point ids in one pass, the rows that are
+        not points (not all the results of a select are points) are dropped together
+        with the matching `values`.
+        """
+        ids = self.iris.get_ids(iris)
+        found = ids >= 0
+        if values is None:
+            return ids[found]
+        return ids[found], values[found]
+
+    def _select_point_ids(self, query):
+        """
+        Runs a select query and returns the ids of the selected points. When the
+        points have ordinals, the server returns them instead of the whole IRIs.
+        """
+        if self.iris.has_ordinals():
+            projection = POINT_ORDINAL_PROJECTION.format(
+                prefix=self.iris.get_ordinal_prefix()
+            )
+            ordinal_query, replaced = SELECT_POINTS_REGEX.subn(
+                lambda match: match.group(1) + projection, query, count=1
+            )
+            if replaced:
+                results = self._execute_chunked_query(ordinal_query)
+                if not "k" in results:
+                    raise WrongResultFormatException(["k"], list(results.keys()))
+                ids = self.iris.get_ids_by_ordinal(_integer_column(results["k"]))
+                return ids[ids >= 0]
 
-        colors = np.copy(self.colors)
+        results = self._execute_chunked_query(query)
         if not "p" in results:
             raise WrongResultFormatException(["p"], list(results.keys()))
-
-        for p in results["p"]:
-            try:
-                i = self.iri_to_id[p]
-            except KeyError:
-                continue  # not all the results of a select are points
-            colors[i] = HIGHLIGHT_COLOR
-
-        return colors
+        return self._map_to_point_ids(results["p"])
+
+    def _highlight_mask(self, ids):
+        """
+        Returns the points in `ids` as a bitset, one bit per point packed with
+        np.packbits in little bit order, see Viewer.highlight.
+        """
+        mask = np.zeros(len(self.colors), dtype=bool)
+        mask[ids] = True
+        return np.packbits(mask, bitorder="little")
+
+    # returns the highlight mask of the selected points
+    def execute_select_query(self, query):
+        return self._highlight_mask(self._select_point_ids(query))
 
     def execute_scalar_query(self, query):
         results = self._execute_chunked_query(query)
         if not "s" in results or not "x" in results:
             raise WrongResultFormatException(["s", "x"], list(results.keys()))
 
-        minimum = float(min(results["x"]))
-        maximum = float(max(results["x"]))
+        values = _numeric_column(results["x"])
+        minimum = float(values.min())
+        maximum = float(values.max())
         # print(minimum, maximum)
         default = minimum - (maximum - minimum) / 10
         # scalars = np.empty(len(self.colors), dtype=np.float32)
         scalars = np.full(len(self.colors), default, dtype=np.float32)
-        for subject, scalar in zip(results["s"], results["x"]):
-            i = self.iri_to_id[subject]
-            scalars[i] = scalar
+        ids, values = self._map_to_point_ids(results["s"], values)
+        scalars[ids] = values
         return scalars
 
     def get_point_iri(self, point_id):
-        return self.id_to_iri[point_id]
+        return self.iris[point_id]
 
     def get_node_details(self, iri):
         query = GET_NODE_DETAILS.format(
             graph=self.graph, point=iri, namespace=self.namespace
         )
-        self.sparql.setQuery(query)
-        results = self.sparql.queryAndConvert()
+        results = self._query(query)
 
         if "p" not in results or "o" not in results:
             # assume empty result
@@ -164,8 +467,9 @@ class SparqlEndpoint:
             object=object,
             namespace=self.namespace,
         )
-        self.sparql.setQuery(query)
-        self.sparql.query()
+        client = self._new_client()
+        client.setQuery(query)
+        client.query()
 
     def select_all_subjects(self, predicate, object):
         query = SELECT_ALL_WITH_PREDICATE.format(
@@ -174,48 +478,45 @@ class SparqlEndpoint:
             object=object,
             namespace=self.namespace,
         )
-        iris = self._execute_chunked_query(query)["p"]
-        colors = np.copy(self.colors)
-        for p in iris:
-            try:
-                i = self.iri_to_id[p]
-            except KeyError:
-                continue  # not all the results of a select are points
-            colors[i] = [1.0, 0.0, 0.0]
-        return colors
+        return self._highlight_mask(self._select_point_ids(query))
 
     def raw_query(self, query):
         return self._execute_chunked_query(query)
 
     def autodetect_query_nl(self, query):
-        # TODO refactor
+        """
+        Runs a query generated from natural language, the points in the results are
+        identified by their coordinates x1, y1, z1. Results without other numeric
+        columns are a selection, results with one more numeric column are the scalars
+        of the points, everything else is a table.
+        """
         result = self._execute_chunked_query(query)
-        columns = list(result.keys())
-        if "x1" in columns and "y1" in columns and "z1" in columns:
-            # select query
-            colors = np.copy(self.colors)
-            coords = np.array((result["x1"], result["y1"], result["z1"])).T.astype(
-                np.float32
-            )
-            for coord in coords:
-                try:
-                    i = self.coords_to_id[tuple(coord)]
-                except KeyError:
-                    continue  # not all the results of a select are points
-                colors[i] = [1.0, 0.0, 0.0]
-                return colors, "select"
-
-        if "x1" in columns and "y1" in columns and "z1" in columns:
-            minimum = float(min(result["x1"]))
-            maximum = float(max(result["x1"]))
-            default = minimum - (maximum - minimum) / 10
-            scalars = np.full(len(self.colors), default, dtype=np.float32)
-            coords = np.array((result["x1"], result["y1"], result["z1"])).T.astype(
-                np.float32
-            )
-            for coord, scalar in zip(coords, result["x1"]):
-                i = self.coords_to_id[tuple(coord)]
-                scalars[i] = scalar
-            return scalars, "scalar"
-
-        return result, "tabular"
+        if not all(key in result for key in NL_COORD_COLUMNS):
+            return result, "tabular"
+        coords = np.array([_numeric_column(result[key]) for key in NL_COORD_COLUMNS]).T
+        numeric = {}
+        for key in result.keys():
+            if key in NL_COORD_COLUMNS:
+                continue
+            try:
+                numeric[key] = _numeric_column(result[key])
+            except ValueError:
+                continue  # IRIs and strings, e.g. the points themselves
+
+        if len(numeric) == 0:
+            ids = self._map_coords_to_point_ids(coords)
+            if len(ids) == 0:
+                return result, "tabular"  # not points
+            return self._highlight_mask(ids), "select"
+        if len(numeric) > 1:
+            return result, "tabular"
+
+        ids, values = self._map_coords_to_point_ids(coords, next(iter(numeric.values())))
+        if len(ids) == 0:
+            return result, "tabular"
+        minimum = float(values.min())
+        maximum = float(values.max())
+        default = minimum - (maximum - minimum) / 10
+        scalars = np.full(len(self.colors), default, dtype=np.float32)
+        scalars[ids] = values
+        return scalars, "scalar"
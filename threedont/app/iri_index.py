@@ -0,0 +1,221 @@
+import os
+
+import numpy as np
+
+__all__ = ['IriIndex']
+
+FNV_OFFSET = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+# longer numbers could overflow int64
+MAX_ORDINAL_DIGITS = 18
+# seeds tried before giving up on a hash without collisions
+MAX_HASH_SEEDS = 16
+
+
+class IriIndex:
+    """
+    Compact store of the IRIs of the points, the id of a point is its position.
+    An IRI listed more than once resolves to its first id.
+    The common prefix of the IRIs is kept once, the rest (local names) is packed in
+    a single bytes buffer with offsets. Lookups go through a sorted array of uint64
+    codes of the local names, so a whole column of IRIs is resolved with one
+    np.searchsorted. IRIs are in the form used by the parsers, enclosed in angle brackets.
+
+    When all the local names are decimal numbers in canonical form, without leading
+    zeros (e.g. <http://3DOntCore#Point_42>), the numbers are the ordinals of the
+    points, queries can return them instead of the IRIs, see `has_ordinals`.
+    """
+
+    def __init__(self, iris=None):
+        self.prefix = b""
+        self._buffer = np.empty(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        # width of the local names in the lookup arrays and seed of the hash
+        self._params = np.zeros(2, dtype=np.int64)
+        self._codes = np.empty(0, dtype=np.uint64)
+        self._order = np.empty(0, dtype=np.int64)
+        self._keys = np.empty((0, 0), dtype=np.uint8)
+        # sorted ordinals and the ids they belong to, empty if the IRIs have none
+        self._ordinals = np.empty(0, dtype=np.int64)
+        self._ordinal_order = np.empty(0, dtype=np.int64)
+        if iris is not None and len(iris) > 0:
+            self._build(iris)
+
+    def _build(self, iris):
+        # the prefix never takes a whole IRI, so that no local name is empty, nor
+        # the first digits of a number, so that the local names are the ordinals
+        prefix = os.path.commonprefix([min(iris), max(iris)])
+        prefix = prefix[:min(map(len, iris)) - 1].rstrip("0123456789")
+        self.prefix = prefix.encode("utf-8")
+
+        column = "\n".join(iris).encode("utf-8")
+        column = column[len(self.prefix):].replace(b"\n" + self.prefix, b"\n")
+        names = column.split(b"\n")
+
+        lengths = np.fromiter(map(len, names), dtype=np.int64, count=len(names))
+        self._offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self._offsets[1:])
+        self._buffer = np.frombuffer(column.replace(b"\n", b""), dtype=np.uint8)
+
+        keys = np.array(names)
+        width = keys.dtype.itemsize
+        keys = keys.view(np.uint8).reshape(len(names), width)
+        for seed in range(MAX_HASH_SEEDS):
+            self._params = np.array([width, seed], dtype=np.int64)
+            codes = self._encode(keys)
+            self._order = np.argsort(codes, kind="stable")
+            self._codes = codes[self._order]
+            if width <= 8 or not self._has_collisions(keys[self._order]):
+                break
+        else:
+            raise ValueError(f"No collision free hash of the IRIs in {MAX_HASH_SEEDS} seeds")
+        # short names are their own code, longer ones need the names to check the hash
+        self._keys = keys[self._order] if width > 8 else np.empty((0, 0), dtype=np.uint8)
+        self._build_ordinals(keys, lengths)
+
+    def _has_collisions(self, keys):
+        # keys in the order of the codes. The same IRI can be there more than once,
+        # only different names with the same code are a collision
+        same = np.flatnonzero(self._codes[1:] == self._codes[:-1])
+        return (keys[same] != keys[same + 1]).any()
+
+    def _build_ordinals(self, keys, lengths):
+        # the local names end with the '>' of the IRI, the rest must be digits
+        if keys.shape[1] - 1 > MAX_ORDINAL_DIGITS or (lengths < 2).any():
+            return
+        if (keys[np.arange(len(keys)), lengths - 1] != ord(">")).any():
+            return
+        ordinals = np.zeros(len(keys), dtype=np.int64)
+        for i in range(keys.shape[1] - 1):
+            rows = np.flatnonzero(lengths - 1 > i)
+            digits = keys[rows, i].astype(np.int64) - ord("0")
+            if ((digits < 0) | (digits > 9)).any():
+                return
+            ordinals[rows] = ordinals[rows] * 10 + digits
+        if ((keys[:, 0] == ord("0")) & (lengths > 2)).any():
+            return  # leading zeros, Point_07 isn't the ordinal 7
+        # equal ordinals are the same IRI, the stable sort resolves it to its first id
+        order = np.argsort(ordinals, kind="stable")
+        ordinals = ordinals[order]
+        self._ordinals = ordinals
+        self._ordinal_order = order
+
+    def _encode(self, names):
+        # names is a (n, width) array of characters padded with zeros
+        width, seed = self._params
+        if width <= 8:
+            padded = np.zeros((len(names), 8), dtype=np.uint8)
+            padded[:, :width] = names
+            return padded.view(">u8").ravel().astype(np.uint64)
+        codes = np.full(len(names), FNV_OFFSET ^ np.uint64(seed), dtype=np.uint64)
+        for i in range(width):
+            codes ^= names[:, i]
+            codes *= FNV_PRIME
+        return codes
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, point_id):
+        start, end = self._offsets[point_id], self._offsets[point_id + 1]
+        return (self.prefix + self._buffer[start:end].tobytes()).decode("utf-8")
+
+    def get_ids(self, iris):
+        """
+        Vectorized lookup, returns the ids of `iris` as an int64 array,
+        -1 where the IRI is not a point.
+        """
+        ids = np.full(len(iris), -1, dtype=np.int64)
+        if len(iris) == 0 or len(self) == 0:
+            return ids
+
+        iris = self._to_bytes(iris)
+        iri_width = iris.dtype.itemsize
+        if iri_width <= len(self.prefix):
+            return ids
+
+        # strip the prefix working on the raw characters of the fixed width strings
+        chars = iris.view(np.uint8).reshape(len(iris), iri_width)
+        prefix = np.frombuffer(self.prefix, dtype=np.uint8)
+        rows = np.flatnonzero((chars[:, :len(self.prefix)] == prefix).all(axis=1))
+        names = chars[rows, len(self.prefix):]
+
+        # bring the names to the width of the index, longer ones can't be points
+        width = self._params[0]
+        if names.shape[1] > width:
+            fits = ~names[:, width:].any(axis=1)
+            rows, names = rows[fits], names[fits, :width]
+        elif names.shape[1] < width:
+            names = np.pad(names, ((0, 0), (0, width - names.shape[1])))
+
+        codes = self._encode(names)
+        # sorted queries keep the binary searches cache friendly
+        order = np.argsort(codes)
+        codes, rows, names = codes[order], rows[order], names[order]
+        positions = np.searchsorted(self._codes, codes)
+        positions[positions == len(self._codes)] = 0
+        found = self._codes[positions] == codes
+        if width > 8:
+            found &= (self._keys[positions] == names).all(axis=1)
+        ids[rows[found]] = self._order[positions[found]]
+        return ids
+
+    def has_ordinals(self):
+        return len(self) > 0 and len(self._ordinals) == len(self)
+
+    def get_ordinal_prefix(self):
+        """
+        The part of the IRIs before the ordinal, without the angle bracket,
+        i.e. what to strip from STR(?p) in a query.
+        """
+        return self.prefix[1:].decode("utf-8")
+
+    def get_ids_by_ordinal(self, ordinals):
+        """
+        Like `get_ids` for an array of ordinals.
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        ids = np.full(len(ordinals), -1, dtype=np.int64)
+        if len(ordinals) == 0 or not self.has_ordinals():
+            return ids
+        positions = np.searchsorted(self._ordinals, ordinals)
+        positions[positions == len(self._ordinals)] = 0
+        found = self._ordinals[positions] == ordinals
+        ids[found] = self._ordinal_order[positions[found]]
+        return ids
+
+    @staticmethod
+    def _to_bytes(iris):
+        if isinstance(iris, np.ndarray) and iris.dtype.kind == "S":
+            return iris
+        # IRIs can't contain newlines, one split is much faster than encoding them one by one
+        return np.array("\n".join(iris).encode("utf-8").split(b"\n"))
+
+    def to_arrays(self):
+        return {
+            "buffer": self._buffer,
+            "offsets": self._offsets,
+            "params": self._params,
+            "codes": self._codes,
+            "order": self._order,
+            "keys": self._keys,
+            "ordinals": self._ordinals,
+            "ordinal_order": self._ordinal_order,
+        }
+
+    @classmethod
+    def from_arrays(cls, prefix, arrays):
+        """
+        Inverse of `to_arrays`, the arrays can be memory mapped.
+        """
+        index = cls()
+        index.prefix = prefix.encode("utf-8")
+        index._buffer = arrays["buffer"]
+        index._offsets = arrays["offsets"]
+        index._params = np.asarray(arrays["params"])
+        index._codes = arrays["codes"]
+        index._order = arrays["order"]
+        index._keys = arrays["keys"]
+        index._ordinals = arrays["ordinals"]
+        index._ordinal_order = arrays["ordinal_order"]
+        return index
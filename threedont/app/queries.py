@@ -20,6 +20,71 @@ WHERE {{
 }}
 """
 
+# one page of a partition of the points, a range of ?p walked with a keyset cursor,
+# see _page_filter. The rows are grouped by ?p, so that a point is never split
+# between two pages
+SELECT_ALL_PARTITION_QUERY = """
+PREFIX base:<{namespace}>
+PREFIX rdf:<http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs:<http://www.w3.org/2000/01/rdf-schema#>
+
+SELECT ?p
+       (SAMPLE(?px) AS ?x)
+       (SAMPLE(?py) AS ?y)
+       (SAMPLE(?pz) AS ?z)
+       (COALESCE(SAMPLE(?pr), 0) AS ?r)
+       (COALESCE(SAMPLE(?pg), 0) AS ?g)
+       (COALESCE(SAMPLE(?pb), 0) AS ?b)
+FROM <{graph}>
+WHERE {{
+    ?p base:X ?px;
+        base:Y ?py;
+        base:Z ?pz.
+    OPTIONAL {{
+        ?p base:R ?pr.
+        ?p base:G ?pg.
+        ?p base:B ?pb.
+    }}
+    FILTER ({filter})
+}}
+GROUP BY ?p
+ORDER BY ?p
+LIMIT {limit}
+"""
+
+# the point at `offset` in the order of the pages, the bound between two partitions
+PARTITION_BOUND_QUERY = """
+PREFIX base:<{namespace}>
+SELECT DISTINCT ?p
+FROM <{graph}>
+WHERE {{
+    ?p base:X ?x.
+}}
+ORDER BY ?p
+OFFSET {offset}
+LIMIT 1
+"""
+
+COUNT_POINTS_QUERY = """
+PREFIX base:<{namespace}>
+SELECT (COUNT(DISTINCT ?p) AS ?count)
+FROM <{graph}>
+WHERE {{
+    ?p base:X ?x.
+}}
+"""
+
+# cheap marker of the points in the graph, it changes when points are added or removed
+POINTS_FINGERPRINT_QUERY = """
+PREFIX base:<{namespace}>
+SELECT (COUNT(*) AS ?count)
+FROM <{graph}>
+WHERE {{
+    VALUES ?predicate {{ base:X base:Y base:Z base:R base:G base:B }}
+    ?p ?predicate ?o.
+}}
+"""
+
 PREDICATE_QUERY = """
 PREFIX base:<{namespace}>
 PREFIX rdf:<http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -31,6 +96,15 @@ WHERE {{
 }}
 """
 
+# replaces ?p in the SELECT clause of a select query, the point is returned as its
+# ordinal (see IriIndex.has_ordinals), -1 for the results that are not points.
+# Only the canonical form of a number is an ordinal, not Point_07 nor Point_+7
+POINT_ORDINAL_PROJECTION = """(COALESCE(IF(
+    STRSTARTS(STR(?p), "{prefix}")
+        && STR(<http://www.w3.org/2001/XMLSchema#integer>(STRAFTER(STR(?p), "{prefix}"))) = STRAFTER(STR(?p), "{prefix}"),
+    <http://www.w3.org/2001/XMLSchema#integer>(STRAFTER(STR(?p), "{prefix}")),
+    -1), -1) AS ?k)"""
+
 # get all the predicates and objects of a point, given its id
 GET_NODE_DETAILS = """
 PREFIX base:<{namespace}>
@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import re
+from itertools import islice
+
+import numpy as np
+
+__all__ = ['decode_tsv', 'decode_csv', 'decode_json']
+
+BLOCK_SIZE = 1 << 22  # 4 MiB
+CSV_BLOCK_ROWS = 100000
+LITERAL_VALUE_REGEX = re.compile(rb"^\"?([^\"\n]*)", re.MULTILINE)
+
+
+class NumericColumn:
+    """
+    Growable float64 buffer, values are written in place block by block.
+    """
+
+    def __init__(self, capacity):
+        self.data = np.empty(max(capacity, 1), dtype=np.float64)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.empty(max(end, 2 * len(self.data)), dtype=np.float64)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def array(self):
+        return self.data[:self.size]
+
+
+def read_blocks(response, size=BLOCK_SIZE):
+    """
+    Yields the response in blocks of about `size` bytes, a line is never split between two blocks.
+    """
+    tail = b""
+    while True:
+        block = response.read(size)
+        if not block:
+            break
+        block = tail + block
+        cut = block.rfind(b"\n") + 1
+        tail = block[cut:]
+        if cut:
+            yield block[:cut]
+    if tail:
+        yield tail
+
+
+def to_float64(values):
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        # unbound values are empty strings
+        return np.array([value or "nan" for value in values], dtype=np.float64)
+
+
+def parse_numbers(values):
+    # values in form b'42' or b'"2.48e-05"^^xsd:decimal'
+    column = b"\n".join(values)
+    if b'"' in column:
+        values = LITERAL_VALUE_REGEX.findall(column)
+    return to_float64(values)
+
+
+def decode_tsv(response, encoding, numeric_columns=(), expected_rows=0):
+    """
+    SPARQL 1.1 TSV results. The terms are in Turtle syntax, so the columns are the
+    same as the ones returned by the Turtle parser.
+    """
+    header = response.readline().strip()
+    if not header:
+        return {}
+    variables = [var.strip().lstrip(b"?$").decode(encoding) for var in header.split(b"\t")]
+    numeric = {var: NumericColumn(expected_rows) for var in variables if var in numeric_columns}
+    strings = {var: [] for var in variables if var not in numeric}
+
+    for block in read_blocks(response):
+        # tabs and newlines inside the terms are escaped, a whole block can be split at once
+        rows = block.replace(b"\r", b"").strip(b"\n")
+        if not rows:
+            continue
+        fields = rows.replace(b"\n", b"\t").split(b"\t")
+        if len(fields) % len(variables) != 0:
+            raise ValueError(f"Malformed TSV result, expected {len(variables)} values per row")
+
+        for i, var in enumerate(variables):
+            column = fields[i::len(variables)]
+            if var in numeric:
+                numeric[var].extend(parse_numbers(column))
+            else:
+                strings[var].extend(b"\n".join(column).decode(encoding).split("\n"))
+
+    out = {}
+    for var in variables:
+        if var in numeric:
+            if numeric[var].size:
+                out[var] = numeric[var].array()
+        elif any(strings[var]):
+            out[var] = strings[var]
+    return out
+
+
+def decode_csv(response, encoding, numeric_columns=(), iri_columns=()):
+    """
+    SPARQL 1.1 CSV results. CSV doesn't keep the type of the terms: the columns in
+    `iri_columns` are enclosed in angle brackets like in the other formats, the
+    others are plain lexical values.
+    """
+    data = response.read().decode(encoding)
+    header, _, body = data.partition("\n")
+    if not header.strip():
+        return {}
+    variables = header.strip().split(",")
+
+    if '"' in body:
+        # quoted fields can contain commas and newlines, leave them to the csv module
+        reader = csv.reader(io.StringIO(body, newline=""))
+        columns = [[] for _ in variables]
+        while True:
+            rows = list(islice(reader, CSV_BLOCK_ROWS))
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+    else:
+        body = body.replace("\r", "").strip("\n")
+        fields = body.replace("\n", ",").split(",") if body else []
+        if len(fields) % len(variables) != 0:
+            raise ValueError(f"Malformed CSV result, expected {len(variables)} values per row")
+        columns = [fields[i::len(variables)] for i in range(len(variables))]
+
+    out = {}
+    for var, column in zip(variables, columns):
+        if not column:
+            continue
+        if var in numeric_columns:
+            out[var] = to_float64(column)
+        elif var in iri_columns:
+            out[var] = ["<" + value + ">" for value in column]
+        elif any(column):
+            out[var] = column
+    return out
+
+
+def _json_term(term):
+    # back to the Turtle syntax used by the other formats
+    if term["type"] == "uri":
+        return "<" + term["value"] + ">"
+    if term["type"] == "bnode":
+        return "_:" + term["value"]
+    value = '"' + term["value"] + '"'
+    if "datatype" in term:
+        return value + "^^<" + term["datatype"] + ">"
+    if "xml:lang" in term:
+        return value + "@" + term["xml:lang"]
+    return value
+
+
+def decode_json(response, encoding, numeric_columns=()):
+    """
+    SPARQL 1.1 JSON results, the columns are the same as the ones returned by the Turtle parser.
+    """
+    results = json.loads(response.read().decode(encoding))
+    if "results" not in results:
+        return {}  # ASK query
+
+    bindings = results["results"]["bindings"]
+    out = {}
+    for var in results["head"].get("vars", []):
+        terms = [binding[var] for binding in bindings if var in binding]
+        if not terms:
+            continue
+        if var in numeric_columns:
+            out[var] = to_float64([term["value"] for term in terms])
+        else:
+            out[var] = [_json_term(term) for term in terms]
+    return out
@@ -0,0 +1,151 @@
+import itertools
+import logging
+from concurrent.futures import CancelledError, Future
+from threading import Condition, Event, Thread, local
+
+__all__ = ["CommandScheduler", "check_cancelled", "current_task"]
+
+_local = local()
+
+
+def current_task():
+    """
+    The task running in this thread, None outside of the scheduler.
+    """
+    return getattr(_local, "task", None)
+
+
+def check_cancelled():
+    """
+    Raises CancelledError if the task running in this thread was cancelled. Long
+    commands call it between the steps they can be interrupted at.
+    """
+    task = current_task()
+    if task is not None:
+        task.check()
+
+
+class Task:
+    def __init__(self, sequence, group, function, args):
+        self.sequence = sequence
+        self.group = group
+        self.function = function
+        self.args = args
+        self.future = Future()
+        self._cancelled = Event()
+
+    def __lt__(self, other):
+        return self.sequence < other.sequence
+
+    def cancel(self):
+        # a running task can't be interrupted, it stops at its next check
+        self._cancelled.set()
+        self.future.cancel()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled():
+            raise CancelledError()
+
+
+class CommandScheduler:
+    """
+    Runs the commands of the Controller on a pool of worker threads. The commands
+    of a group run one at a time in the order of submission, different groups run
+    concurrently, so a slow query doesn't hold back the interactive commands.
+    A group can supersede other groups: submitting to it cancels all their queued
+    and running tasks, e.g. a new query cancels the one still running.
+    """
+
+    def __init__(self, workers, supersedes=None):
+        self.supersedes = supersedes or {}
+        self._condition = Condition()
+        self._pending = []
+        self._running = {}  # group -> task
+        self._sequence = itertools.count()
+        self._stopped = False
+        self._threads = [
+            Thread(target=self._work, daemon=True, name=f"command-worker-{i}")
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, group, function, *args):
+        """
+        Queues `function(*args)` and returns a Future of its result.
+        """
+        with self._condition:
+            for superseded in self.supersedes.get(group, ()):
+                self._cancel_group(superseded)
+            task = Task(next(self._sequence), group, function, args)
+            self._pending.append(task)
+            self._condition.notify_all()
+        return task.future
+
+    def running(self, group):
+        """
+        True while a task of `group` runs.
+        """
+        with self._condition:
+            return group in self._running
+
+    def _cancel_group(self, group):
+        for task in [task for task in self._pending if task.group == group]:
+            task.cancel()
+            self._pending.remove(task)
+        if group in self._running:
+            self._running[group].cancel()
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            for task in self._pending:
+                task.cancel()
+            self._pending.clear()
+            for task in self._running.values():
+                task.cancel()
+            self._condition.notify_all()
+
+    def _next_task(self):
+        with self._condition:
+            while not self._stopped:
+                ready = [task for task in self._pending if task.group not in self._running]
+                if ready:
+                    task = min(ready)
+                    self._pending.remove(task)
+                    self._running[task.group] = task
+                    return task
+                self._condition.wait()
+        return None
+
+    def _work(self):
+        task = self._next_task()
+        while task is not None:
+            self._run(task)
+            with self._condition:
+                del self._running[task.group]
+                self._condition.notify_all()
+            task = self._next_task()
+
+    @staticmethod
+    def _run(task):
+        if not task.future.set_running_or_notify_cancel():
+            return
+        _local.task = task
+        try:
+            result = task.function(*task.args)
+        except CancelledError as e:
+            print(f"Command {task.function.__name__} cancelled")
+            task.future.set_exception(e)
+        except Exception as e:
+            logging.exception(
+                "Error in controller running function %s", task.function.__name__
+            )
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            _local.task = None
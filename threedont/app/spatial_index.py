@@ -0,0 +1,85 @@
+import numpy as np
+
+__all__ = ['SpatialIndex']
+
+# classic spatial hash primes, collisions only cost a few more distance checks
+HASH_PRIMES = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+# default tolerance in units of float32 epsilon at the largest coordinate, enough
+# for the rounding differences between the loaded points and a query result
+TOLERANCE_EPS = 8
+
+
+class SpatialIndex:
+    """
+    Quantized grid hash over the coordinates of the points. Every point is hashed by
+    the grid cell it falls in, the cells are 2 * tolerance wide, so a query only needs
+    to look at the 8 cells closest to it. `get_ids` maps whole arrays of coordinates.
+    """
+
+    def __init__(self, coords, tolerance=None):
+        coords = np.asarray(coords, dtype=np.float32)
+        if tolerance is None:
+            scale = float(np.abs(coords).max()) if len(coords) else 1.0
+            tolerance = TOLERANCE_EPS * np.finfo(np.float32).eps * max(scale, 1.0)
+        self.tolerance = tolerance
+        self.cell_size = 2 * tolerance
+        self.coords = coords
+
+        keys = self._hash(np.floor(coords / self.cell_size).astype(np.int64))
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._order = order.astype(np.int32 if len(coords) < (1 << 31) else np.int64)
+
+    @staticmethod
+    def _hash(cells):
+        hashed = cells * HASH_PRIMES
+        return hashed[:, 0] ^ hashed[:, 1] ^ hashed[:, 2]
+
+    def _lookup(self, keys):
+        # the queries are sorted first, searchsorted is a lot faster on sorted needles
+        order = np.argsort(keys)
+        start = np.empty(len(keys), dtype=np.int64)
+        end = np.empty(len(keys), dtype=np.int64)
+        start[order] = np.searchsorted(self._keys, keys[order], side="left")
+        end[order] = np.searchsorted(self._keys, keys[order], side="right")
+        return start, end
+
+    def _match(self, coords, cells, rows, ids, best):
+        start, end = self._lookup(self._hash(cells))
+        # cells hold a handful of points, walk them all at once
+        for k in range(int((end - start).max(initial=0))):
+            inside = np.flatnonzero(start + k < end)
+            candidates = self._order[start[inside] + k]
+            distances = np.linalg.norm(
+                self.coords[candidates] - coords[rows[inside]], axis=1
+            )
+            closer = (distances <= self.tolerance) & (distances < best[rows[inside]])
+            best[rows[inside[closer]]] = distances[closer]
+            ids[rows[inside[closer]]] = candidates[closer]
+
+    def get_ids(self, coords):
+        """
+        Returns the id of the closest point within the tolerance for every row
+        of `coords`, -1 where there is none.
+        """
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        ids = np.full(len(coords), -1, dtype=np.int64)
+        if len(coords) == 0 or len(self._keys) == 0:
+            return ids
+        best = np.full(len(coords), np.inf, dtype=np.float32)
+
+        scaled = coords / self.cell_size
+        cells = np.floor(scaled).astype(np.int64)
+        # exact matches are the common case and are always in the own cell
+        rows = np.arange(len(coords))
+        self._match(coords, cells, rows, ids, best)
+        rows = np.flatnonzero(best > 0)
+        if len(rows) == 0:
+            return ids
+
+        # the neighbour on each axis is on the side of the closer cell boundary
+        sides = np.where(scaled[rows] - cells[rows] < 0.5, -1, 1)
+        for corner in range(1, 8):
+            offsets = np.array([(corner >> axis) & 1 for axis in range(3)])
+            self._match(coords, cells[rows] + sides * offsets, rows, ids, best)
+        return ids
@@ -1,5 +1,6 @@
 from .config import Config
 from .app_state import AppState
 from .project import Project
+from .point_cache import PointCache
 
-__all__ = ["Config", "AppState", "Project"]
\ No newline at end of file
+__all__ = ["Config", "AppState", "Project", "PointCache"]
\ No newline at end of file
@@ -12,9 +12,15 @@ DEFAULT_CONFIG = {
         "pointsSize": 0.01,
         "scalarColorScheme": "jet",
         "highlightColor": "#FF0000",
+        "quantizePositions": False,
+        "gpuPointBudget": 0,
     },
     "general": {
         "loadLastProject": True,
+        "loadWorkers": 4,
+        "resultFormat": "auto",
+        "usePointCache": True,
+        "streamPoints": True,
     },
 }
 
@@ -23,9 +29,15 @@ CONFIG_SCHEMA = {
         "pointsSize": float,
         "scalarColorScheme": str,
         "highlightColor": str,
+        "quantizePositions": bool,
+        "gpuPointBudget": int,
     },
     "general": {
         "loadLastProject": bool,
+        "loadWorkers": int,
+        "resultFormat": str,
+        "usePointCache": bool,
+        "streamPoints": bool,
     },
 }
 
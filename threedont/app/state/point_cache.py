@@ -0,0 +1,98 @@
+from pathlib import Path
+import json
+import shutil
+
+import numpy as np
+
+from ..iri_index import IriIndex
+
+META_FILE = "meta.json"
+OCTREE_FILE = "octree.bin"
+CACHE_VERSION = 5
+
+
+class PointCache:
+    """
+    Binary copy of the points of a project, so that opening it doesn't download them again.
+    Every array is a .npy file that is memory mapped when loaded, meta.json is written last
+    and holds the graph the points come from and its fingerprint.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = Path(cache_path)
+
+    def _array_path(self, name):
+        return self.cache_path / f"{name}.npy"
+
+    def _save_array(self, name, array):
+        # the old file may still be memory mapped, replace it instead of truncating it
+        tmp_path = self.cache_path / f"{name}.npy.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        tmp_path.replace(self._array_path(name))
+
+    def _read_meta(self):
+        try:
+            with open(self.cache_path / META_FILE, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != CACHE_VERSION:
+            return None
+        return meta
+
+    def _load_array(self, name):
+        return np.load(self._array_path(name), mmap_mode="r")
+
+    def get_octree_path(self):
+        """
+        File where the viewer keeps the octree of the points, it checks itself that they didn't change.
+        The directory is created, the viewer may write the file before the points are saved.
+        """
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        return self.cache_path / OCTREE_FILE
+
+    def get_fingerprint(self, source):
+        meta = self._read_meta()
+        if meta is None or meta["source"] != source:
+            return None
+        return meta["fingerprint"]
+
+    def load(self, source):
+        """
+        Returns (coords, colors, iris) for the points of `source`, or None if they are not cached.
+        `iris` is an IriIndex.
+        """
+        meta = self._read_meta()
+        if meta is None or meta["source"] != source:
+            return None
+        try:
+            coords = self._load_array("coords")
+            colors = self._load_array("colors")
+            iri_arrays = {name: self._load_array("iri_" + name) for name in IriIndex().to_arrays()}
+        except (OSError, ValueError) as e:
+            print("Invalid point cache, ignoring it: ", e)
+            return None
+        return coords, colors, IriIndex.from_arrays(meta["iriPrefix"], iri_arrays)
+
+    def save(self, source, fingerprint, coords, colors, iris):
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        # a cache without meta is never loaded, so a save interrupted halfway is harmless
+        (self.cache_path / META_FILE).unlink(missing_ok=True)
+        self._save_array("coords", np.asarray(coords, dtype=np.float32))
+        # colors keep their compact 8 or 16 bit dtype
+        self._save_array("colors", np.asarray(colors))
+        for name, array in iris.to_arrays().items():
+            self._save_array("iri_" + name, array)
+        meta = {
+            "version": CACHE_VERSION,
+            "source": source,
+            "fingerprint": fingerprint,
+            "points": len(iris),
+            "iriPrefix": iris.prefix.decode("utf-8"),
+        }
+        with open(self.cache_path / META_FILE, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def clear(self):
+        shutil.rmtree(self.cache_path, ignore_errors=True)
@@ -7,8 +7,10 @@ from copy import deepcopy
 from importlib import resources
 
 from .abstract_config import AbstractConfig
+from .point_cache import PointCache
 
 PROJECT_FILE = "project.json"
+CACHE_DIR = "cache"
 
 DEFAULT_PROJECT_CONFIG = {
     "name": "",
@@ -61,6 +63,9 @@ class Project(AbstractConfig):
         project_path = Path(user_data_dir("threedont")) / "projects" / f"{safe_filename(project_name)}"
         return (project_path / PROJECT_FILE).exists()
 
+    def get_point_cache(self):
+        return PointCache(self.project_path / CACHE_DIR)
+
     def get_onto_path(self):
         # ugly way for now
         assets_folder = resources.files("threedont.assets")
@@ -3,13 +3,43 @@ import re
 
 from SPARQLWrapper import SPARQLWrapper, QueryResult
 
+from .result_formats import NumericColumn, decode_csv, decode_json, decode_tsv, parse_numbers, read_blocks
+
 __all__ = ['SPARQLWrapperWithTurtle', 'QueryResultWithTurtle']
 
 VARIABLES_REGEX = re.compile(r"res:binding\s*\[\s*res:variable\s*\"([a-zA-Z0-9_]+)\"\s*;\s*res:value\s*(\S+)\s*\]")
 PREFIXES_REGEX = re.compile(r"^@prefix\s+([a-zA-Z0-9_]+):\s*<([^>]+)>\s*\.\s*")
 
+# bytes versions used by the streaming parser, they run on a whole block at once
+BLOCK_PREFIXES_REGEX = re.compile(rb"^@prefix\s+([a-zA-Z0-9_]+):\s*<([^>]+)>\s*\.", re.MULTILINE)
+BLOCK_RESULT_VARIABLES_REGEX = re.compile(rb"res:resultVariable\s+([^\n]*)")
+BLOCK_VARIABLE_NAMES_REGEX = re.compile(rb"\"([a-zA-Z0-9_]+)\"")
+# names and values are scanned separately, findall with a single group returns plain
+# bytes while with two groups it allocates a tuple per binding and keeps the gc busy
+BLOCK_BINDING_NAMES_REGEX = re.compile(rb"res:variable\s*\"([a-zA-Z0-9_]+)\"")
+BLOCK_BINDING_VALUES_REGEX = re.compile(rb"res:value\s*(\S+)\s*\]")
+BLOCK_BINDINGS_REGEX = re.compile(rb"res:variable\s*\"([a-zA-Z0-9_]+)\"\s*;\s*res:value\s*(\S+)\s*\]")
+
 
 class QueryResultWithTurtle(QueryResult):
+    def __init__(self, result, numeric_columns=None, expected_rows=0, iri_columns=()):
+        super().__init__(result)
+        self.numeric_columns = numeric_columns
+        self.expected_rows = expected_rows
+        self.iri_columns = iri_columns
+
+    def _encoding(self):
+        return self.response.info().get_content_charset('utf-8')
+
+    def _convertTSV(self):
+        return decode_tsv(self.response, self._encoding(), self.numeric_columns or (), self.expected_rows)
+
+    def _convertCSV(self):
+        return decode_csv(self.response, self._encoding(), self.numeric_columns or (), self.iri_columns)
+
+    def _convertJSON(self):
+        return decode_json(self.response, self._encoding(), self.numeric_columns or ())
+
     def substitute_prefix(self, var):
         if not ':' in var:
             return var
@@ -25,6 +55,9 @@ class QueryResultWithTurtle(QueryResult):
             return var
 
     def _convertN3(self):
+        if self.numeric_columns is not None:
+            return self._convertN3Streaming()
+
         encoding = self.response.info().get_content_charset('utf-8')
         self._prefixes = {}
         out = {}
@@ -47,7 +80,134 @@ class QueryResultWithTurtle(QueryResult):
 
         return out
 
+    def _convertN3Streaming(self):
+        """
+        Reads the response in large blocks and extracts the bindings
+        of every variable with one regex scan per block, instead of two regexes per line.
+        Columns in `numeric_columns` are parsed straight into float64 arrays, the others
+        are returned as lists of strings like in `_convertN3`.
+        """
+        self._charset = self._encoding()
+        self._prefixes = {}
+        self._variables = []
+        self._numeric = {}
+        self._strings = {}
+
+        # bindings are one per line, so they are never split between two blocks
+        for block in read_blocks(self.response):
+            self._parse_block(block)
+
+        out = {}
+        for var in self._variables:
+            name = var.decode("ascii")
+            if var in self._numeric:
+                out[name] = self._numeric[var].array()
+            elif self._strings[var]:
+                out[name] = self._strings[var]
+        return out
+
+    def _parse_block(self, block):
+        if not block:
+            return
+
+        if b"@prefix" in block:
+            for prefix, uri in BLOCK_PREFIXES_REGEX.findall(block):
+                self._prefixes[prefix] = uri
+
+        names = BLOCK_BINDING_NAMES_REGEX.findall(block)
+        values = BLOCK_BINDING_VALUES_REGEX.findall(block)
+        if len(values) != len(names):
+            # some value could not be matched, pair them up one by one
+            bindings = BLOCK_BINDINGS_REGEX.findall(block)
+            names = [name for name, _ in bindings]
+            values = [value for _, value in bindings]
+        if not names:
+            return
+        if not self._variables:
+            self._find_variables(block, names)
+
+        # every solution binds the variables in the same order, so each column is a
+        # strided slice of the block; a block may start in the middle of a solution
+        count = len(self._variables)
+        first = self._variables.index(names[0]) if names[0] in self._variables else -1
+        columns = {}
+        for i, var in enumerate(self._variables):
+            start = (i - first) % count
+            column_names = names[start::count]
+            if first < 0 or column_names.count(var) != len(column_names):
+                columns = self._group_bindings(names, values)
+                break
+            columns[var] = values[start::count]
+
+        for var, column in columns.items():
+            if var in self._numeric:
+                self._numeric[var].extend(parse_numbers(column))
+            elif var in self._strings:
+                self._strings[var].extend(self._substitute_prefixes(column))
+
+    def _find_variables(self, block, names):
+        header = BLOCK_RESULT_VARIABLES_REGEX.search(block)
+        if header:
+            variables = BLOCK_VARIABLE_NAMES_REGEX.findall(header.group(1))
+        else:
+            variables = list(dict.fromkeys(names))
+
+        numeric = {var.encode("ascii") for var in self.numeric_columns}
+        for var in variables:
+            self._variables.append(var)
+            if var in numeric:
+                self._numeric[var] = NumericColumn(self.expected_rows)
+            else:
+                self._strings[var] = []
+
+    @staticmethod
+    def _group_bindings(names, values):
+        # slow path for solutions with unbound variables
+        columns = {}
+        for name, value in zip(names, values):
+            columns.setdefault(name, []).append(value)
+        return columns
+
+    def _substitute_prefixes(self, values):
+        # same as substitute_prefix, on the raw bytes of a whole column
+        if not values:
+            return []  # a block with only the tail of a solution
+        prefix = values[0].partition(b":")[0]
+        uri = self._prefixes.get(prefix)
+        if uri is not None:
+            # common case, the whole column has the same prefix (e.g. all the points)
+            head = prefix + b":"
+            column = b"\n".join(values)
+            if column.startswith(head) and column.count(b"\n" + head) == len(values) - 1:
+                column = column[len(head):].replace(b"\n" + head, b">\n<" + uri)
+                return (b"<" + uri + column + b">").decode(self._charset).split("\n")
+
+        out = []
+        for value in values:
+            prefix, colon, suffix = value.partition(b":")
+            uri = self._prefixes.get(prefix) if colon and not value.startswith(b"<") else None
+            if uri is not None:
+                value = b"<" + uri + suffix + b">"
+            out.append(value.decode(self._charset))
+        return out
+
 
 class SPARQLWrapperWithTurtle(SPARQLWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.numeric_columns = None
+        self.expected_rows = 0
+        self.iri_columns = ()
+
+    def setNumericColumns(self, columns, expected_rows=0, iri_columns=()):
+        """
+        Enables the streaming parser, `columns` are returned as float64 arrays.
+        Pass None to go back to the line by line parser.
+        `iri_columns` is only needed for CSV, that doesn't tell IRIs from literals.
+        """
+        self.numeric_columns = columns
+        self.expected_rows = expected_rows
+        self.iri_columns = iri_columns
+
     def query(self):
-        return QueryResultWithTurtle(self._query())
+        return QueryResultWithTurtle(self._query(), self.numeric_columns, self.expected_rows, self.iri_columns)
@@ -2,6 +2,9 @@ import inspect
 import os
 import socket
 import struct
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from threading import Lock, Thread
 
 import numpy
 
@@ -9,7 +12,21 @@ _viewer_dir = os.path.dirname(inspect.getfile(inspect.currentframe()))
 if not os.path.isabs(_viewer_dir):
     _viewer_dir = os.path.abspath(_viewer_dir)
 
-__all__ = ['Viewer', 'get_color_map']
+__all__ = ['Viewer', 'Categorical', 'get_color_map']
+
+# every message, both ways, is framed as request id, body length, body
+_FRAME_HEADER = struct.Struct('=IQ')
+
+# smaller arrays go through the socket, a shared memory segment costs a round trip
+SHARED_MEMORY_MIN_BYTES = 1 << 20
+
+# quantized positions: uint16 offsets inside the cells of a grid over the
+# bounding cube, see QuantizedPositions in the viewer
+_GRID_BITS = 5
+_MAX_OFFSET = 65535
+
+# encodings of typed attribute sets, see PointAttributes::Encoding
+_FLOAT32, _UNORM8, _UNORM16, _FLOAT16, _INDEX8, _INDEX16 = range(6)
 
 """
 For docs: go to [the original github page](https://github.com/heremaps/pptk)
@@ -42,8 +59,23 @@ class Viewer:
             >>> pptk.Viewer(xyz, rgb)
             >>> v.set(point_size=0.005)
 
+        All the messages go through a single connection, opened by the first one.
+        Messages are pipelined: sending one doesn't wait for the viewer, only
+        get() (and wait()) wait for their response.
+
+        Large point clouds and attributes are written in a POSIX shared memory
+        segment and only its name goes through the connection, the viewer reads
+        them from the mapped segment.
+
         """
         self._portNumber = port
+        self._shared_memory = os.name == 'posix'  # off once the viewer can't map a segment
+        self._quantize_positions = False
+        self._socket = None
+        self._send_lock = Lock()  # the viewer threads of the controller share the connection
+        self._pending_lock = Lock()
+        self._pending = {}  # request id -> Future of the response body
+        self._next_request_id = 0
 
     def close(self):
         """ Closes the point cloud viewer
@@ -91,9 +123,14 @@ class Viewer:
         curr_attribute_id  uint             Current attribute set index
         floor_level        float32          Floor z-level
         floor_color        4 x float32      Floor color in RGBA [0, 1]
+        frame_budget       float32          Seconds per refinement chunk
+        gpu_point_budget   uint             Points kept on the gpu, see below
+        highlight_color    4 x float32      Color of highlighted points
         lookat             3 x float32      Camera look-at position
+        octree_cache       str              Octree file, see below
         phi                float32          Camera azimuthal angle (radians)
         point_size         float32          Point size in world space
+        quantize_positions bool             Quantize positions, see below
         r                  float32          Camera distance to look-at point
         selected           ? x uint         Indices of selected points
         show_grid          bool             Show floor grid
@@ -105,6 +142,27 @@ class Viewer:
         (phi, theta, r) are spherical coordinates specifying camera position
         relative to the look at position.
 
+        With quantize_positions the positions are sent and kept on the gpu as
+        16 bit offsets inside the cells of a 32 x 32 x 32 grid over the
+        cloud, 8 bytes per point instead of 12, with a precision of about
+        2^-21 of the extent of the cloud.
+
+        After the camera stops the points are refined in chunks sized to draw
+        in about frame_budget seconds each (1/60 by default), the viewer
+        stays responsive in between and drops the refinement when the camera
+        moves.
+
+        With a gpu_point_budget (0 for none) the gpu holds at most that many
+        points, in chunks of 65536 from the octree, and the chunks each frame
+        needs are paged in from host memory, evicting the least recently
+        drawn ones. It bounds the gpu memory only, the viewer still keeps all
+        the points in host memory. The points of a frame that don't fit in
+        the budget are not drawn, see dropped_points.
+
+        With octree_cache the viewer saves the octree of the points loaded
+        next to that file, and reads it back instead of building it when the
+        same points are loaded again. An empty string disables it.
+
         (right, up, view) are orthogonal vectors forming the camera coordinate
         frame, where view is pointed away from the look at position, and view
         is the cross product of up with right
@@ -117,6 +175,8 @@ class Viewer:
         """
         for prop, val in kwargs.items():
             self.__send(_construct_set_msg(prop, val))
+            if prop == 'quantize_positions':
+                self._quantize_positions = bool(val)
 
     def get(self, prop_name):
         """ Gets viewer property
@@ -125,7 +185,9 @@ class Viewer:
         Property Name     Return Type    Description
         ================  =============  ================================
         curr_atribute_id  uint           Current attribute set index
+        dropped_points    uint           Points left out by the last draw
         eye               3 x float64    Camera position
+        frame_stats       6 x float32    Frame timings, see below
         lookat            3 x float64    Camera look-at position
         mvp               4 x 4 float64
         num_points        uint           Number of points loaded
@@ -139,6 +201,12 @@ class Viewer:
         view              3 x float64    Camera view vector
         ================  =============  ================================
 
+        frame_stats holds the seconds taken by the last coarse frame and by
+        the last completed refinement, the number of chunks and of points of
+        that refinement, the estimated points drawn per second and the
+        frame_budget. The viewer sends them all as float32, the counts are
+        exact up to 2^24.
+
         Examples:
 
             >>> v = pptk.Viewer(xyz)
@@ -156,6 +224,31 @@ class Viewer:
         self.attributes(*attr)
         self.color_map(color_map, scale)
 
+    def append(self, positions, colors, last=False):
+        """ Appends points to the ones streamed since the last clear or load
+
+        The viewer shows the streamed points while they arrive, its octree is
+        rebuilt every time their number doubles. Pass last=True with the last
+        points (or with no points) to build it with all of them. The points
+        keep the order they were appended in.
+
+        Examples:
+
+            >>> v.clear()
+            >>> for xyz, rgb in pages:
+            ...     v.append(xyz, rgb)
+            >>> v.append(numpy.empty((0, 3)), numpy.empty((0, 3)), last=True)
+
+        """
+        positions = numpy.asarray(positions, dtype=numpy.float32).reshape(-1, 3)
+        colors = _float_colors(numpy.asarray(colors))
+        colors = colors.reshape(len(positions), -1)
+        if colors.shape[-1] == 3:
+            colors = numpy.c_[colors, numpy.ones(colors.shape[0], dtype=numpy.float32)]
+        msg = struct.pack('b', 11) + struct.pack('i', len(positions)) \
+              + struct.pack('?', last) + positions.tobytes() + colors.tobytes()
+        self.__send(msg)
+
     def attributes(self, *attr):
         """ Loads point attributes
 
@@ -166,6 +259,11 @@ class Viewer:
         * scalars: 1-d array of length 1 or n
         * RGB colors: 2-d array of shape (1, 3) or (n, 3)
         * RGBA colors: 2-d array of shape (1, 4) or (n, 4)
+        * categories: a :class:`Categorical` of length 1 or n
+
+        The arrays keep their width on the way to the gpu: uint8 and uint16
+        colors are read as normalized integers (255 or 65535 is 1), float16
+        arrays stay half floats, anything else is sent as float32.
 
         Passing in no arguments clears all existing attribute sets and colors
         all points white.  Cycle through attribute sets via :kbd:`[` and
@@ -183,30 +281,60 @@ class Viewer:
         >>> attr6 = np.rand(1, 4)    # 1 random RGBA color
         >>> v.attributes(attr1, attr2, attr3, attr4, attr5, attr6)
         >>> v.set(point_size=0.005)
+        >>> rgb = np.random.randint(0, 256, (100, 3), dtype=np.uint8)
+        >>> v.attributes(rgb)  # 4 bytes per point instead of 16
 
         """
-        msg = struct.pack('Q', len(attr))
+        num_points = None
         error_msg = '%d-th attribute array inconsistent with number of points'
+        arrays = []
         for i, x in enumerate(attr):
-            x = numpy.asarray(x, dtype=numpy.float32)
-            # TODO:warn if attribute array contains NaN
-            # array of scalars
-            if len(x.shape) == 1:
-                if x.shape[0] != self.get('num_points') and x.shape[0] != 1:
-                    raise ValueError(error_msg % i)
-                msg += struct.pack('QQ', x.shape[0], 1) + x.tostring()
-            # array of rgb or rgba
-            elif len(x.shape) == 2 and (x.shape[-1] == 4 or x.shape[-1] == 3):
-                if x.shape[0] != self.get('num_points') and x.shape[0] != 1:
-                    raise ValueError(error_msg % i)
-                if x.shape[-1] == 3:
-                    x = numpy.c_[x,
-                    numpy.ones(x.shape[0], dtype=numpy.float32)]
-                msg += struct.pack('QQ', *x.shape) + x.tostring()
+            if isinstance(x, Categorical):
+                typed = (x.encoding, x.indices.reshape(-1, 1), x.palette)
             else:
-                raise ValueError('%d-th ' % i +
-                                 'attribute array shape is not supported')
-        msg = struct.pack('b', 10) + struct.pack('Q', len(msg)) + msg
+                # TODO:warn if attribute array contains NaN
+                typed = _typed_attribute(numpy.asarray(x))
+                if typed is None:
+                    raise ValueError('%d-th ' % i +
+                                     'attribute array shape is not supported')
+            values = typed[1]
+            if values.shape[0] != 1 and num_points is None:
+                num_points = self.get('num_points')
+            if values.shape[0] != num_points and values.shape[0] != 1:
+                raise ValueError(error_msg % i)
+            arrays.append(typed)
+        size = _attributes_size(arrays)
+        if self.__send_shared(13, size, lambda buf: _write_attributes(buf, arrays),
+                              struct.pack('Q', size)):
+            return
+        payload = bytearray(size)
+        _write_attributes(payload, arrays)
+        msg = struct.pack('b', 16) + struct.pack('Q', size) + payload
+        self.__send(msg)
+
+    def highlight(self, mask=None):
+        """ Highlights points with the highlight_color property
+
+        The highlight is drawn on top of any attribute set and doesn't change
+        them. mask is a boolean array with one element per point, or the same
+        already packed to one bit per point with
+        numpy.packbits(mask, bitorder='little'). Passing no mask clears the
+        highlight.
+
+        Examples:
+
+        >>> v.set(highlight_color=[1, 0, 0, 1])
+        >>> v.highlight(xyz[:, 2] > 0.5)
+        >>> v.highlight()
+
+        """
+        bits = b''
+        if mask is not None:
+            mask = numpy.asarray(mask)
+            if mask.dtype == numpy.bool_:
+                mask = numpy.packbits(mask, bitorder='little')
+            bits = mask.astype(numpy.uint8, copy=False).tobytes()
+        msg = struct.pack('b', 15) + struct.pack('Q', len(bits)) + bits
         self.__send(msg)
 
     def color_map(self, c, scale=None):
@@ -310,8 +438,8 @@ class Viewer:
         if poses.size == 0:
             return
         msg = struct.pack('b', 8) \
-              + struct.pack('i', poses.shape[0]) + poses.tostring() \
-              + struct.pack('i', ts.size) + ts.tostring() \
+              + struct.pack('i', poses.shape[0]) + poses.tobytes() \
+              + struct.pack('i', ts.size) + ts.tobytes() \
               + struct.pack('b', _interp_code[interp])
         self.__send(msg)
         msg = struct.pack('b', 9) \
@@ -356,8 +484,8 @@ class Viewer:
             return
         # load camera path
         msg = struct.pack('b', 8) + \
-              struct.pack('i', poses.shape[0]) + poses.tostring() + \
-              struct.pack('i', ts.size) + ts.tostring() + \
+              struct.pack('i', poses.shape[0]) + poses.tobytes() + \
+              struct.pack('i', ts.size) + ts.tobytes() + \
               struct.pack('b', _interp_code[interp])
         self.__send(msg)
 
@@ -397,63 +525,125 @@ class Viewer:
         Press enter in viewer to return control to python terminal.
 
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(('localhost', self._portNumber))
-        s.send(struct.pack('b', 7))
-        s.setblocking(1)
-        buf = b''
-        while len(buf) == 0:
-            buf += s.recv(1)
+        buf = self.__request(struct.pack('b', 7)).result()
         if buf != b'x':
             raise RuntimeError('expecting return code \'x\'')
-        s.close()
 
     def __load(self, positions):
         # if no points, then done
         if positions.size == 0:
             return
-        # construct message
         numPoints = int(positions.size / 3)
+        if self._quantize_positions:
+            self.__load_quantized(positions)
+            return
+        if self.__send_shared(12, positions.nbytes,
+                              lambda buf: _write_array(buf, positions),
+                              struct.pack('Q', numPoints)):
+            return
+        # construct message
         msg = struct.pack('b', 1) \
-              + struct.pack('i', numPoints) + positions.tostring()
+              + struct.pack('i', numPoints) + positions.tobytes()
         # send message to viewer
         self.__send(msg)
 
+    def __load_quantized(self, positions):
+        corner, cell_size = _quantization_grid(positions)
+        fields = struct.pack('4dQ', *corner, cell_size, len(positions))
+        size = 8 * len(positions)
+        write = lambda buf: _write_quantized(buf, positions, corner, cell_size)
+        if self.__send_shared(18, size, write, fields):
+            return
+        payload = bytearray(size)
+        write(payload)
+        self.__send(struct.pack('b', 17) + fields + payload)
+
+    def __connect(self):
+        s = socket.create_connection(('localhost', self._portNumber))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        Thread(target=self.__read_responses, args=(s,), daemon=True).start()
+        return s
+
+    def __request(self, msg):
+        # returns a Future of the response body
+        future = Future()
+        with self._send_lock:
+            if self._socket is None:
+                self._socket = self.__connect()
+            request_id = self._next_request_id
+            self._next_request_id = (request_id + 1) % (1 << 32)
+            with self._pending_lock:
+                self._pending[request_id] = future
+            try:
+                self._socket.sendall(_FRAME_HEADER.pack(request_id, len(msg)))
+                self._socket.sendall(msg)
+            except OSError:
+                self._socket.close()  # the reader fails the pending requests
+                self._socket = None
+                raise
+        return future
+
+    def __read_responses(self, s):
+        # runs in its own thread for the whole life of the connection
+        try:
+            while True:
+                request_id, length = _FRAME_HEADER.unpack(
+                    _recv_from_socket(_FRAME_HEADER.size, s))
+                body = _recv_from_socket(length, s)
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(body)
+        except (OSError, RuntimeError) as e:
+            error = e
+        with self._send_lock:
+            if self._socket is s:
+                self._socket = None
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(RuntimeError(f"viewer connection closed: {error}"))
+
     def __send(self, msg):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(('localhost', self._portNumber))
-        totalSent = 0
-        while totalSent < len(msg):
-            sent = s.send(msg)
-            if sent == 0:
-                raise RuntimeError("socket connection broken")
-            totalSent = totalSent + sent
-        s.close()
+        self.__request(msg)
+
+    def __send_shared(self, msg_type, size, write, fields=b''):
+        # sends a message whose payload, written by write(buffer), is in a shared
+        # memory segment; returns False if the payload must go through the socket
+        if not self._shared_memory or size < SHARED_MEMORY_MIN_BYTES:
+            return False
+        try:
+            segment = shared_memory.SharedMemory(create=True, size=size)
+        except OSError:
+            self._shared_memory = False
+            return False
+        try:
+            write(segment.buf)
+            msg = struct.pack('b', msg_type) + _pack_string(segment.name) + fields
+            # the segment is removed as soon as the viewer has read it
+            mapped = self.__request(msg).result() == b'\x01'
+        finally:
+            segment.close()
+            segment.unlink()
+        if not mapped:
+            self._shared_memory = False
+        return mapped
 
     def __query(self, msg):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # s.setsockopt(socket.SOL_SOCKET,socket.TCP_NODELAY,1)
-        s.connect(('localhost', self._portNumber))
-        totalSent = 0
-        while totalSent < len(msg):
-            sent = s.send(msg)
-            if sent == 0:
-                raise RuntimeError("socket connection broken")
-            totalSent = totalSent + sent
+        body = self.__request(msg).result()
         # layout of response message:
         # 0: data type (0 - error msg, 1 - char, 2 - float, 3 - int, 4 - uint)
         # 1: number of dimensions (quint64)
         # 9: dimensions (quint64)
         # ?: body
         lookupSize = {0: 1, 1: 1, 2: 4, 3: 4, 4: 4}
-        dataType = ord(s.recv(1))
-        numDims = struct.unpack('Q', _recv_from_socket(8, s))[0]
-        dims = struct.unpack(str(numDims) + 'Q',
-                             _recv_from_socket(numDims * 8, s))
+        dataType = body[0]
+        numDims = struct.unpack_from('Q', body, 1)[0]
+        dims = struct.unpack_from(str(numDims) + 'Q', body, 9)
         numElts = numpy.prod(dims)
-        bodySize = lookupSize[dataType] * numElts
-        body = _recv_from_socket(bodySize, s)
-        s.close()
+        offset = 9 + 8 * numDims
+        body = body[offset:offset + lookupSize[dataType] * numElts]
 
         if dataType == 0:
             raise ValueError(body)
@@ -465,12 +655,54 @@ class Viewer:
         return body
 
 
+class Categorical:
+    """ Attribute set of category indices, colored with a palette
+
+    indices is a 1-d array of length 1 or n with values in
+    [0, len(palette)), palette a (k, 3) or (k, 4) array of colors in [0, 1].
+    The indices take one byte per point up to 256 categories, two up to
+    65536, and the viewer never blends the colors of different categories.
+
+    Examples:
+
+    >>> labels = np.random.randint(0, 3, 100)
+    >>> v.attributes(Categorical(labels, [[1, 0, 0], [0, 1, 0], [0, 0, 1]]))
+
+    """
+    def __init__(self, indices, palette):
+        palette = numpy.asarray(palette, dtype=numpy.float32)
+        if len(palette.shape) != 2 or palette.shape[-1] not in (3, 4) \
+                or not 0 < len(palette) <= 1 << 16:
+            raise ValueError('palette shape is not supported')
+        if numpy.any(numpy.logical_or(palette < 0.0, palette > 1.0)):
+            raise ValueError('Expecting palette colors in [0,1]')
+        if palette.shape[-1] == 3:
+            palette = numpy.c_[palette, numpy.ones(len(palette), dtype=numpy.float32)]
+        indices = numpy.asarray(indices)
+        if len(indices.shape) != 1:
+            raise ValueError('indices must be a 1-d array')
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(palette)):
+            raise ValueError('indices out of the palette')
+        small = len(palette) <= 1 << 8
+        self.encoding = _INDEX8 if small else _INDEX16
+        self.indices = indices.astype(numpy.uint8 if small else numpy.uint16)
+        self.palette = palette
+
+    def __len__(self):
+        return len(self.indices)
+
+
 def _recv_from_socket(n, s):
     # receive n bytes from socket s
-    buf = b''
-    while len(buf) < n:
-        buf += s.recv(n - len(buf))
-    return buf
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        chunk = s.recv_into(view[received:])
+        if chunk == 0:
+            raise RuntimeError("socket connection broken")
+        received += chunk
+    return bytes(buf)
 
 
 def _fix_poses_ts_input(poses, ts):
@@ -522,11 +754,11 @@ def _encode_float(x):
 
 
 def _encode_floats(x):
-    return numpy.asarray(x, dtype=numpy.float32).tostring()
+    return numpy.asarray(x, dtype=numpy.float32).tobytes()
 
 
 def _encode_uints(x):
-    return numpy.asarray(numpy.uint32(x)).tostring()
+    return numpy.asarray(numpy.uint32(x)).tobytes()
 
 
 def _encode_uint(x):
@@ -537,6 +769,10 @@ def _encode_uint(x):
     return y
 
 
+def _encode_str(x):
+    return str(x).encode('utf-8')
+
+
 def _encode_rgb(x):
     x = numpy.asarray(numpy.float32(x))
     if x.size != 3 or numpy.any(numpy.logical_or(x < 0.0, x > 1.0)):
@@ -554,7 +790,7 @@ def _encode_rgba(x):
 def _encode_rgbas(x):
     x = numpy.asarray(numpy.float32(x))
     if x.shape[1] == 4 and numpy.all(numpy.logical_and(x >= 0.0, x <= 1.0)):
-        return x.tostring()
+        return x.tobytes()
     else:
         raise ValueError('Expecting 4 column array of values in [0,1]')
 
@@ -568,16 +804,21 @@ def _encode_xyz(x):
 
 def _init_properties():
     _properties['point_size'] = _encode_float
+    _properties['quantize_positions'] = _encode_bool
     _properties['bg_color'] = _encode_rgba
     _properties['bg_color_top'] = _encode_rgba
     _properties['bg_color_bottom'] = _encode_rgba
     _properties['show_grid'] = _encode_bool
     _properties['show_info'] = _encode_bool
+    _properties['frame_budget'] = _encode_float
     _properties['show_axis'] = _encode_bool
     _properties['floor_level'] = _encode_float
     _properties['floor_color'] = _encode_rgba
+    _properties['gpu_point_budget'] = _encode_uint
     _properties['floor_grid_color'] = _encode_rgba
+    _properties['highlight_color'] = _encode_rgba
     _properties['lookat'] = _encode_xyz
+    _properties['octree_cache'] = _encode_str
     _properties['phi'] = _encode_float
     _properties['theta'] = _encode_float
     _properties['r'] = _encode_float
@@ -603,6 +844,94 @@ def _construct_set_msg(prop_name, prop_value):
     return msg_header + struct.pack('Q', len(msg_payload)) + msg_payload
 
 
+def _write_array(buffer, x):
+    # writes the float32 array x at the start of buffer
+    numpy.copyto(numpy.ndarray(x.shape, numpy.float32, buffer), x)
+
+
+def _quantization_grid(positions):
+    # corner and cell size of the grid over the bounding cube of positions
+    corner = positions.min(axis=0).astype(numpy.float64)
+    cube_size = float((positions.max(axis=0) - corner).max())
+    return corner, cube_size / (1 << _GRID_BITS) if cube_size > 0 else 1.0
+
+
+def _write_quantized(buffer, positions, corner, cell_size, chunk=1 << 20):
+    # writes 4 uint16 per point at the start of buffer: the offsets inside
+    # its cell and the index of the cell (x, y, z with _GRID_BITS bits each)
+    grid = 1 << _GRID_BITS
+    out = numpy.ndarray((len(positions), 4), numpy.uint16, buffer)
+    for start in range(0, len(positions), chunk):
+        t = (positions[start:start + chunk] - corner) / cell_size
+        cell = numpy.clip(numpy.floor(t), 0, grid - 1)
+        offset = numpy.clip(t - cell, 0, 1)
+        out[start:start + chunk, :3] = numpy.floor(offset * _MAX_OFFSET + 0.5)
+        cell = cell.astype(numpy.uint16)
+        out[start:start + chunk, 3] = (cell[:, 0] << 2 * _GRID_BITS) \
+            | (cell[:, 1] << _GRID_BITS) | cell[:, 2]
+
+
+def _float_colors(colors):
+    # uint8 and uint16 colors to floats in [0, 1]
+    if colors.dtype in (numpy.uint8, numpy.uint16):
+        return colors / numpy.float32(numpy.iinfo(colors.dtype).max)
+    return colors.astype(numpy.float32)
+
+
+def _typed_attribute(x):
+    # (encoding, values, palette) of an attribute array, None if its shape is
+    # not supported; values are scalars (n, 1) or rgb or rgba colors (n, 3|4)
+    is_scalars = len(x.shape) == 1
+    is_colors = len(x.shape) == 2 and (x.shape[-1] == 4 or x.shape[-1] == 3)
+    if not is_scalars and not is_colors:
+        return None
+    values = x.reshape(x.shape[0], -1)
+    if is_colors and x.dtype == numpy.uint8:
+        return _UNORM8, values, None
+    if is_colors and x.dtype == numpy.uint16:
+        return _UNORM16, values, None
+    if x.dtype == numpy.float16:
+        return _FLOAT16, values, None
+    return _FLOAT32, values.astype(numpy.float32, copy=False), None
+
+
+def _attributes_size(attr):
+    # size in bytes of the typed attributes payload, see _write_attributes
+    size = 8
+    for encoding, values, palette in attr:
+        size += 24 + values.shape[0] * (1 if values.shape[1] == 1 else 4) * \
+            values.dtype.itemsize
+        if palette is not None:
+            size += 8 + palette.nbytes
+    return size
+
+
+def _write_attributes(buffer, attr):
+    # layout of the typed attributes payload: number of sets (quint64), then
+    # for each set its size (quint64), dimension (quint64), encoding (quint64),
+    # for categorical sets the number of palette colors (quint64) and the
+    # float32 rgba palette, and the values in the encoding of the set;
+    # rgb colors are written as rgba, with an opaque alpha
+    struct.pack_into('Q', buffer, 0, len(attr))
+    offset = 8
+    for encoding, x, palette in attr:
+        dim = 1 if x.shape[1] == 1 else 4
+        struct.pack_into('QQQ', buffer, offset, x.shape[0], dim, encoding)
+        offset += 24
+        if palette is not None:
+            struct.pack_into('Q', buffer, offset, len(palette))
+            offset += 8
+            numpy.copyto(numpy.ndarray(palette.shape, numpy.float32, buffer, offset),
+                         palette)
+            offset += palette.nbytes
+        values = numpy.ndarray((x.shape[0], dim), x.dtype, buffer, offset)
+        values[:, :x.shape[1]] = x
+        if x.shape[1] == 3:
+            values[:, 3] = numpy.iinfo(x.dtype).max \
+                if encoding in (_UNORM8, _UNORM16) else 1
+        offset += values.nbytes
+
+
 def _pack_string(string):
     return struct.pack('Q', len(string)) + \
         struct.pack(str(len(string)) + 's', string.encode('ascii'))
@@ -0,0 +1,84 @@
+#ifndef __CHUNKPOOL_H__
+#define __CHUNKPOOL_H__
+#include <QtGlobal>
+#include <algorithm>
+#include <vector>
+
+// which chunks of points are resident in the slots of the gpu buffers. The
+// points and LOD centroids are split in chunks of CHUNK_SIZE in octree order,
+// a slot holds one chunk. With fewer slots than chunks the pool is paged: a
+// draw acquires the chunks of the points it needs and the least recently
+// used ones of earlier draws are evicted to make room, the chunks of a draw
+// that find no slot are not drawn. The pool bounds the gpu memory only, the
+// points stay in host memory. Without paging every chunk is resident in the
+// slot with its own index
+class ChunkPool {
+public:
+  static const std::size_t CHUNK_SIZE = 1 << 16;
+
+  ChunkPool() : _paged(false), _pass(0) {}
+
+  void reset(std::size_t num_points, std::size_t max_points = 0) {
+    // max_points bounds the points the slots can hold, 0 for no bound
+    std::size_t num_chunks = (num_points + CHUNK_SIZE - 1) / CHUNK_SIZE;
+    std::size_t num_slots = num_chunks;
+    if (max_points > 0)
+      num_slots = (std::min) (num_chunks, (std::max) (max_points / CHUNK_SIZE,
+                                                      (std::size_t) 1));
+    _paged = num_slots < num_chunks;
+    _pass = 0;
+    _chunk_slot.assign(num_chunks, -1);
+    _slot_chunk.assign(num_slots, -1);
+    _slot_used.assign(num_slots, 0);
+    if (!_paged)
+      for (std::size_t i = 0; i < num_chunks; i++) {
+        _chunk_slot[i] = (int) i;
+        _slot_chunk[i] = (int) i;
+      }
+  }
+
+  bool paged() const { return _paged; }
+  std::size_t numChunks() const { return _chunk_slot.size(); }
+  std::size_t numSlots() const { return _slot_chunk.size(); }
+  int slot(std::size_t chunk) const { return _chunk_slot[chunk]; }
+  int chunk(std::size_t slot) const { return _slot_chunk[slot]; }
+
+  void nextPass() {
+    // the chunks acquired from now on belong to a new draw, the ones of the
+    // previous draws may be evicted
+    _pass++;
+  }
+
+  int acquire(std::size_t chunk, bool &load) {
+    // returns the slot of chunk, load is set if the chunk was just given a
+    // slot and its points must be uploaded. Returns -1 if every slot is
+    // used by the current pass
+    load = false;
+    int s = _chunk_slot[chunk];
+    if (s == -1) {
+      quint64 oldest = _pass;
+      for (std::size_t i = 0; i < _slot_chunk.size(); i++)
+        if (_slot_chunk[i] == -1 || _slot_used[i] < oldest) {
+          s = (int) i;
+          if (_slot_chunk[i] == -1) break;
+          oldest = _slot_used[i];
+        }
+      if (s == -1) return -1;
+      if (_slot_chunk[s] != -1) _chunk_slot[_slot_chunk[s]] = -1;
+      _slot_chunk[s] = (int) chunk;
+      _chunk_slot[chunk] = s;
+      load = true;
+    }
+    _slot_used[s] = _pass;
+    return s;
+  }
+
+private:
+  bool _paged;
+  quint64 _pass;
+  std::vector<int> _chunk_slot; // -1 if not resident
+  std::vector<int> _slot_chunk; // -1 if free
+  std::vector<quint64> _slot_used;
+};
+
+#endif // __CHUNKPOOL_H__
@@ -1,9 +1,26 @@
 #ifndef __COMMFUNCS_H__
 #define __COMMFUNCS_H__
-#include <QTcpSocket>
+#include <QByteArray>
+#include <QDebug>
+#include <QIODevice>
+#include <cstring>
 #include <vector>
 
 namespace comm {
+  // every message on the connection, both ways, is framed as
+  // request id (quint32), body length (quint64), body
+  const qint64 FRAME_HEADER_SIZE = sizeof(quint32) + sizeof(quint64);
+
+  inline void writeFrame(QIODevice *connection, quint32 requestId,
+                         const QByteArray &body) {
+    char header[FRAME_HEADER_SIZE];
+    quint64 length = body.size();
+    std::memcpy(header, &requestId, sizeof(quint32));
+    std::memcpy(header + sizeof(quint32), &length, sizeof(quint64));
+    connection->write(header, FRAME_HEADER_SIZE);
+    connection->write(body);
+  }
+
   template<typename T>
   struct TypeCode {
     static const unsigned char value = 0;
@@ -26,7 +43,7 @@ namespace comm {
   };
 
   inline void receiveBytes(char *destination, const qint64 bytesExpected,
-                           QTcpSocket *clientConnection) {
+                           QIODevice *clientConnection) {
     // notes: read() can read just part of buffer
     // but waitForReadyRead() unblocks only on receiving *new* data
     // not-yet-read data in buffer is not considered new
@@ -34,10 +51,17 @@ namespace comm {
     while (bytesReceived < bytesExpected) {
       qint64 received =
               clientConnection->read(destination, bytesExpected - bytesReceived);
-      if (received == 0) clientConnection->waitForReadyRead(-1);
+      if (received == 0 && !clientConnection->waitForReadyRead(-1)) {
+        // end of a framed request, the message is shorter than it claims
+        qDebug() << "unexpected end of message";
+        std::memset(destination, 0, bytesExpected - bytesReceived);
+        return;
+      }
       if (received == -1) {
-        qDebug() << "error during socket read()";
-        exit(1);
+        // the rest of the message reads as zeros, the viewer keeps running
+        qWarning() << "error during read():" << clientConnection->errorString();
+        std::memset(destination, 0, bytesExpected - bytesReceived);
+        return;
       }
       bytesReceived += received;
       destination += received;
@@ -45,14 +69,14 @@ namespace comm {
   }
 
   inline void sendBytes(const char *source, const qint64 size,
-                        QTcpSocket *clientConnection) {
+                        QIODevice *clientConnection) {
     qint64 bytesLeft = size;
     const char *buf = source;
     while (bytesLeft > 0) {
       qint64 bytesSent = clientConnection->write(buf, bytesLeft);
       if (bytesSent == -1) {
-        qDebug() << "error during socket write()";
-        exit(1);
+        qWarning() << "error during write():" << clientConnection->errorString();
+        return;
       }
       buf += bytesSent;
       bytesLeft -= bytesSent;
@@ -61,7 +85,7 @@ namespace comm {
   }
 
   template<typename T>
-  void sendScalar(const T value, QTcpSocket *clientConnection) {
+  void sendScalar(const T value, QIODevice *clientConnection) {
     // send data type
     unsigned char dataType = TypeCode<T>::value;
     sendBytes((char *) &dataType, 1, clientConnection);
@@ -80,7 +104,7 @@ namespace comm {
 
   template<typename T>
   void sendArray(const T *source, const quint64 size,
-                 QTcpSocket *clientConnection) {
+                 QIODevice *clientConnection) {
     // send data type
     unsigned char dataType = TypeCode<T>::value;
     sendBytes((char *) &dataType, 1, clientConnection);
@@ -97,7 +121,7 @@ namespace comm {
   }
 
   inline void sendError(const char *msg, const quint64 size,
-                        QTcpSocket *clientConnection) {
+                        QIODevice *clientConnection) {
     // send data type
     unsigned char dataType = 0;
     sendBytes((char *) &dataType, 1, clientConnection);
@@ -116,7 +140,7 @@ namespace comm {
   template<typename T>
   void sendMatrix(const T *source, // in column major order
                   const quint64 numRows, const quint64 numCols,
-                  QTcpSocket *clientConnection) {
+                  QIODevice *clientConnection) {
     // send data type
     unsigned char dataType = TypeCode<T>::value;
     sendBytes((char *) &dataType, 1, clientConnection);
@@ -135,7 +159,7 @@ namespace comm {
 
   template<typename T>
   void sendMultiDimArray(const T *source, const std::vector<quint64> &dims,
-                         QTcpSocket *clientConnection) {
+                         QIODevice *clientConnection) {
     // send data type
     unsigned char dataType = TypeCode<T>::value;
     sendBytes((char *) &dataType, 1, clientConnection);
@@ -4,7 +4,9 @@
 #include "box3.h"
 #include "camera.h"
 #include <algorithm>
+#include <atomic>
 #include <limits>
+#include <thread>
 #include <vector>
 
 class Octree {
@@ -18,6 +20,33 @@ public:
                        // where z is least significant bit
   };
 
+  struct FlatNode {
+    // node of a tree stored in an array (see flatten), children are indices
+    // into the array, -1 if none
+    unsigned int centroid_index;
+    unsigned int point_index;
+    unsigned int point_count;
+    unsigned int is_leaf;
+    int children[8];
+  };
+
+  struct Range {
+    // consecutive points (and centroids) in the octree order
+    unsigned int first;
+    unsigned int count;
+  };
+
+  // the subtrees at this depth, up to 8^PARALLEL_DEPTH, are built and
+  // traversed in parallel
+  static const unsigned int PARALLEL_DEPTH = 2;
+  // smaller clouds are built on the calling thread only
+  static const unsigned int PARALLEL_MIN_POINTS = 1 << 16;
+  // and traversed on the calling thread only
+  static const unsigned int PARALLEL_TRAVERSAL_MIN_POINTS = 1 << 20;
+  // nodes this close to the box of getIndicesInBox (in normalized device
+  // coordinates) have their points tested one by one
+  static constexpr float BOX_MARGIN = 1e-5f;
+
   struct CameraFrustum {
     float eye[3];
     float right[3];
@@ -73,7 +102,9 @@ public:
         _num_points(0),
         _root(nullptr),
         _ptr_point_xyz(nullptr),
-        _cube_size(0.0f) {
+        _ptr_point_size(nullptr),
+        _cube_size(0.0f),
+        _num_threads(0) {
     _lower_left_corner[0] = _lower_left_corner[1] = _lower_left_corner[2] =
             0.0f;
   }
@@ -85,6 +116,12 @@ public:
   const std::vector<float> &getPointPos() const { return *_ptr_point_xyz; }
   const std::vector<unsigned int> &getIndices() const { return _indices; }
   const std::vector<unsigned int> &getIndicesR() const { return _indices_r; }
+  const std::vector<float> &getPointSizes() const { return *_ptr_point_size; }
+  const float *getCorner() const { return _lower_left_corner; }
+  float getCubeSize() const { return _cube_size; }
+  unsigned int getMaxLeafSize() const { return _max_leaf_size; }
+  // threads building and traversing the tree, 0 for one per core
+  void setNumThreads(unsigned int num_threads) { _num_threads = num_threads; }
 
   unsigned int countNodes() {
     // sanity check: two ways of computing the same thing
@@ -134,9 +171,28 @@ public:
     for (unsigned int i = 0; i < _num_points; i++) _indices.push_back(i);
     _labels.resize(_num_points);
 
-    // begin recursion
-    _root = buildTreeHelper(&_indices[0], &_labels[0], _num_points,
-                            _lower_left_corner, _cube_size);
+    // begin recursion, the subtrees below the first levels are built by a
+    // pool of threads, then their centroids are appended and the ones of the
+    // first levels computed
+    if (_num_points < PARALLEL_MIN_POINTS) {
+      _root = buildTreeHelper(&_indices[0], &_labels[0], _num_points,
+                              _lower_left_corner, _cube_size);
+    } else {
+      std::vector<Subtree> subtrees;
+      _root = buildTreeHelper(&_indices[0], &_labels[0], _num_points,
+                              _lower_left_corner, _cube_size, nullptr,
+                              &subtrees);
+      buildSubtrees(subtrees);
+      for (std::size_t i = 0; i < subtrees.size(); i++) {
+        Centroids &centroids = subtrees[i].centroids;
+        offsetCentroids(*subtrees[i].node, (unsigned int) point_xyz.size() / 3);
+        point_xyz.insert(point_xyz.end(), centroids.xyz.begin(),
+                         centroids.xyz.end());
+        point_size.insert(point_size.end(), centroids.size.begin(),
+                          centroids.size.end());
+      }
+      finishCentroids(_root, _cube_size);
+    }
 
     // reorder points
 #if 0
@@ -166,10 +222,12 @@ public:
 
   enum ProjectionMode { PERSPECTIVE,
                         ORTHOGRAPHIC };
-  void getIndices(std::vector<unsigned int> &indices, const Camera &camera,
+  void getIndices(std::vector<Range> &ranges, const Camera &camera,
                   float vfov, float z_near, unsigned int width,
                   unsigned int height, float fudge_factor = 0.25f) const {
-    indices.clear();
+    // the LOD selected points as ranges in the octree order, points and
+    // centroids of subtrees visited one after the other share a range
+    ranges.clear();
     if (!_root) return;
 
     // set frustum
@@ -184,15 +242,13 @@ public:
     // compute eps (pixel size in image plane at z = -1)
     float eps = frustum.image_t * 2.0f / height;
 
-    indices.reserve(_num_points);
-    getIndicesHelper(indices, _root, frustum, _lower_left_corner, _cube_size,
-                     eps, PERSPECTIVE, fudge_factor);
+    traverse(ranges, frustum, eps, PERSPECTIVE, fudge_factor);
   }
 
-  void getIndicesOrtho(std::vector<unsigned int> &indices, const Camera &camera,
+  void getIndicesOrtho(std::vector<Range> &ranges, const Camera &camera,
                        float image_r, float image_t, unsigned int height,
                        float fudge_factor = 0.25f) const {
-    indices.clear();
+    ranges.clear();
     if (!_root) return;
 
     // set frustum
@@ -208,9 +264,7 @@ public:
     // compute eps (pixel size in image plane at z = -1)
     float eps = frustum.image_t * 2.0f / height;
 
-    indices.reserve(_num_points);
-    getIndicesHelper(indices, _root, frustum, _lower_left_corner, _cube_size,
-                     eps, ORTHOGRAPHIC, fudge_factor);
+    traverse(ranges, frustum, eps, ORTHOGRAPHIC, fudge_factor);
   }
 
   void getClickIndices(std::vector<unsigned int> &indices, const float screen_x,
@@ -249,6 +303,29 @@ public:
       std::reverse(&indices[1], &indices[indices.size() - 1]);
   }
 
+  void getIndicesInBox(std::vector<Range> &ranges, const float (&mvp)[16],
+                       const float (&box)[4]) const {
+    // the points and centroids whose projection by mvp (column major) falls
+    // in box (x min, y min, x max, y max in normalized device coordinates)
+    // and in the depth range. Nodes entirely inside are added as a whole,
+    // only the points of the leaves on the border of the box are tested
+    ranges.clear();
+    if (!_root) return;
+    getIndicesInBoxHelper(ranges, _root, _lower_left_corner, _cube_size, mvp,
+                          box);
+  }
+
+  static bool projectsInBox(const float *xyz, const float (&mvp)[16],
+                            const float (&box)[4]) {
+    const float *m = mvp;
+    float p[4];
+    for (int i = 0; i < 4; i++)
+      p[i] = xyz[0] * m[i] + xyz[1] * m[4 + i] + xyz[2] * m[8 + i] + m[12 + i];
+    for (int i = 0; i < 3; i++) p[i] /= p[3];
+    return p[0] >= box[0] && p[0] <= box[2] && p[1] >= box[1] &&
+           p[1] <= box[3] && p[2] > -1.0f && p[2] < 1.0f;
+  }
+
   void getClickIndicesBrute(
           std::vector<unsigned int> &indices, const float screen_x,
           const float screen_y, const float screen_radius, const float screen_width,
@@ -280,7 +357,169 @@ public:
     if (min_idx != -1) indices.push_back(min_idx);
   }
 
+  bool getPickIndices(std::vector<unsigned int> &indices,
+                      const unsigned int index, const Camera &camera) const {
+    // indices as returned by getClickIndices for the point or centroid drawn
+    // under the click. A centroid stands for the points of its node, which
+    // are followed down to the one nearest along -view through the nearest
+    // child centroids. Returns false if index is no point or centroid
+    indices.clear();
+    if (!_root) return false;
+    const std::vector<float> &point_xyz = *_ptr_point_xyz;
+    const Node *node = _root;
+    unsigned int point = index;
+    if (index >= _num_points) {
+      // the centroid of a node lies in its cube, the cube is found as the
+      // one of a point would be
+      if ((std::size_t) index >= point_xyz.size() / 3) return false;
+      const float *xyz = &point_xyz[3 * index];
+      float corner[3] = {_lower_left_corner[0], _lower_left_corner[1],
+                         _lower_left_corner[2]};
+      float size = _cube_size;
+      while (node && node->centroid_index != index) {
+        if (node->is_leaf) return false;
+        unsigned int child_index = 0;
+        for (unsigned int dim = 0; dim < 3; dim++)
+          if (xyz[dim] > corner[dim] + 0.5f * size) {
+            child_index |= 1 << (2 - dim);
+            corner[dim] += 0.5f * size;
+          }
+        size *= 0.5f;
+        node = node->children[child_index];
+      }
+      if (!node) return false;
+
+      float eye[3], view[3];
+      camera.getCameraPosition(eye);
+      camera.getViewVector(view);
+      while (!node->is_leaf) {
+        const Node *nearest = nullptr;
+        float d_min = std::numeric_limits<float>::max();
+        for (int i = 0; i < 8; i++) {
+          const Node *child = node->children[i];
+          if (!child) continue;
+          float d = viewDepth(&point_xyz[3 * child->centroid_index], eye, view);
+          if (d < d_min) {
+            d_min = d;
+            nearest = child;
+          }
+        }
+        node = nearest;
+      }
+      point = node->point_index;
+      for (unsigned int i = 1; i < node->point_count; i++)
+        if (viewDepth(&point_xyz[3 * (node->point_index + i)], eye, view) <
+            viewDepth(&point_xyz[3 * point], eye, view))
+          point = node->point_index + i;
+      node = _root;
+    }
+
+    // the centroids of the inner nodes the point is under
+    indices.push_back(point);
+    while (!node->is_leaf) {
+      indices.push_back(node->centroid_index);
+      const Node *child = nullptr;
+      for (int i = 0; i < 8 && !child; i++)
+        if (node->children[i] && point >= node->children[i]->point_index &&
+            point - node->children[i]->point_index <
+                    node->children[i]->point_count)
+          child = node->children[i];
+      if (!child) {
+        indices.clear();
+        return false;
+      }
+      node = child;
+    }
+    return true;
+  }
+
+  void flatten(std::vector<FlatNode> &nodes) const {
+    // the nodes in pre-order, the root first
+    nodes.clear();
+    if (_root) flattenHelper(nodes, _root);
+  }
+
+  bool restoreTree(std::vector<float> &point_xyz, std::vector<float> &point_size,
+                   const unsigned int num_points, const unsigned int *indices,
+                   const FlatNode *nodes, const std::size_t num_nodes,
+                   const float (&cube_corner)[3], const float cube_size,
+                   unsigned int max_leaf_size) {
+    // rebuilds a tree saved with flatten, point_xyz and point_size hold the
+    // points in octree order followed by the centroids, indices is what
+    // getIndices returned. Returns false if the nodes are inconsistent,
+    // the tree is empty then
+    deleteTree(_root);
+    _root = nullptr;
+    _max_leaf_size = max_leaf_size;
+    _num_points = num_points;
+    _ptr_point_xyz = &point_xyz;
+    _ptr_point_size = &point_size;
+    for (unsigned int dim = 0; dim < 3; dim++)
+      _lower_left_corner[dim] = cube_corner[dim];
+    _cube_size = cube_size;
+
+    _indices.assign(indices, indices + num_points);
+    _indices_r.assign(num_points, num_points);
+    for (unsigned int i = 0; i < num_points; i++)
+      if (_indices[i] < num_points) _indices_r[_indices[i]] = i;
+    bool valid = point_xyz.size() == 3 * point_size.size() &&
+                 point_size.size() >= num_points;
+    for (unsigned int i = 0; i < num_points && valid; i++)
+      valid = _indices_r[i] < num_points;
+    if (valid && num_nodes > 0)
+      valid = restoreTreeHelper(_root, nodes, num_nodes, 0);
+    else if (valid)
+      valid = num_points == 0;
+    if (!valid) {
+      deleteTree(_root);
+      _root = nullptr;
+      _num_points = 0;
+      _indices.clear();
+      _indices_r.clear();
+    }
+    return valid;
+  }
+
+  void swap(Octree &other) {
+    // exchanges the trees, each keeps pointing to the point arrays it was
+    // built on, see relocate
+    std::swap(_max_leaf_size, other._max_leaf_size);
+    std::swap(_num_points, other._num_points);
+    std::swap(_root, other._root);
+    std::swap(_ptr_point_xyz, other._ptr_point_xyz);
+    std::swap(_ptr_point_size, other._ptr_point_size);
+    for (int dim = 0; dim < 3; dim++)
+      std::swap(_lower_left_corner[dim], other._lower_left_corner[dim]);
+    std::swap(_cube_size, other._cube_size);
+    _indices.swap(other._indices);
+    _indices_r.swap(other._indices_r);
+    _labels.swap(other._labels);
+  }
+
+  void relocate(std::vector<float> &point_xyz, std::vector<float> &point_size) {
+    // the arrays the tree was built on were swapped or moved to these
+    _ptr_point_xyz = &point_xyz;
+    _ptr_point_size = &point_size;
+  }
+
 private:
+  struct Centroids {
+    // centroids of a subtree built on a worker thread, the centroid indices
+    // of its nodes are into xyz until it's merged into the point array
+    std::vector<float> xyz;
+    std::vector<float> size;
+  };
+
+  struct Subtree {
+    unsigned int *indices;
+    unsigned char *labels;
+    unsigned int count;
+    float corner[3];
+    float size;
+    Node **node; // child slot of the parent where the subtree goes
+    Centroids centroids;
+  };
+
   static void traversalOrder(unsigned int (&nodeIndices)[8],
                              const float (&view)[3]) {
     int b[3][2];
@@ -316,6 +555,14 @@ private:
     return result;
   }
 
+  static float viewDepth(const float *xyz, const float (&eye)[3],
+                         const float (&view)[3]) {
+    // distance along -view
+    float d = 0.0f;
+    for (int dim = 0; dim < 3; dim++) d -= (xyz[dim] - eye[dim]) * view[dim];
+    return d;
+  }
+
   static float boxToPointDistance(const float (&box_center)[2],
                                   const float (&box_size)[2],
                                   const float (&point)[2]) {
@@ -508,22 +755,30 @@ private:
     }
     return left;
   }
-  unsigned int addCentroid(const float (&xyz)[3]) {
-    std::vector<float> &point_xyz = *_ptr_point_xyz;
+  unsigned int addCentroid(const float (&xyz)[3], const float size,
+                           Centroids *centroids = nullptr) {
+    // appends to the point array, or to the centroids of a subtree
+    std::vector<float> &point_xyz = centroids ? centroids->xyz : *_ptr_point_xyz;
+    std::vector<float> &point_size =
+            centroids ? centroids->size : *_ptr_point_size;
     unsigned int index = (unsigned int) point_xyz.size() / 3;
     for (unsigned int dim = 0; dim < 3; dim++)
       point_xyz.push_back(xyz[dim]);
+    point_size.push_back(size);
     return index;
   }
-  void computeCentroid(float (&centroid_xyz)[3], Node *children[]) {
+  void computeCentroid(float (&centroid_xyz)[3], Node *children[],
+                       const Centroids *centroids = nullptr) {
     // compute centroid from child node centroids
     // assumes children are valid
-    std::vector<float> &point_xyz = *_ptr_point_xyz;
+    const std::vector<float> &point_xyz =
+            centroids ? centroids->xyz : *_ptr_point_xyz;
     centroid_xyz[0] = centroid_xyz[1] = centroid_xyz[2] = 0.0f;
     unsigned int count = 0;
     for (unsigned int i = 0; i < 8; i++) {
       if (children[i] == nullptr) continue;
-      float *child_centroid_xyz = &point_xyz[3 * children[i]->centroid_index];
+      const float *child_centroid_xyz =
+              &point_xyz[3 * children[i]->centroid_index];
       unsigned int child_count = children[i]->point_count;
       for (unsigned int dim = 0; dim < 3; dim++)
         centroid_xyz[dim] += child_centroid_xyz[dim] * child_count;
@@ -549,9 +804,14 @@ private:
 
   Node *buildTreeHelper(unsigned int *indices, unsigned char *labels,
                         const unsigned int count, const float (&cube_corner)[3],
-                        const float cube_size) {
-    std::vector<float> &point_xyz = *_ptr_point_xyz;
-    std::vector<float> &point_size = *_ptr_point_size;
+                        const float cube_size, Centroids *centroids = nullptr,
+                        std::vector<Subtree> *subtrees = nullptr,
+                        const unsigned int depth = 0) {
+    // centroids go to the point array, or to the buffer of a subtree built on
+    // a worker thread. With subtrees the nodes at PARALLEL_DEPTH are only
+    // recorded there, and the centroids of the inner nodes above them are
+    // left to finishCentroids
+    const std::vector<float> &point_xyz = *_ptr_point_xyz;
     Node *node;
     if (count == 0) {
       node = nullptr;
@@ -565,8 +825,7 @@ private:
       // compute centroid
       float centroid_xyz[3];
       computeCentroid(centroid_xyz, indices, count);
-      node->centroid_index = addCentroid(centroid_xyz);
-      point_size.push_back(cube_size);
+      node->centroid_index = addCentroid(centroid_xyz, cube_size, centroids);
 
       return node;
     } else {
@@ -602,28 +861,156 @@ private:
                 (i & 4) == 0 ? cube_corner[0] : cube_center[0],
                 (i & 2) == 0 ? cube_corner[1] : cube_center[1],
                 (i & 1) == 0 ? cube_corner[2] : cube_center[2]};
-        node->children[i] =
-                buildTreeHelper(ptr_indices, ptr_labels, child_counts[i],
-                                child_corner, 0.5f * cube_size);
+        if (subtrees && depth + 1 == PARALLEL_DEPTH) {
+          Subtree subtree = {ptr_indices, ptr_labels, child_counts[i],
+                             {child_corner[0], child_corner[1], child_corner[2]},
+                             0.5f * cube_size, &node->children[i], Centroids()};
+          if (child_counts[i] > 0) subtrees->push_back(subtree);
+        } else {
+          node->children[i] = buildTreeHelper(
+                  ptr_indices, ptr_labels, child_counts[i], child_corner,
+                  0.5f * cube_size, centroids, subtrees, depth + 1);
+        }
         ptr_indices += child_counts[i];
         ptr_labels += child_counts[i];
       }
+      if (subtrees) return node;
 
       // compute centroid
       float centroid_xyz[3] = {0.0f, 0.0f, 0.0f};
-      computeCentroid(centroid_xyz, node->children);
-      node->centroid_index = addCentroid(centroid_xyz);
-      point_size.push_back(cube_size);
+      computeCentroid(centroid_xyz, node->children, centroids);
+      node->centroid_index = addCentroid(centroid_xyz, cube_size, centroids);
     }
     return node;
   }
 
+  template <typename Function>
+  void parallelFor(std::size_t count, Function f) const {
+    // calls f(0), ..., f(count - 1) on a pool of threads, the calling one
+    // included, every thread takes the next index left
+    std::atomic<std::size_t> next(0);
+    auto work = [&f, &next, count]() {
+      for (std::size_t i = next++; i < count; i = next++) f(i);
+    };
+    unsigned int num_threads = _num_threads;
+    if (num_threads == 0)
+      num_threads = (std::max) (1u, std::thread::hardware_concurrency());
+    std::vector<std::thread> threads;
+    for (std::size_t i = 1; i < (std::min) ((std::size_t) num_threads, count);
+         i++)
+      threads.emplace_back(work);
+    work();
+    for (std::size_t i = 0; i < threads.size(); i++) threads[i].join();
+  }
+
+  void buildSubtrees(std::vector<Subtree> &subtrees) {
+    // the largest first. The subtrees have their own points and centroids,
+    // they share nothing
+    std::sort(subtrees.begin(), subtrees.end(),
+              [](const Subtree &a, const Subtree &b) { return a.count > b.count; });
+    parallelFor(subtrees.size(), [this, &subtrees](std::size_t i) {
+      Subtree &s = subtrees[i];
+      *s.node = buildTreeHelper(s.indices, s.labels, s.count, s.corner, s.size,
+                                &s.centroids);
+    });
+  }
+
+  void traverse(std::vector<Range> &ranges, const CameraFrustum &frustum,
+                const float eps, const ProjectionMode projection_mode,
+                const float fudge_factor) const {
+    // the first levels are traversed here, the subtrees below them by a pool
+    // of threads. Their ranges are spliced in where the first levels left
+    // an empty range for them, so the order is the one of a single pass
+    if (_num_points < PARALLEL_TRAVERSAL_MIN_POINTS) {
+      getIndicesHelper(ranges, _root, frustum, _lower_left_corner, _cube_size,
+                       eps, projection_mode, fudge_factor);
+      return;
+    }
+    std::vector<Range> first_levels;
+    std::vector<Traversal> subtrees;
+    getIndicesHelper(first_levels, _root, frustum, _lower_left_corner,
+                     _cube_size, eps, projection_mode, fudge_factor, UNCERTAIN,
+                     &subtrees);
+    parallelFor(subtrees.size(), [&](std::size_t i) {
+      Traversal &t = subtrees[i];
+      getIndicesHelper(t.ranges, t.node, frustum, t.corner, t.size, eps,
+                       projection_mode, fudge_factor, t.intersect_result);
+    });
+    std::size_t k = 0;
+    for (std::size_t i = 0; i < first_levels.size(); i++) {
+      const Range &r = first_levels[i];
+      if (r.count > 0) {
+        appendRange(ranges, r.first, r.count);
+        continue;
+      }
+      const std::vector<Range> &t = subtrees[k++].ranges;
+      for (std::size_t j = 0; j < t.size(); j++)
+        appendRange(ranges, t[j].first, t[j].count);
+    }
+  }
+
+  void flattenHelper(std::vector<FlatNode> &nodes, const Node *node) const {
+    std::size_t k = nodes.size();
+    FlatNode flat = {node->centroid_index, node->point_index, node->point_count,
+                     node->is_leaf ? 1u : 0u, {-1, -1, -1, -1, -1, -1, -1, -1}};
+    nodes.push_back(flat);
+    if (node->is_leaf) return;
+    for (int i = 0; i < 8; i++) {
+      if (!node->children[i]) continue;
+      nodes[k].children[i] = (int) nodes.size();
+      flattenHelper(nodes, node->children[i]);
+    }
+  }
+
+  bool restoreTreeHelper(Node *&node, const FlatNode *nodes,
+                         const std::size_t num_nodes, const std::size_t k) {
+    // children come after their parent, so a valid array has no cycles
+    const FlatNode &flat = nodes[k];
+    if (flat.centroid_index >= _ptr_point_size->size() ||
+        flat.point_index > _num_points ||
+        flat.point_count > _num_points - flat.point_index)
+      return false;
+    node = new Node();
+    node->centroid_index = flat.centroid_index;
+    node->point_index = flat.point_index;
+    node->point_count = flat.point_count;
+    node->is_leaf = flat.is_leaf != 0;
+    if (node->is_leaf) return true;
+    for (int i = 0; i < 8; i++) {
+      int child = flat.children[i];
+      if (child == -1) continue;
+      if (child <= (int) k || (std::size_t) child >= num_nodes ||
+          !restoreTreeHelper(node->children[i], nodes, num_nodes, child))
+        return false;
+    }
+    return true;
+  }
+
+  static void offsetCentroids(Node *node, const unsigned int offset) {
+    // the centroids of a subtree are moved to the point array
+    if (!node) return;
+    node->centroid_index += offset;
+    if (!node->is_leaf)
+      for (int i = 0; i < 8; i++) offsetCentroids(node->children[i], offset);
+  }
+
+  void finishCentroids(Node *node, const float cube_size,
+                       const unsigned int depth = 0) {
+    // centroids of the inner nodes above PARALLEL_DEPTH, once the subtrees
+    // are built
+    if (!node || node->is_leaf || depth >= PARALLEL_DEPTH) return;
+    for (int i = 0; i < 8; i++)
+      finishCentroids(node->children[i], 0.5f * cube_size, depth + 1);
+    float centroid_xyz[3] = {0.0f, 0.0f, 0.0f};
+    computeCentroid(centroid_xyz, node->children);
+    node->centroid_index = addCentroid(centroid_xyz, cube_size);
+  }
+
   static void deleteTree(Node *root) {
     if (!root) return;
-    if (root->is_leaf)
-      delete root;
-    else
+    if (!root->is_leaf)
       for (int i = 0; i < 8; i++) deleteTree(root->children[i]);
+    delete root;
   }
 
   static void boundProjectedAABB(
@@ -661,6 +1048,16 @@ private:
   enum IntersectResult { OUTSIDE = 0,
                          UNCERTAIN = 1,
                          INSIDE = 2 };
+
+  struct Traversal {
+    // subtree traversed on a worker thread, see traverse
+    const Node *node;
+    float corner[3];
+    float size;
+    IntersectResult intersect_result;
+    std::vector<Range> ranges;
+  };
+
   static IntersectResult intersectBoxes2D(const float (&box_1_center)[2],
                                           const float (&box_1_size)[2],
                                           const float (&box_2_center)[2],
@@ -714,15 +1111,28 @@ private:
     return false;
   }
 
+  static void appendRange(std::vector<Range> &ranges, unsigned int first,
+                          unsigned int count) {
+    if (count == 0) return;
+    if (!ranges.empty() && ranges.back().first + ranges.back().count == first)
+      ranges.back().count += count;
+    else
+      ranges.push_back(Range{first, count});
+  }
+
   void getIndicesHelper(
-          std::vector<unsigned int> &indices, const Node *node,
+          std::vector<Range> &ranges, const Node *node,
           const CameraFrustum &frustum, const float (&cube_corner)[3],
           const float cube_size,
           const float eps, // measured on z = 1 image plane
           const ProjectionMode projection_mode = PERSPECTIVE,
           const float fudge_factor =
                   0.25f, // factor by which projected area is reduced
-          const IntersectResult parent_intersect_result = UNCERTAIN) const {
+          const IntersectResult parent_intersect_result = UNCERTAIN,
+          std::vector<Traversal> *subtrees = nullptr,
+          const unsigned int depth = 0) const {
+    // with subtrees the nodes at PARALLEL_DEPTH are left to traverse, an
+    // empty range marks the place of their ranges
     // TODO: this results in redundant calls to xyz2ruv
     // consider performing frustum culling prior to recursing
     // bool in_frustum = cubeInFrustum(cube_corner, cube_size, frustum);
@@ -787,10 +1197,9 @@ private:
     else
       adjusted_cube_size = fudge_factor * cube_size;
     if (adjusted_cube_size < eps) {
-      indices.push_back(node->centroid_index);
+      appendRange(ranges, node->centroid_index, 1);
     } else if (node->is_leaf) {
-      for (unsigned int i = 0; i < node->point_count; i++)
-        indices.push_back(node->point_index + i);
+      appendRange(ranges, node->point_index, node->point_count);
     } else { // inner node
       unsigned int b[3][2];
       if (projection_mode == PERSPECTIVE) {
@@ -829,15 +1238,105 @@ private:
                     b[1][j] == 0 ? cube_corner[1] : cube_center[1],
                     b[2][k] == 0 ? cube_corner[2] : cube_center[2]};
             if (!node->children[node_index]) continue;
-            getIndicesHelper(indices, node->children[node_index], frustum,
+            if (subtrees && depth + 1 == PARALLEL_DEPTH) {
+              Traversal t;
+              t.node = node->children[node_index];
+              for (int dim = 0; dim < 3; dim++) t.corner[dim] = child_corner[dim];
+              t.size = 0.5f * cube_size;
+              t.intersect_result = intersect_result;
+              subtrees->push_back(t);
+              ranges.push_back(Range{~0u, 0}); // nothing merges into it
+              continue;
+            }
+            getIndicesHelper(ranges, node->children[node_index], frustum,
                              child_corner, 0.5f * cube_size, eps,
-                             projection_mode, fudge_factor, intersect_result);
+                             projection_mode, fudge_factor, intersect_result,
+                             subtrees, depth + 1);
           }
         }
       }
     }
   }
 
+  IntersectResult intersectBox(const float (&cube_corner)[3],
+                               const float cube_size, const float (&mvp)[16],
+                               const float (&box)[4]) const {
+    // the cube against the planes bounding the box in clip space, where they
+    // are linear and a cube is inside (outside) one of them when all its
+    // corners are. The cube is padded for the rounding of the build and the
+    // planes by BOX_MARGIN, the nodes close to them are UNCERTAIN
+    float pad = 1e-6f * (cube_size + (std::max) ({fabsf(cube_corner[0]),
+                                                  fabsf(cube_corner[1]),
+                                                  fabsf(cube_corner[2])}));
+    const float *m = mvp;
+    unsigned int inside = 0; // corners inside all planes
+    unsigned int outside[6] = {0, 0, 0, 0, 0, 0};
+    for (int c = 0; c < 8; c++) {
+      float xyz[3];
+      for (int dim = 0; dim < 3; dim++)
+        xyz[dim] = (c >> (2 - dim)) & 1 ? cube_corner[dim] + cube_size + pad
+                                        : cube_corner[dim] - pad;
+      float p[4];
+      for (int i = 0; i < 4; i++)
+        p[i] = xyz[0] * m[i] + xyz[1] * m[4 + i] + xyz[2] * m[8 + i] + m[12 + i];
+      float d[6] = {p[0] - box[0] * p[3], box[2] * p[3] - p[0],
+                    p[1] - box[1] * p[3], box[3] * p[3] - p[1],
+                    p[2] + p[3], p[3] - p[2]};
+      float margin = BOX_MARGIN * fabsf(p[3]);
+      bool corner_inside = true;
+      for (int i = 0; i < 6; i++) {
+        if (d[i] < -margin) outside[i]++;
+        if (d[i] <= margin) corner_inside = false;
+      }
+      inside += corner_inside;
+    }
+    for (int i = 0; i < 6; i++)
+      if (outside[i] == 8) return OUTSIDE;
+    return inside == 8 ? INSIDE : UNCERTAIN;
+  }
+
+  static void appendCentroids(std::vector<Range> &ranges, const Node *node) {
+    appendRange(ranges, node->centroid_index, 1);
+    if (node->is_leaf) return;
+    for (int i = 0; i < 8; i++)
+      if (node->children[i]) appendCentroids(ranges, node->children[i]);
+  }
+
+  void getIndicesInBoxHelper(std::vector<Range> &ranges, const Node *node,
+                             const float (&cube_corner)[3],
+                             const float cube_size, const float (&mvp)[16],
+                             const float (&box)[4]) const {
+    IntersectResult intersect_result =
+            intersectBox(cube_corner, cube_size, mvp, box);
+    if (intersect_result == OUTSIDE) return;
+    if (intersect_result == INSIDE) {
+      appendRange(ranges, node->point_index, node->point_count);
+      appendCentroids(ranges, node);
+      return;
+    }
+    const std::vector<float> &xyz = *_ptr_point_xyz;
+    if (projectsInBox(&xyz[3 * node->centroid_index], mvp, box))
+      appendRange(ranges, node->centroid_index, 1);
+    if (node->is_leaf) {
+      for (unsigned int i = 0; i < node->point_count; i++) {
+        unsigned int k = node->point_index + i;
+        if (projectsInBox(&xyz[3 * k], mvp, box)) appendRange(ranges, k, 1);
+      }
+      return;
+    }
+    float cube_center[3];
+    for (int dim = 0; dim < 3; dim++)
+      cube_center[dim] = cube_corner[dim] + 0.5f * cube_size;
+    for (int i = 0; i < 8; i++) {
+      if (!node->children[i]) continue;
+      float child_corner[3] = {(i & 4) == 0 ? cube_corner[0] : cube_center[0],
+                               (i & 2) == 0 ? cube_corner[1] : cube_center[1],
+                               (i & 1) == 0 ? cube_corner[2] : cube_center[2]};
+      getIndicesInBoxHelper(ranges, node->children[i], child_corner,
+                            0.5f * cube_size, mvp, box);
+    }
+  }
+
   unsigned int countNodesHelper(const Node *node, bool count_leaf = true) {
     if (!node)
       return 0;
@@ -858,6 +1357,7 @@ private:
 
   float _lower_left_corner[3];
   float _cube_size;
+  unsigned int _num_threads; // see setNumThreads
 
   // scratch space for buildTreeHelper
   std::vector<unsigned int> _indices;
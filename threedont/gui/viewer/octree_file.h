@@ -0,0 +1,149 @@
+#ifndef __OCTREEFILE_H__
+#define __OCTREEFILE_H__
+#include "octree.h"
+#include <QDebug>
+#include <QFile>
+#include <QSaveFile>
+#include <QString>
+#include <QtGlobal>
+#include <cstring>
+#include <vector>
+
+// the octree of a cloud saved next to the point cache of the project, so
+// opening it again skips the build. The file holds the points and LOD
+// centroids in octree order, their sizes, the octree to original index
+// mapping and the nodes, it's only used for the positions it was built on
+// (same fingerprint). Layout: Header, then
+//   float point_xyz[3 * num_xyz], float point_size[num_xyz],
+//   quint32 indices[num_points], Octree::FlatNode nodes[num_nodes]
+class OctreeFile {
+public:
+  static const quint32 VERSION = 1;
+
+  static quint64 fingerprint(const std::vector<float> &positions) {
+    // FNV-1a over the bits of the coordinates, 64 bits at a time
+    quint64 h = 14695981039346656037ULL;
+    const quint64 prime = 1099511628211ULL;
+    std::size_t n = positions.size() * sizeof(float);
+    const char *data = (const char *) positions.data();
+    std::size_t i = 0;
+    for (; i + sizeof(quint64) <= n; i += sizeof(quint64)) {
+      quint64 word;
+      std::memcpy(&word, data + i, sizeof(quint64));
+      h = (h ^ word) * prime;
+    }
+    for (; i < n; i++) h = (h ^ (unsigned char) data[i]) * prime;
+    return (h ^ positions.size()) * prime;
+  }
+
+  static bool save(const QString &path, quint64 fingerprint,
+                   const Octree &octree) {
+    // written to a temporary file and renamed, a file being read is never
+    // truncated
+    std::vector<Octree::FlatNode> nodes;
+    octree.flatten(nodes);
+    const std::vector<float> &point_xyz = octree.getPointPos();
+    const std::vector<float> &point_size = octree.getPointSizes();
+    Header header = makeHeader(fingerprint, octree.getNumPoints(),
+                               point_size.size(), nodes.size());
+    header.max_leaf_size = octree.getMaxLeafSize();
+    for (int dim = 0; dim < 3; dim++) header.corner[dim] = octree.getCorner()[dim];
+    header.cube_size = octree.getCubeSize();
+
+    QSaveFile file(path);
+    if (!file.open(QIODevice::WriteOnly) ||
+        !write(file, &header, sizeof(Header)) ||
+        !write(file, point_xyz.data(), point_xyz.size() * sizeof(float)) ||
+        !write(file, point_size.data(), point_size.size() * sizeof(float)) ||
+        !write(file, octree.getIndices().data(),
+               octree.getIndices().size() * sizeof(quint32)) ||
+        !write(file, nodes.data(), nodes.size() * sizeof(Octree::FlatNode)) ||
+        !file.commit()) {
+      qWarning() << "OctreeFile: cannot write" << path << file.errorString();
+      return false;
+    }
+    return true;
+  }
+
+  static bool load(const QString &path, quint64 fingerprint,
+                   std::size_t num_points, Octree &octree,
+                   std::vector<float> &point_xyz,
+                   std::vector<float> &point_size) {
+    // returns false if there is no file for these positions, point_xyz and
+    // point_size are left empty then
+    QFile file(path);
+    if (!file.open(QIODevice::ReadOnly)) return false;
+    qint64 file_size = file.size();
+    if (file_size < (qint64) sizeof(Header)) return false;
+    const uchar *data = file.map(0, file_size);
+    if (!data) return false;
+    Header header;
+    std::memcpy(&header, data, sizeof(Header));
+    Header expected = makeHeader(fingerprint, num_points, header.num_xyz,
+                                 header.num_nodes);
+    if (std::memcmp(header.magic, expected.magic, sizeof(header.magic)) ||
+        header.version != VERSION || header.fingerprint != fingerprint ||
+        header.num_points != num_points || header.num_xyz < num_points ||
+        header.num_xyz > (quint64) file_size ||
+        header.num_nodes > (quint64) file_size ||
+        expected.file_size != (quint64) file_size) {
+      file.unmap((uchar *) data);
+      return false;
+    }
+
+    const uchar *p = data + sizeof(Header);
+    point_xyz.assign((const float *) p, (const float *) p + 3 * header.num_xyz);
+    p += point_xyz.size() * sizeof(float);
+    point_size.assign((const float *) p, (const float *) p + header.num_xyz);
+    p += point_size.size() * sizeof(float);
+    const unsigned int *indices = (const unsigned int *) p;
+    p += num_points * sizeof(quint32);
+    bool valid = octree.restoreTree(
+            point_xyz, point_size, (unsigned int) num_points, indices,
+            (const Octree::FlatNode *) p, (std::size_t) header.num_nodes,
+            header.corner, header.cube_size, header.max_leaf_size);
+    file.unmap((uchar *) data);
+    if (!valid) {
+      qWarning() << "OctreeFile: ignoring the invalid octree in" << path;
+      point_xyz.clear();
+      point_size.clear();
+    }
+    return valid;
+  }
+
+private:
+  struct Header {
+    char magic[8];
+    quint32 version;
+    quint32 max_leaf_size;
+    quint64 fingerprint;
+    quint64 num_points;
+    quint64 num_xyz; // points and centroids
+    quint64 num_nodes;
+    quint64 file_size;
+    float corner[3];
+    float cube_size;
+  };
+
+  static Header makeHeader(quint64 fingerprint, quint64 num_points,
+                           quint64 num_xyz, quint64 num_nodes) {
+    Header header;
+    std::memset(&header, 0, sizeof(Header));
+    std::memcpy(header.magic, "3DOCTREE", sizeof(header.magic));
+    header.version = VERSION;
+    header.fingerprint = fingerprint;
+    header.num_points = num_points;
+    header.num_xyz = num_xyz;
+    header.num_nodes = num_nodes;
+    header.file_size = sizeof(Header) + 4 * num_xyz * sizeof(float) +
+                       num_points * sizeof(quint32) +
+                       num_nodes * sizeof(Octree::FlatNode);
+    return header;
+  }
+
+  static bool write(QSaveFile &file, const void *data, std::size_t size) {
+    return size == 0 || file.write((const char *) data, (qint64) size) == (qint64) size;
+  }
+};
+
+#endif // __OCTREEFILE_H__
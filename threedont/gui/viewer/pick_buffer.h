@@ -0,0 +1,153 @@
+#ifndef __PICKBUFFER_H__
+#define __PICKBUFFER_H__
+#include "opengl_funcs.h"
+#include <QOpenGLContext>
+#include <QWindow>
+#include <QtGlobal>
+#include <algorithm>
+#include <vector>
+
+// offscreen framebuffer the ids of the points are drawn into, with a depth
+// buffer so that every pixel keeps the nearest one. An id is packed in the
+// bytes of an rgba color, the lowest in red, which needs no integer formats
+class PickBuffer : protected OpenGLFuncs {
+public:
+  static const quint32 NO_ID = 0xffffffff; // where nothing was drawn
+
+  PickBuffer(QWindow *window, QOpenGLContext *context)
+      : _context(context),
+        _window(window),
+        _framebuffer(0),
+        _color(0),
+        _depth(0),
+        _width(0),
+        _height(0),
+        _valid(false) {
+    _context->makeCurrent(_window);
+    initializeOpenGLFunctions();
+    _context->doneCurrent();
+  }
+
+  ~PickBuffer() {
+    _context->makeCurrent(_window);
+    deallocate();
+    _context->doneCurrent();
+  }
+
+  int width() const { return _width; }
+  int height() const { return _height; }
+
+  // the ids of a draw are kept until invalidated
+  bool valid() const { return _valid; }
+  void invalidate() { _valid = false; }
+
+  bool bind(int width, int height) {
+    // assumes context is current. Sizes the framebuffer to width x height
+    // pixels, binds and clears it. Returns false if it can't be drawn to
+    _valid = false;
+    if (width <= 0 || height <= 0) return false;
+    if (width != _width || height != _height) allocate(width, height);
+    glGetIntegerv(GL_VIEWPORT, _viewport);
+    glBindFramebuffer(GL_FRAMEBUFFER, _framebuffer);
+    if (glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE) {
+      glBindFramebuffer(GL_FRAMEBUFFER, _context->defaultFramebufferObject());
+      return false;
+    }
+    glViewport(0, 0, _width, _height);
+    glClearColor(1.0f, 1.0f, 1.0f, 1.0f); // NO_ID
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+    return true;
+  }
+
+  void release() {
+    // assumes context is current, the window is drawn to again and the ids
+    // drawn since bind are valid
+    glBindFramebuffer(GL_FRAMEBUFFER, _context->defaultFramebufferObject());
+    glViewport(_viewport[0], _viewport[1], _viewport[2], _viewport[3]);
+    _valid = true;
+  }
+
+  quint32 pick(int x, int y, int radius) {
+    // assumes context is current. Returns the nearest of the ids drawn
+    // within radius pixels of pixel (x, y), counted from the bottom left,
+    // NO_ID if none
+    if (!_valid) return NO_ID;
+    int x0 = (std::max) (x - radius, 0);
+    int y0 = (std::max) (y - radius, 0);
+    int x1 = (std::min) (x + radius, _width - 1);
+    int y1 = (std::min) (y + radius, _height - 1);
+    if (x0 > x1 || y0 > y1) return NO_ID;
+    int w = x1 - x0 + 1;
+    int h = y1 - y0 + 1;
+    _colors.resize(4 * w * h);
+    _depths.resize(w * h);
+    glBindFramebuffer(GL_FRAMEBUFFER, _framebuffer);
+    glReadPixels(x0, y0, w, h, GL_RGBA, GL_UNSIGNED_BYTE, &_colors[0]);
+    glReadPixels(x0, y0, w, h, GL_DEPTH_COMPONENT, GL_FLOAT, &_depths[0]);
+    glBindFramebuffer(GL_FRAMEBUFFER, _context->defaultFramebufferObject());
+
+    quint32 id = NO_ID;
+    float depth_min = 0.0f;
+    for (int i = 0; i < h; i++)
+      for (int j = 0; j < w; j++) {
+        int dx = x0 + j - x;
+        int dy = y0 + i - y;
+        if (dx * dx + dy * dy > radius * radius) continue;
+        const unsigned char *c = &_colors[4 * (i * w + j)];
+        quint32 pixel_id = (quint32) c[0] | (quint32) c[1] << 8 |
+                           (quint32) c[2] << 16 | (quint32) c[3] << 24;
+        if (pixel_id == NO_ID) continue;
+        if (id == NO_ID || _depths[i * w + j] < depth_min) {
+          id = pixel_id;
+          depth_min = _depths[i * w + j];
+        }
+      }
+    return id;
+  }
+
+private:
+  void allocate(int width, int height) {
+    deallocate();
+    _width = width;
+    _height = height;
+    glGenRenderbuffers(1, &_color);
+    glBindRenderbuffer(GL_RENDERBUFFER, _color);
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, _width, _height);
+    glGenRenderbuffers(1, &_depth);
+    glBindRenderbuffer(GL_RENDERBUFFER, _depth);
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, _width,
+                          _height);
+    glBindRenderbuffer(GL_RENDERBUFFER, 0);
+    glGenFramebuffers(1, &_framebuffer);
+    glBindFramebuffer(GL_FRAMEBUFFER, _framebuffer);
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0,
+                              GL_RENDERBUFFER, _color);
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
+                              GL_RENDERBUFFER, _depth);
+    glBindFramebuffer(GL_FRAMEBUFFER, _context->defaultFramebufferObject());
+  }
+
+  void deallocate() {
+    if (_framebuffer == 0) return;
+    glDeleteFramebuffers(1, &_framebuffer);
+    glDeleteRenderbuffers(1, &_color);
+    glDeleteRenderbuffers(1, &_depth);
+    _framebuffer = _color = _depth = 0;
+    _width = _height = 0;
+    _valid = false;
+  }
+
+  QOpenGLContext *_context;
+  QWindow *_window;
+  GLuint _framebuffer;
+  GLuint _color;
+  GLuint _depth;
+  int _width;
+  int _height;
+  GLint _viewport[4]; // of the window, restored by release
+  bool _valid;
+  std::vector<unsigned char> _colors; // read by pick
+  std::vector<float> _depths;
+};
+
+#endif // __PICKBUFFER_H__
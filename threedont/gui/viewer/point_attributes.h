@@ -1,25 +1,35 @@
 #ifndef __POINTATTRIBUTES_H__
 #define __POINTATTRIBUTES_H__
 #include "octree.h"
-#include <QVector3D>
-#include <QVector4D>
 #include <QtGlobal>
 #include <algorithm>
+#include <cstring>
 #include <vector>
 
 class PointAttributes {
+public:
+  // how the values of an attribute set are stored, on the wire and on the
+  // gpu. Normalized integers are read as values in [0, 1], the indices of a
+  // categorical set select a color of the palette of the set
+  enum Encoding {
+    FLOAT32 = 0,
+    UNORM8 = 1,
+    UNORM16 = 2,
+    FLOAT16 = 3,
+    INDEX8 = 4,
+    INDEX16 = 5
+  };
+
 private:
-  std::vector<std::vector<float>> _attr;
+  std::vector<std::vector<unsigned char>> _attr; // raw values, see Encoding
   std::vector<quint64> _attr_size;
   std::vector<quint64> _attr_dim;
+  std::vector<Encoding> _attr_encoding;
+  std::vector<std::vector<float>> _attr_palette; // rgba, categorical sets only
   std::size_t _curr_idx;
 
 public:
-  PointAttributes()
-      : _attr(1, std::vector<float>(4, 1.0f)),
-        _attr_size(1, 1),
-        _attr_dim(1, 4),
-        _curr_idx(0) {}
+  PointAttributes() { reset(); }
 
   bool set(const std::vector<float> &attr, quint64 attr_size,
            quint64 attr_dim) {
@@ -27,19 +37,30 @@ public:
     _attr.clear();
     _attr_size.clear();
     _attr_dim.clear();
-    _attr.resize(1, attr);
+    _attr_encoding.clear();
+    _attr_palette.clear();
+    _attr.resize(1, _float_bytes(attr));
     _attr_size.resize(1, attr_size);
     _attr_dim.resize(1, attr_dim);
+    _attr_encoding.resize(1, FLOAT32);
+    _attr_palette.resize(1);
     _curr_idx = 0;
     return true;
   }
 
   bool set(const std::vector<char> &data, const Octree &octree) {
-    // overwrites existing attributes
+    if (data.empty()) return false;
+    return set(&data[0], data.size(), octree);
+  }
+
+  bool set(const char *data, std::size_t size, const Octree &octree,
+           bool typed = false) {
+    // overwrites existing attributes, data is only read. The payload holds
+    // float32 values, or with typed the encoding of every set (see _unpack)
     unsigned int num_points = octree.getNumPoints();
 
     // fill in _attr* arrays
-    if (!_unpack(data, num_points)) return false;
+    if (!_unpack(data, size, num_points, typed)) return false;
 
     // nothing to do if there are no points in octree
     if (num_points == 0) return true;
@@ -68,84 +89,116 @@ public:
     _attr.clear();
     _attr_size.clear();
     _attr_dim.clear();
-    _attr.resize(1, std::vector<float>(4, 1.0f));
+    _attr_encoding.clear();
+    _attr_palette.clear();
+    _attr.resize(1, _float_bytes(std::vector<float>(4, 1.0f)));
     _attr_size.resize(1, 1);
     _attr_dim.resize(1, 4);
+    _attr_encoding.resize(1, FLOAT32);
+    _attr_palette.resize(1);
     _curr_idx = 0;
   }
 
-  const std::vector<float> &operator[](int i) const { return _attr[i]; }
+  // raw values of the k-th attribute set, points followed by LOD centroids
+  const std::vector<unsigned char> &values(int k) const { return _attr[k]; }
 
   float operator()(int i, int j) const {
     // return j-th component of i-th attribute in current attribute set
-    quint64 dim = _attr_dim[_curr_idx];
-    quint64 size = _attr_size[_curr_idx];
-    if (size == 1)
-      return _attr[_curr_idx][j];
-    else
-      return _attr[_curr_idx][i * dim + j];
+    return (*this)((int) _curr_idx, i, j);
   }
 
   float operator()(int k, int i, int j) const {
-    // return j-th component of i-th attribute in k-th attribute set
+    // return j-th component of i-th attribute in k-th attribute set,
+    // decoded to float (the index for categorical sets)
     quint64 dim = _attr_dim[k];
     quint64 size = _attr_size[k];
     if (size == 1)
-      return _attr[k][j];
+      return _decode(k, j);
     else
-      return _attr[k][i * dim + j];
+      return _decode(k, i * dim + j);
   }
 
   std::size_t currentIndex() const { return _curr_idx; }
   quint64 size(int i) const { return _attr_size[i]; }
   quint64 dim(int i) const { return _attr_dim[i]; }
+  Encoding encoding(int i) const { return _attr_encoding[i]; }
+  bool isCategorical(int i) const {
+    return _attr_encoding[i] == INDEX8 || _attr_encoding[i] == INDEX16;
+  }
+  const std::vector<float> &palette(int i) const { return _attr_palette[i]; }
+  std::size_t elementSize(int i) const {
+    return _element_size(_attr_encoding[i]);
+  }
   std::size_t numAttributes() const { return _attr.size(); }
   void setCurrentIndex(std::size_t i) {
     if (i < _attr.size() && i >= 0) _curr_idx = i;
   }
 
 private:
-  bool _unpack(const std::vector<char> &data, unsigned int expected_size) {
-    if (data.empty()) return false;
+  bool _unpack(const char *data, std::size_t size, unsigned int expected_size,
+               bool typed) {
+    if (data == nullptr || size == 0) return false;
 
     // initialize ptr into data stream
-    const char *ptr = (char *) &data[0];
-    const char *ptr_end = ptr + data.size();
+    const char *ptr = data;
+    const char *ptr_end = ptr + size;
 
     // get number of attribute sets
     quint64 num_attr;
     if (!_unpack_number(num_attr, ptr, ptr_end)) return false;
 
     // parse attribute sets
-    std::vector<std::vector<float>> attr(num_attr);
+    std::vector<std::vector<unsigned char>> attr(num_attr);
     std::vector<quint64> attr_size(num_attr);
     std::vector<quint64> attr_dim(num_attr);
+    std::vector<Encoding> attr_encoding(num_attr, FLOAT32);
+    std::vector<std::vector<float>> attr_palette(num_attr);
     for (quint64 i = 0; i < num_attr; i++) {
       // record attribute size of current set
       if (!_unpack_number(attr_size[i], ptr, ptr_end)) return false;
       if (attr_size[i] != expected_size && attr_size[i] != 1) return false;
 
-      // record attribute dimension of current set
+      // record attribute dimension of current set, at most rgba
       if (!_unpack_number(attr_dim[i], ptr, ptr_end)) return false;
+      if (attr_dim[i] == 0 || attr_dim[i] > 4) return false;
+
+      if (typed) {
+        // record encoding of current set, and the rgba palette of the
+        // categorical ones
+        quint64 encoding;
+        if (!_unpack_number(encoding, ptr, ptr_end)) return false;
+        if (encoding > INDEX16) return false;
+        attr_encoding[i] = (Encoding) encoding;
+        if (encoding == INDEX8 || encoding == INDEX16) {
+          quint64 palette_size;
+          if (!_unpack_number(palette_size, ptr, ptr_end)) return false;
+          if (attr_dim[i] != 1 || palette_size == 0) return false;
+          attr_palette[i].resize(4 * palette_size);
+          if (!_unpack_array(attr_palette[i], ptr, ptr_end)) return false;
+        }
+      }
 
       // record attribute values
-      attr[i].resize(attr_size[i] * attr_dim[i]);
+      attr[i].resize(attr_size[i] * attr_dim[i] *
+                     _element_size(attr_encoding[i]));
       if (!_unpack_array(attr[i], ptr, ptr_end)) return false;
     }
     _attr.swap(attr);
     _attr_size.swap(attr_size);
     _attr_dim.swap(attr_dim);
+    _attr_encoding.swap(attr_encoding);
+    _attr_palette.swap(attr_palette);
     return true;
   }
 
   void _reorder(std::size_t attr_idx, const Octree &octree) {
     // assumes _attr_size[attr_idx] > 1
-    std::vector<float> &attr = _attr[attr_idx];
-    std::vector<float> temp(attr.size());
-    quint64 dim = _attr_dim[attr_idx];
+    std::vector<unsigned char> &attr = _attr[attr_idx];
+    std::vector<unsigned char> temp(attr.size());
+    std::size_t stride = _attr_dim[attr_idx] * elementSize((int) attr_idx);
     for (quint64 j = 0; j < _attr_size[attr_idx]; j++)
-      for (quint64 k = 0; k < dim; k++)
-        temp[j * dim + k] = attr[octree.getIndices()[j] * dim + k];
+      std::memcpy(&temp[j * stride], &attr[octree.getIndices()[j] * stride],
+                  stride);
     attr.swap(temp);
   }
 
@@ -154,84 +207,178 @@ private:
     std::size_t num_centroids =
             octree.getPointPos().size() / 3 - octree.getNumPoints();
     _attr[attr_idx].resize(_attr[attr_idx].size() +
-                           _attr_dim[attr_idx] * num_centroids);
-    if (false && _attr_dim[attr_idx] == 4)
-      // disable LOD approximation of alpha transparency for now
-      _compute_rgba_LOD_helper(attr_idx, octree.getRoot());
-    else
-      _compute_LOD_helper(attr_idx, octree.getRoot());
+                           _attr_dim[attr_idx] * num_centroids *
+                                   elementSize((int) attr_idx));
+    _compute_LOD_helper(attr_idx, octree.getRoot());
   }
 
-  void _compute_rgba_LOD_helper(std::size_t attr_idx,
-                                const Octree::Node *node) {
+  void _compute_LOD_helper(std::size_t attr_idx, const Octree::Node *node) {
     if (node == nullptr) return;
+    if (!node->is_leaf)
+      for (unsigned int i = 0; i < 8; i++)
+        _compute_LOD_helper(attr_idx, node->children[i]);
+    _compute_node_LOD(attr_idx, node);
+  }
 
-    std::vector<float> &attr = _attr[attr_idx];
+  void _compute_node_LOD(std::size_t attr_idx, const Octree::Node *node) {
+    // average of the points of a leaf, or of the centroids of the children
+    // (already computed) weighted by their point count
     quint64 dim = _attr_dim[attr_idx];
-    float *dst = &attr[dim * node->centroid_index];
-    dst[0] = dst[1] = dst[2] = 0.0f;
-    dst[3] = 1.0f;
-    if (node->is_leaf) {
-      QVector3D x = QVector3D(0.0f, 0.0f, 0.0f);
-      float w = 1.0f;
-      for (unsigned int i = 0; i < node->point_count; i++)
-        _accumulate_rgba(x, w, &attr[4 * (node->point_index + i)]);
-      _xw_to_rgba(dst, x, w, node->point_count);
-    } else { // !node->is_leaf
-      //_compute_inner_rgba(dst, node);
-      QVector3D x = QVector3D(0.0f, 0.0f, 0.0f);
-      float w = 1.0f;
-      unsigned int num_children = 0;
-      for (unsigned int i = 0; i < 8; i++) {
-        if (node->children[i] == nullptr) continue;
-        num_children++;
-        _compute_rgba_LOD_helper(attr_idx, node->children[i]);
-        _accumulate_rgba(x, w, &attr[4 * node->children[i]->centroid_index]);
+    std::size_t dst = dim * node->centroid_index;
+    if (isCategorical((int) attr_idx)) {
+      // indices can't be averaged, a centroid takes the category of its
+      // first point
+      std::size_t src = node->point_index;
+      for (unsigned int i = 0; !node->is_leaf && i < 8; i++) {
+        if (!node->children[i]) continue;
+        src = node->children[i]->centroid_index;
+        break;
       }
-      _xw_to_rgba(dst, x, w, num_children);
+      _encode(attr_idx, dst, _decode(attr_idx, src));
+      return;
     }
-  }
-
-  void _compute_LOD_helper(std::size_t attr_idx, const Octree::Node *node) {
-    if (node == nullptr) return;
-
-    std::vector<float> &attr = _attr[attr_idx];
-    quint64 dim = _attr_dim[attr_idx];
-    float *dst = &attr[dim * node->centroid_index];
-    std::fill_n(dst, dim, 0.0f);
+    float sum[4] = {0.0f, 0.0f, 0.0f, 0.0f};
     if (node->is_leaf) {
       for (unsigned int i = 0; i < node->point_count; i++)
         for (quint64 j = 0; j < dim; j++)
-          dst[j] += attr[(node->point_index + i) * dim + j];
-      for (quint64 i = 0; i < dim; i++) dst[i] /= node->point_count;
+          sum[j] += _decode(attr_idx, (node->point_index + i) * dim + j);
+      for (quint64 j = 0; j < dim; j++) sum[j] /= node->point_count;
     } else { // !node->is_leaf
-      std::vector<float> w(8, 0.0f);
-      for (std::size_t i = 0; i < 8; i++) {
-        if (!node->children[i]) continue;
-        w[i] = (float) node->children[i]->point_count / node->point_count;
-      }
       for (unsigned int i = 0; i < 8; i++) {
         Octree::Node *child = node->children[i];
         if (!child) continue;
-        _compute_LOD_helper(attr_idx, child);
-        float w = (float) node->children[i]->point_count / node->point_count;
+        float w = (float) child->point_count / node->point_count;
         for (quint64 j = 0; j < dim; j++)
-          dst[j] += w * attr[child->centroid_index * dim + j];
+          sum[j] += w * _decode(attr_idx, child->centroid_index * dim + j);
       }
     }
+    for (quint64 j = 0; j < dim; j++) _encode(attr_idx, dst + j, sum[j]);
   }
 
-  inline void _accumulate_rgba(QVector3D &x, float &w, const float *v) {
-    for (int i = 0; i < 3; i++) x[i] += v[i];
-    w *= (1.0f - v[3]);
+  static std::size_t _element_size(Encoding encoding) {
+    switch (encoding) {
+      case UNORM8:
+      case INDEX8:
+        return 1;
+      case UNORM16:
+      case FLOAT16:
+      case INDEX16:
+        return 2;
+      default:
+        return 4;
+    }
+  }
+
+  float _decode(std::size_t attr_idx, std::size_t i) const {
+    // i-th component of an attribute set, in any encoding
+    const unsigned char *p = &_attr[attr_idx][i * elementSize((int) attr_idx)];
+    quint16 v16;
+    float v;
+    switch (_attr_encoding[attr_idx]) {
+      case UNORM8:
+        return p[0] / 255.0f;
+      case INDEX8:
+        return p[0];
+      case UNORM16:
+        std::memcpy(&v16, p, sizeof(v16));
+        return v16 / 65535.0f;
+      case INDEX16:
+        std::memcpy(&v16, p, sizeof(v16));
+        return v16;
+      case FLOAT16:
+        std::memcpy(&v16, p, sizeof(v16));
+        return _half_to_float(v16);
+      default:
+        std::memcpy(&v, p, sizeof(v));
+        return v;
+    }
+  }
+
+  void _encode(std::size_t attr_idx, std::size_t i, float v) {
+    // overwrites the i-th component of an attribute set, rounding v to the
+    // nearest value of its encoding
+    unsigned char *p = &_attr[attr_idx][i * elementSize((int) attr_idx)];
+    quint16 v16;
+    switch (_attr_encoding[attr_idx]) {
+      case UNORM8:
+        p[0] = (unsigned char) (qBound(0.0f, v, 1.0f) * 255.0f + 0.5f);
+        return;
+      case INDEX8:
+        p[0] = (unsigned char) qBound(0.0f, v + 0.5f, 255.0f);
+        return;
+      case UNORM16:
+        v16 = (quint16) (qBound(0.0f, v, 1.0f) * 65535.0f + 0.5f);
+        break;
+      case INDEX16:
+        v16 = (quint16) qBound(0.0f, v + 0.5f, 65535.0f);
+        break;
+      case FLOAT16:
+        v16 = _float_to_half(v);
+        break;
+      default:
+        std::memcpy(p, &v, sizeof(v));
+        return;
+    }
+    std::memcpy(p, &v16, sizeof(v16));
+  }
+
+  static float _half_to_float(quint16 h) {
+    quint32 sign = (quint32) (h & 0x8000) << 16;
+    quint32 exponent = (h >> 10) & 0x1f;
+    quint32 mantissa = h & 0x3ff;
+    quint32 bits;
+    if (exponent == 0x1f) { // inf or nan
+      bits = sign | 0x7f800000 | (mantissa << 13);
+    } else if (exponent != 0) {
+      bits = sign | ((exponent + 112) << 23) | (mantissa << 13);
+    } else if (mantissa == 0) {
+      bits = sign;
+    } else { // subnormal, normalized for float
+      exponent = 113;
+      while (!(mantissa & 0x400)) {
+        mantissa <<= 1;
+        exponent--;
+      }
+      bits = sign | (exponent << 23) | ((mantissa & 0x3ff) << 13);
+    }
+    float f;
+    std::memcpy(&f, &bits, sizeof(f));
+    return f;
+  }
+
+  static quint16 _float_to_half(float f) {
+    // rounds to nearest even
+    quint32 bits;
+    std::memcpy(&bits, &f, sizeof(bits));
+    quint16 sign = (bits >> 16) & 0x8000;
+    int exponent = (int) ((bits >> 23) & 0xff);
+    quint32 mantissa = bits & 0x7fffff;
+    if (exponent == 0xff) // inf or nan
+      return sign | 0x7c00 | (mantissa ? 0x200 : 0);
+    exponent = exponent - 127 + 15;
+    if (exponent >= 0x1f) return sign | 0x7c00; // too large, inf
+    quint32 half, rest, halfway;
+    if (exponent <= 0) { // subnormal or zero
+      if (exponent < -10) return sign;
+      mantissa |= 0x800000;
+      quint32 shift = 14 - exponent;
+      half = mantissa >> shift;
+      rest = mantissa & ((1u << shift) - 1);
+      halfway = 1u << (shift - 1);
+    } else {
+      half = ((quint32) exponent << 10) | (mantissa >> 13);
+      rest = mantissa & 0x1fff;
+      halfway = 0x1000;
+    }
+    if (rest > halfway || (rest == halfway && (half & 1)))
+      half++; // a carry into the exponent is still correct, up to inf
+    return sign | (quint16) half;
   }
 
-  inline void _xw_to_rgba(float *dst, const QVector3D &x, const float &w,
-                          unsigned int n) const {
-    dst[0] = x[0] / n;
-    dst[1] = x[1] / n;
-    dst[2] = x[2] / n;
-    dst[3] = 1.0f - w;
+  static std::vector<unsigned char> _float_bytes(const std::vector<float> &v) {
+    std::vector<unsigned char> bytes(v.size() * sizeof(float));
+    if (!v.empty()) std::memcpy(&bytes[0], &v[0], bytes.size());
+    return bytes;
   }
 
   template<typename T>
@@ -1,17 +1,30 @@
 #ifndef __POINTCLOUD_H__
 #define __POINTCLOUD_H__
 #include "box3.h"
+#include "chunk_pool.h"
 #include "octree.h"
+#include "octree_file.h"
 #include "opengl_funcs.h"
+#include "pick_buffer.h"
 #include "point_attributes.h"
+#include "point_selection.h"
 #include "qt_camera.h"
+#include "quantized_positions.h"
 #include "selection_box.h"
 #include "timer.h"
 #include <QOpenGLContext>
 #include <QOpenGLShaderProgram>
 #include <QWindow>
+#include <cstring>
+#include <functional>
+#include <random>
+#include <thread>
 #include <vector>
 
+#ifndef GL_HALF_FLOAT
+#define GL_HALF_FLOAT 0x140B
+#endif
+
 inline void checkOpenGLError(const char *context) {
   GLenum error = glGetError();
   if (error != GL_NO_ERROR) {
@@ -23,103 +36,231 @@ inline void checkOpenGLError(const char *context) {
 
 class PointCloud : protected OpenGLFuncs {
 public:
+  // larger clouds are drawn from a random subsample of this size while their
+  // octree is built on another thread, see loadPoints
+  static const std::size_t BUILD_IN_BACKGROUND_MIN_POINTS = 1 << 20;
+  static const std::size_t PREVIEW_POINTS = 1 << 18;
+  // a click picks the nearest point drawn this many pixels around it
+  static constexpr float CLICK_RADIUS = 5.0f;
+
   PointCloud(QWindow *window, QOpenGLContext *context)
       : _context(context),
         _window(window),
+        _has_pick_program(false),
         _point_size(0.0f),
         _num_points(0),
+        _num_selected(0),
         _buffer_positions(0),
         _buffer_colors(0),
         _buffer_sizes(0),
         _buffer_selection_mask(0),
-        _buffer_octree_ids(0),
+        _buffer_highlight_mask(0),
+        _buffer_ids(0),
+        _num_points_building(0),
         _color_map(4, 1.0f),
         _color_map_min(0.0f),
         _color_map_max(1.0f),
-        _color_map_auto(true) {
+        _color_map_auto(true),
+        _has_highlight(false),
+        _highlight_color(1.0f, 0.0f, 0.0f, 1.0f),
+        _quantize_positions(false),
+        _gpu_point_budget(0),
+        _dropped_points(0),
+        _dropped_warned(false),
+        _pick_buffer(window, context),
+        _pick_complete(false) {
     _context->makeCurrent(_window);
     initializeOpenGLFunctions();
+    // desktop GL since 1.4, the ranges are drawn one by one without it
+    _multi_draw_arrays = (MultiDrawArrays) _context->getProcAddress(
+            "glMultiDrawArrays");
     _context->doneCurrent();
     compileProgram();
   }
 
   ~PointCloud() { clearPoints(); }
 
-  void loadPoints(std::vector<float> &positions) {
-    // warning: this function modifies positions and colors
-    _positions.swap(positions);
-    _num_points = _positions.size() / 3;
+  void loadPoints(std::vector<float> &positions, bool partial = false) {
+    // warning: this function modifies positions and colors.
+    // The octree is read from the cache file if it has one for these
+    // positions, else a large cloud is drawn from a subsample until its
+    // octree is built in the background, then finishBuild swaps it in.
+    // A partial cloud, streamed points that are still arriving, is never
+    // cached
+    waitForBuild();
+    std::size_t num_points = positions.size() / 3;
+    _full_box = vltools::Box3<float>();
+    _full_box.addPoints(&positions[0], num_points);
 
-    _octree.buildTree(_positions, _sizes, 32);
-    _octree_ids.reserve(_num_points);
+    QString cache_path = partial ? QString() : _octree_cache_path;
+    quint64 fingerprint = 0;
+    if (!cache_path.isEmpty()) {
+      fingerprint = OctreeFile::fingerprint(positions);
+      if (OctreeFile::load(cache_path, fingerprint, num_points, _octree,
+                           _positions, _sizes)) {
+        qDebug() << "PointCloud: octree read from" << cache_path;
+        createBuffers();
+        return;
+      }
+    }
 
-    _full_box = vltools::Box3<float>();
-    _full_box.addPoints(&_positions[0], _num_points);
+    if (num_points < BUILD_IN_BACKGROUND_MIN_POINTS) {
+      _positions.swap(positions);
+      _octree.buildTree(_positions, _sizes, 32);
+      if (!cache_path.isEmpty())
+        OctreeFile::save(cache_path, fingerprint, _octree);
+    } else {
+      _positions.clear();
+      _positions.reserve(3 * PREVIEW_POINTS);
+      for (std::size_t i : previewIndices(num_points))
+        _positions.insert(_positions.end(), &positions[3 * i],
+                          &positions[3 * i + 3]);
+      _octree.buildTree(_positions, _sizes, 32);
 
-    _context->makeCurrent(_window);
+      _build_positions.swap(positions);
+      _num_points_building = num_points;
+      _build_thread = std::thread([this, cache_path, fingerprint] {
+        _build_octree.buildTree(_build_positions, _build_sizes, 32);
+        if (!cache_path.isEmpty())
+          OctreeFile::save(cache_path, fingerprint, _build_octree);
+        if (_on_built) _on_built();
+      });
+    }
+    createBuffers();
+  }
 
-    // create a buffer for storing position vectors
-    glGenBuffers(1, &_buffer_positions);
-    glBindBuffer(GL_ARRAY_BUFFER, _buffer_positions);
-    glBufferData(GL_ARRAY_BUFFER, sizeof(float) * _positions.size(),
-                 (GLvoid *) &_positions[0], GL_STATIC_DRAW);
+  bool finishBuild() {
+    // call on the gui thread once the build callback ran. Replaces the
+    // preview with the full cloud, its selection and attributes are dropped,
+    // the colors of streamed points are loaded.
+    // Returns false if no octree was being built
+    if (!_build_thread.joinable()) return false;
+    _build_thread.join();
+    deleteBuffers();
+    _positions.swap(_build_positions);
+    _sizes.swap(_build_sizes);
+    _octree.swap(_build_octree);
+    _octree.relocate(_positions, _sizes);
+    _build_positions.clear();
+    _build_positions.shrink_to_fit();
+    _build_sizes.clear();
+    _build_sizes.shrink_to_fit();
+    _build_octree.buildTree(_build_positions, _build_sizes);
+    createBuffers();
+    if (!_build_attributes.empty()) {
+      loadAttributes(_build_attributes);
+      _build_attributes.clear();
+      _build_attributes.shrink_to_fit();
+    }
+    return true;
+  }
 
-    // create a buffer for storing color vectors
-    glGenBuffers(1, &_buffer_colors);
-//    std::vector<float> default_colors(_num_points * 4);
-//    for(size_t i = 0; i < _num_points; ++i) {
-//      default_colors[i*4 + 0] = 1.0f; // R
-//      default_colors[i*4 + 1] = 1.0f; // G
-//      default_colors[i*4 + 2] = 1.0f; // B
-//      default_colors[i*4 + 3] = 1.0f; // A
-//    }
-//    glBindBuffer(GL_ARRAY_BUFFER, _buffer_colors);
-//    glBufferData(GL_ARRAY_BUFFER, sizeof(float) * default_colors.size(),
-//                 (GLvoid *) &default_colors[0], GL_STATIC_DRAW);
+  static std::vector<std::size_t> previewIndices(std::size_t num_points) {
+    // the points of a large cloud drawn while its octree is built, a
+    // jittered stride over all of them
+    std::vector<std::size_t> indices(PREVIEW_POINTS);
+    std::mt19937 random;
+    std::uniform_real_distribution<double> jitter(0.0, 1.0);
+    double stride = (double) num_points / PREVIEW_POINTS;
+    for (std::size_t k = 0; k < PREVIEW_POINTS; k++) {
+      std::size_t i = (std::size_t) ((k + jitter(random)) * stride);
+      indices[k] = (std::min) (i, num_points - 1);
+    }
+    return indices;
+  }
 
-    // create a buffer for storing per point scalars
-    glGenBuffers(1, &_buffer_scalars);
+  void setBuildCallback(const std::function<void()> &callback) {
+    // called on the build thread when the octree of a large cloud is ready
+    _on_built = callback;
+  }
 
-    // create buffer for storing centroid sizes
-    glGenBuffers(1, &_buffer_sizes);
-    glBindBuffer(GL_ARRAY_BUFFER, _buffer_sizes);
-    glBufferData(GL_ARRAY_BUFFER, _sizes.size() * sizeof(float),
-                 (GLvoid *) &_sizes[0], GL_STATIC_DRAW);
+  void setOctreeCache(const QString &path) {
+    // file the octree of the points loaded next is read from or saved to,
+    // none if empty
+    _octree_cache_path = path;
+  }
 
-    // create buffer for storing selection mask
-    glGenBuffers(1, &_buffer_selection_mask);
-    glBindBuffer(GL_ARRAY_BUFFER, _buffer_selection_mask);
-    glBufferData(GL_ARRAY_BUFFER, _positions.size() / 3 * sizeof(float), nullptr,
-                 GL_DYNAMIC_DRAW);
+  bool isBuilding() const { return _build_thread.joinable(); }
+  std::size_t getNumPointsBuilding() const {
+    return isBuilding() ? _num_points_building : 0;
+  }
 
-    // create buffer for storing point indices obtained from octree
-    glGenBuffers(1, &_buffer_octree_ids);
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, _buffer_octree_ids);
-    glBufferData(GL_ELEMENT_ARRAY_BUFFER, _num_points * sizeof(unsigned int),
-                 nullptr, GL_DYNAMIC_DRAW);
+  bool appendPoints(const std::vector<float> &positions,
+                    const std::vector<float> &colors, bool last) {
+    // streamed points are kept in the order they are received, the octree
+    // can't grow in place, so it's rebuilt every time their number doubles
+    // and once more after the last ones. A large cloud is rebuilt in the
+    // background like any other, its colors are loaded once the octree is
+    // ready. Returns true if it was rebuilt
+    _streamed_positions.insert(_streamed_positions.end(), positions.begin(),
+                               positions.end());
+    _streamed_colors.insert(_streamed_colors.end(), colors.begin(),
+                            colors.end());
+    std::size_t num_streamed = _streamed_positions.size() / 3;
+    if (num_streamed == 0 || num_streamed == _num_points) {
+      if (last) clearStreamedPoints();
+      return false;
+    }
+    if (!last && num_streamed < 2 * _num_points) return false;
 
-    _context->doneCurrent();
-    _attributes.reset();
-    initColors();
+    std::vector<float> streamed_positions;
+    std::vector<float> streamed_colors;
+    streamed_positions.swap(_streamed_positions);
+    streamed_colors.swap(_streamed_colors);
+    clearPoints();
+    if (!last) {
+      _streamed_positions = streamed_positions;
+      _streamed_colors = streamed_colors;
+    }
+
+    // same layout as the payload of loadAttributes, one set of rgba colors
+    quint64 header[3] = {1, num_streamed, 4};
+    std::vector<char> attributes(sizeof(header) +
+                                 streamed_colors.size() * sizeof(float));
+    std::memcpy(&attributes[0], header, sizeof(header));
+    std::memcpy(&attributes[sizeof(header)], &streamed_colors[0],
+                streamed_colors.size() * sizeof(float));
+
+    loadPoints(streamed_positions, !last);
+    if (!isBuilding()) {
+      loadAttributes(attributes);
+      return true;
+    }
+    // the preview gets the colors of its points, the full cloud all of them
+    std::vector<std::size_t> preview = previewIndices(num_streamed);
+    header[1] = preview.size();
+    std::vector<char> preview_attributes(
+            sizeof(header) + 4 * preview.size() * sizeof(float));
+    std::memcpy(&preview_attributes[0], header, sizeof(header));
+    float *preview_colors = (float *) &preview_attributes[sizeof(header)];
+    for (std::size_t k = 0; k < preview.size(); k++)
+      std::memcpy(&preview_colors[4 * k], &streamed_colors[4 * preview[k]],
+                  4 * sizeof(float));
+    loadAttributes(preview_attributes);
+    _build_attributes.swap(attributes);
+    return true;
+  }
+
+  void clearStreamedPoints() {
+    _streamed_positions.clear();
+    _streamed_positions.shrink_to_fit();
+    _streamed_colors.clear();
+    _streamed_colors.shrink_to_fit();
   }
 
   void clearPoints() {
     clearAttributes();
+    clearStreamedPoints();
+    waitForBuild();
     if (_num_points == 0) return;
     _num_points = 0;
     _positions.clear();
     _sizes.clear();
-    _octree_ids.clear();
-    _selected_ids.clear();
+    _lod_ranges.clear();
+    _selected.reset(0);
+    _num_selected = 0;
     _full_box = vltools::Box3<float>();
-    _context->makeCurrent(_window);
-    glDeleteBuffers(1, &_buffer_positions);
-    glDeleteBuffers(1, &_buffer_colors);
-    glDeleteBuffers(1, &_buffer_scalars);
-    glDeleteBuffers(1, &_buffer_sizes);
-    glDeleteBuffers(1, &_buffer_selection_mask);
-    glDeleteBuffers(1, &_buffer_octree_ids);
-    _context->doneCurrent();
+    deleteBuffers();
     _octree.buildTree(_positions, _sizes, 32);
     _attributes.reset();
   }
@@ -129,6 +270,11 @@ public:
     initColors();
   }
 
+  void loadAttributes(const char *data, std::size_t size, bool typed = false) {
+    _attributes.set(data, size, _octree, typed);
+    initColors();
+  }
+
   void loadAttributes(const std::vector<float> &attr, quint64 attr_size,
                       quint64 attr_dim) {
     _attributes.set(attr, attr_size, attr_dim);
@@ -139,14 +285,22 @@ public:
 
   // render methods
   void draw(const QtCamera &camera, const SelectionBox *box = nullptr) {
-    queryLOD(_octree_ids, camera, 0.25f); // TODO make this a parameter
-    if (_octree_ids.empty()) return;
-    draw(&_octree_ids[0], (unsigned int) _octree_ids.size(), camera, box);
+    queryLOD(_lod_ranges, camera, 0.25f); // TODO make this a parameter
+    if (_lod_ranges.empty()) return;
+    draw(&_lod_ranges[0], _lod_ranges.size(), camera, box);
   }
 
-  void draw(const unsigned int *indices, const unsigned int num_points,
+  void draw(const Octree::Range *ranges, std::size_t num_ranges,
             const QtCamera &camera, const SelectionBox *box = nullptr) {
     if (_num_points == 0) return;
+    _dropped_points = mapRanges(ranges, num_ranges);
+    if (_dropped_points > 0 && !_dropped_warned) {
+      qWarning() << "PointCloud: the gpu_point_budget of" << _gpu_point_budget
+                 << "points can't hold the points of a frame," << _dropped_points
+                 << "were not drawn";
+      _dropped_warned = true;
+    }
+    if (_draw_firsts.empty()) return;
 
     // box should be in normalized device coordinates
     glEnable(GL_PROGRAM_POINT_SIZE);
@@ -176,51 +330,74 @@ public:
                              box ? box->getType() : SelectionBox::NONE);
     _program.setUniformValue("projection_mode", camera.getProjectionMode());
     _program.setUniformValue("color_map", 0);
-    _program.setUniformValue("scalar_min", _color_map_min);
-    _program.setUniformValue("scalar_max", _color_map_max);
-    _program.setUniformValue("color_map_n", _color_map.size() / 4.0f);
+
+    int curr_attr_idx = (int) _attributes.currentIndex();
+    bool use_color_map = _attributes.dim(curr_attr_idx) == 1;
+    bool broadcast_attr = _attributes.size(curr_attr_idx) == 1;
+    GLenum attr_type = glType(_attributes.encoding(curr_attr_idx));
+    if (_attributes.isCategorical(curr_attr_idx)) {
+      // indices are normalized like unsigned integers, the scale maps them to
+      // the texels of the palette
+      float n = _attributes.palette(curr_attr_idx).size() / 4.0f;
+      float max_index = attr_type == GL_UNSIGNED_BYTE ? 255.0f : 65535.0f;
+      _program.setUniformValue("scalar_min", 0.0f);
+      _program.setUniformValue("scalar_max", qMax(n - 1.0f, 1.0f) / max_index);
+      _program.setUniformValue("color_map_n", n);
+    } else {
+      _program.setUniformValue("scalar_min", _color_map_min);
+      _program.setUniformValue("scalar_max", _color_map_max);
+      _program.setUniformValue("color_map_n", _color_map.size() / 4.0f);
+    }
 
     _program.enableAttributeArray("position");
     _program.enableAttributeArray("size");
     _program.enableAttributeArray("selected");
 
-    glBindBuffer(GL_ARRAY_BUFFER, _buffer_positions);
-    _program.setAttributeArray("position", GL_FLOAT, 0, 3);
+    setPositionArray(_program);
     glBindBuffer(GL_ARRAY_BUFFER, _buffer_sizes);
     _program.setAttributeArray("size", GL_FLOAT, 0, 1);
     glBindBuffer(GL_ARRAY_BUFFER, _buffer_selection_mask);
     _program.setAttributeArray("selected", GL_FLOAT, 0, 1);
+    _program.setUniformValue("highlight_color", _highlight_color);
+    if (_has_highlight) {
+      // unsigned bytes are normalized to [0, 1]
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_highlight_mask);
+      _program.enableAttributeArray("highlighted");
+      _program.setAttributeArray("highlighted", GL_UNSIGNED_BYTE, 0, 1);
+    } else {
+      _program.setAttributeValue("highlighted", 0.0f);
+    }
 
-    int curr_attr_idx = (int) _attributes.currentIndex();
-    bool use_color_map = _attributes.dim(curr_attr_idx) == 1;
-    bool broadcast_attr = _attributes.size(curr_attr_idx) == 1;
+    // attribute arrays are read in their own encoding, integers normalized
     if (use_color_map) {
       _program.setAttributeValue("color", QVector4D(1.0f, 1.0f, 1.0f, 1.0f));
     } else if (broadcast_attr) {
-      const std::vector<float> &v = _attributes[curr_attr_idx];
-      _program.setAttributeValue("color", QVector4D(v[0], v[1], v[2], v[3]));
+      const PointAttributes &a = _attributes;
+      int k = curr_attr_idx;
+      _program.setAttributeValue(
+              "color", QVector4D(a(k, 0, 0), a(k, 0, 1), a(k, 0, 2), a(k, 0, 3)));
     } else {
       glBindBuffer(GL_ARRAY_BUFFER, _buffer_colors);
       _program.enableAttributeArray("color");
-      _program.setAttributeArray("color", GL_FLOAT, 0, 4);
+      _program.setAttributeArray("color", attr_type, 0, 4);
     }
     if (!use_color_map) {
       _program.setAttributeValue("scalar", 1.0f);
     } else if (broadcast_attr) {
-      _program.setAttributeValue("scalar", _attributes[curr_attr_idx][0]);
+      float scalar = _attributes(curr_attr_idx, 0, 0);
+      if (_attributes.isCategorical(curr_attr_idx))
+        scalar /= attr_type == GL_UNSIGNED_BYTE ? 255.0f : 65535.0f;
+      _program.setAttributeValue("scalar", scalar);
     } else {
       glBindBuffer(GL_ARRAY_BUFFER, _buffer_scalars);
       _program.enableAttributeArray("scalar");
-      _program.setAttributeArray("scalar", GL_FLOAT, 0, 1);
+      _program.setAttributeArray("scalar", attr_type, 0, 1);
     }
 
     glActiveTexture(GL_TEXTURE0 + 0);
     glBindTexture(GL_TEXTURE_1D, _texture_color_map);
 
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, _buffer_octree_ids);
-    glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, 0,
-                    sizeof(unsigned int) * num_points, (GLvoid *) indices);
-    glDrawElements(GL_POINTS, num_points, GL_UNSIGNED_INT, 0);
+    drawPoints();
 
     if (!use_color_map && !broadcast_attr)
       _program.disableAttributeArray("color");
@@ -230,6 +407,7 @@ public:
     _program.disableAttributeArray("position");
     _program.disableAttributeArray("size");
     _program.disableAttributeArray("selected");
+    if (_has_highlight) _program.disableAttributeArray("highlighted");
 
     glEnable(GL_DEPTH_TEST);
     glDepthMask(GL_TRUE);
@@ -237,17 +415,17 @@ public:
     glDisable(GL_PROGRAM_POINT_SIZE);
   }
 
-  void queryLOD(std::vector<unsigned int> &indices, const QtCamera &camera,
+  void queryLOD(std::vector<Octree::Range> &ranges, const QtCamera &camera,
                 const float fudge_factor = 1.0f) {
     float min_z_near = 0.1f;
     if (camera.getProjectionMode() == QtCamera::PERSPECTIVE)
-      _octree.getIndices(indices, camera, camera.getVerticalFOV(), -min_z_near,
+      _octree.getIndices(ranges, camera, camera.getVerticalFOV(), -min_z_near,
                          _window->width(), _window->height(), fudge_factor);
     else {
       float t =
               camera.getCameraDistance() * tan(0.5f * camera.getVerticalFOV());
       float r = (float) _window->width() / _window->height() * t;
-      _octree.getIndicesOrtho(indices, camera, r, t, _window->height(),
+      _octree.getIndicesOrtho(ranges, camera, r, t, _window->height(),
                               fudge_factor);
     }
   }
@@ -262,8 +440,6 @@ public:
     _context->makeCurrent(_window);
     int curr_attr_idx = (int) _attributes.currentIndex();
     bool use_color_map = _attributes.dim(curr_attr_idx) == 1;
-    bool broadcast_attr = _attributes.size(curr_attr_idx) == 1;
-    const std::vector<float> &attr = _attributes[curr_attr_idx];
     glEnable(GL_TEXTURE_1D);
     checkOpenGLError("before active texture");
     glActiveTexture(GL_TEXTURE0 + 0);
@@ -274,7 +450,16 @@ public:
     checkOpenGLError("gen texture");
     glBindTexture(GL_TEXTURE_1D, _texture_color_map);
     checkOpenGLError("bind texture");
-    if (use_color_map) {
+    if (_attributes.isCategorical(curr_attr_idx)) {
+      // use palette of the attribute set, one texel per index
+      const std::vector<float> &palette = _attributes.palette(curr_attr_idx);
+      glTexImage1D(GL_TEXTURE_1D, 0, GL_RGBA, (int) palette.size() / 4, 0,
+                   GL_RGBA, GL_FLOAT, (GLvoid *) &palette[0]);
+      checkOpenGLError("tex image");
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE);
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_NEAREST);
+      glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_NEAREST);
+    } else if (use_color_map) {
       // use client provided color map
       glTexImage1D(GL_TEXTURE_1D, 0, 4, (int) _color_map.size() / 4, 0, GL_RGBA,
                    GL_FLOAT, (GLvoid *) &_color_map[0]);
@@ -295,12 +480,8 @@ public:
       glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_NEAREST);
     }
     // load color/scalar buffer if size > 1
-    GLuint attr_buffer = use_color_map ? _buffer_scalars : _buffer_colors;
-    if (!broadcast_attr) {
-      glBindBuffer(GL_ARRAY_BUFFER, attr_buffer);
-      glBufferData(GL_ARRAY_BUFFER, sizeof(float) * attr.size(),
-                   (GLvoid *) &attr[0], GL_STATIC_DRAW);
-    }
+    allocateAttributes();
+    uploadSpan(0, numVertices(), ATTRIBUTES);
 
     glBindTexture(GL_TEXTURE_1D, 0);
     _context->doneCurrent();
@@ -323,20 +504,23 @@ public:
       int curr_attr_idx = (int) _attributes.currentIndex();
       bool use_color_map = _attributes.dim(curr_attr_idx) == 1;
       bool broadcast_attr = _attributes.size(curr_attr_idx) == 1;
-      const std::vector<float> &attr = _attributes[curr_attr_idx];
       if (!use_color_map) {
         _color_map_min = 0.0f;
         _color_map_max = 1.0f;
       } else if (broadcast_attr) {
-        _color_map_min = attr[0] - 1.0f;
-        _color_map_max = attr[0] + 1.0f;
+        _color_map_min = _attributes(curr_attr_idx, 0, 0) - 1.0f;
+        _color_map_max = _attributes(curr_attr_idx, 0, 0) + 1.0f;
       } else {
         _color_map_min = std::numeric_limits<float>::max();
         _color_map_max = -std::numeric_limits<float>::max();
-        for (std::size_t i = 0; i < attr.size(); i++) {
-          if (attr[i] == attr[i]) { // skip if attr[i] is NaN
-            _color_map_min = qMin(_color_map_min, attr[i]);
-            _color_map_max = qMax(_color_map_max, attr[i]);
+        // scalars of points and LOD centroids
+        std::size_t n = _attributes.values(curr_attr_idx).size() /
+                        _attributes.elementSize(curr_attr_idx);
+        for (std::size_t i = 0; i < n; i++) {
+          float v = _attributes(curr_attr_idx, (int) i, 0);
+          if (v == v) { // skip if v is NaN
+            _color_map_min = qMin(_color_map_min, v);
+            _color_map_max = qMax(_color_map_max, v);
           }
         }
       }
@@ -350,35 +534,67 @@ public:
   // selection methods
   void selectInBox(const SelectionBox &box, const QtCamera &camera) {
     if (box.getType() == SelectionBox::NONE) return;
+    // centroids are selected along with the points
     QMatrix4x4 mvp = camera.computeMVPMatrix(_full_box);
-    QRectF rect = box.getBox();
-    std::vector<unsigned int> new_indices;
-    // check all centroids in addition to all points
-    for (unsigned int i = 0; i < _positions.size() / 3; i++) {
-      float *v = &_positions[3 * i];
-      QVector4D p(v[0], v[1], v[2], 1);
-      p = mvp * p;
-      p /= p.w();
-      if (rect.contains(QPointF(p.x(), p.y())) && p.z() > -1.0f && p.z() < 1.0f)
-        new_indices.push_back(i);
-    }
-    if (box.getType() == SelectionBox::ADD)
-      mergeIndices(_selected_ids, new_indices);
-    else // box.getType() == SelectionBox::SUB
-      removeIndices(_selected_ids, new_indices);
+    QRectF rect = box.getBox().normalized();
+    float m[16];
+    std::memcpy(m, mvp.constData(), sizeof(m));
+    float b[4] = {(float) rect.left(), (float) rect.top(), (float) rect.right(),
+                  (float) rect.bottom()};
+    std::vector<Octree::Range> ranges;
+    _octree.getIndicesInBox(ranges, m, b);
+    for (std::size_t i = 0; i < ranges.size(); i++)
+      if (box.getType() == SelectionBox::ADD)
+        _selected.insert(ranges[i].first, ranges[i].count);
+      else // box.getType() == SelectionBox::SUB
+        _selected.erase(ranges[i].first, ranges[i].count);
     updateSelectionMask();
   }
 
   void queryNearPoint(std::vector<unsigned int> &indices, const QPointF &point,
                       const QtCamera &camera) {
+    // the ids drawn around point are read back if they can be, else the
+    // octree is searched
+    if (pickNearPoint(indices, point, camera)) return;
     Octree::ProjectionMode projection_mode =
             camera.getProjectionMode() == QtCamera::PERSPECTIVE
                     ? Octree::PERSPECTIVE
                     : Octree::ORTHOGRAPHIC;
     _octree.getClickIndices(
-            indices, point.x(), _window->height() - point.y() - 1.0f, 5.0f,
-            _window->width(), _window->height(), camera.getVerticalFOV(), 0.1f,
-            camera, projection_mode);
+            indices, point.x(), _window->height() - point.y() - 1.0f,
+            CLICK_RADIUS, _window->width(), _window->height(),
+            camera.getVerticalFOV(), 0.1f, camera, projection_mode);
+  }
+
+  bool pickNearPoint(std::vector<unsigned int> &indices, const QPointF &point,
+                     const QtCamera &camera) {
+    // like queryNearPoint, from the ids of the points of the finest LOD
+    // drawn into the pick buffer. They are drawn again only when the view
+    // changed, further clicks on a view read a few pixels. Returns false if
+    // the ids can't all be drawn (e.g. the chunk pool is too small for
+    // them) or resolved
+    indices.clear();
+    if (_num_points == 0 || !_has_pick_program) return false;
+    qreal ratio = _window->devicePixelRatio();
+    int width = (int) (ratio * _window->width());
+    int height = (int) (ratio * _window->height());
+    QMatrix4x4 mvp = camera.computeMVPMatrix(_full_box);
+    _context->makeCurrent(_window);
+    if (!_pick_buffer.valid() || _pick_buffer.width() != width ||
+        _pick_buffer.height() != height || mvp != _pick_mvp) {
+      _pick_complete = drawIds(camera, width, height);
+      _pick_mvp = mvp;
+    }
+    if (!_pick_complete) {
+      _context->doneCurrent();
+      return false;
+    }
+    quint32 id = _pick_buffer.pick((int) (ratio * point.x()),
+                                   height - 1 - (int) (ratio * point.y()),
+                                   (int) (ratio * CLICK_RADIUS));
+    _context->doneCurrent();
+    if (id == PickBuffer::NO_ID) return true;
+    return _octree.getPickIndices(indices, id, camera);
   }
 
   void selectNearPoint(const QPointF &point, const QtCamera &camera,
@@ -386,10 +602,11 @@ public:
     std::vector<unsigned int> new_indices;
     queryNearPoint(new_indices, point, camera);
     if (new_indices.empty()) return;
-    if (deselect)
-      removeIndices(_selected_ids, new_indices);
-    else
-      mergeIndices(_selected_ids, new_indices);
+    for (std::size_t i = 0; i < new_indices.size(); i++)
+      if (deselect)
+        _selected.erase(new_indices[i], 1);
+      else
+        _selected.insert(new_indices[i], 1);
     updateSelectionMask();
   }
 
@@ -400,26 +617,75 @@ public:
   void getSelected(std::vector<unsigned int> &indices) const {
     // returns indices into original array of points
     // (prior to reshuffling by octree)
-    indices.reserve(_selected_ids.size());
+    indices.reserve(_num_selected);
     indices.clear();
-    for (std::size_t i = 0; i < _selected_ids.size(); i++)
-      if (_selected_ids[i] < _num_points)
-        indices.push_back(_octree.getIndices()[_selected_ids[i]]);
-      else
-        break;
+    for (std::size_t i = _selected.next(0); i < _num_points;
+         i = _selected.next(i + 1))
+      indices.push_back(_octree.getIndices()[i]);
   }
 
   void setSelected(const std::vector<unsigned int> &indices) {
     // expects indices into original array of points
-    _selected_ids.clear();
+    _selected.clear();
     for (std::size_t i = 0; i < indices.size(); i++)
-      _selected_ids.push_back(_octree.getIndicesR()[indices[i]]);
-    std::sort(_selected_ids.begin(), _selected_ids.end()); // increasing order
+      _selected.insert(_octree.getIndicesR()[indices[i]], 1);
     updateSelectionMask();
   }
 
+  bool setHighlight(const std::vector<unsigned char> &bits) {
+    // bits holds one bit per point of the original array (least significant
+    // bit first), the highlighted points are drawn with the highlight color.
+    // No bits clear the highlight
+    if (bits.empty()) {
+      _has_highlight = false;
+      _highlight_mask.clear();
+      _highlight_mask.shrink_to_fit();
+      return true;
+    }
+    if (_num_points == 0 || bits.size() != (_num_points + 7) / 8) return false;
+    std::vector<unsigned char> &mask = _highlight_mask;
+    mask.assign(numVertices(), 0);
+    const std::vector<unsigned int> &indices = _octree.getIndices();
+    for (std::size_t i = 0; i < _num_points; i++) {
+      unsigned int k = indices[i];
+      mask[i] = (bits[k >> 3] >> (k & 7)) & 1 ? 255 : 0;
+    }
+    computeHighlightLOD(mask, _octree.getRoot());
+    _has_highlight = true;
+    _context->makeCurrent(_window);
+    uploadSpan(0, numVertices(), HIGHLIGHT);
+    _context->doneCurrent();
+    return true;
+  }
+
+  void setHighlightColor(const QVector4D &color) { _highlight_color = color; }
+
+  void setQuantizePositions(bool quantize) {
+    // the gpu keeps the positions of points and centroids quantized (see
+    // QuantizedPositions), the octree and the selection still use _positions
+    if (quantize == _quantize_positions) return;
+    _quantize_positions = quantize;
+    if (_num_points == 0) return;
+    _context->makeCurrent(_window);
+    uploadPositions();
+    _context->doneCurrent();
+  }
+
+  void setGpuPointBudget(std::size_t max_points) {
+    // the gpu buffers hold at most about max_points points and centroids,
+    // the chunks each draw needs are paged in from host memory (see
+    // ChunkPool), what doesn't fit is not drawn (see getDroppedPoints). 0
+    // for no bound
+    if (max_points == _gpu_point_budget) return;
+    _gpu_point_budget = max_points;
+    if (_num_points == 0) return;
+    _context->makeCurrent(_window);
+    allocateVertexBuffers();
+    _context->doneCurrent();
+  }
+
   void clearSelected() {
-    _selected_ids.clear();
+    _selected.clear();
     updateSelectionMask();
   }
 
@@ -427,10 +693,10 @@ public:
     // returns bounding box centroid if no points are selected
     QVector3D centroid;
     std::size_t num_selected = 0;
-    for (std::size_t i = 0; i < _selected_ids.size(); i++) {
-      if (_selected_ids[i] >= _num_points) break;
+    for (std::size_t i = _selected.next(0); i < _num_points;
+         i = _selected.next(i + 1)) {
       num_selected++;
-      float *v = &_positions[3 * _selected_ids[i]];
+      float *v = &_positions[3 * i];
       centroid += QVector3D(v[0], v[1], v[2]);
     }
     if (num_selected == 0)
@@ -443,17 +709,18 @@ public:
 
   // getters and setters
   std::size_t getNumPoints() const { return _num_points; }
-  std::size_t getNumSelected() const {
-    return countSelected(_selected_ids, (unsigned int) _num_points);
-  }
+  std::size_t getNumSelected() const { return _num_selected; }
   std::size_t getNumAttributes() const { return _attributes.numAttributes(); }
+  // points and centroids the last draw left out for the gpu_point_budget
+  std::size_t getDroppedPoints() const { return _dropped_points; }
   std::size_t getCurrentAttributeIndex() const {
     return _attributes.currentIndex();
   }
   const PointAttributes &getAttributes() const { return _attributes; }
   const std::vector<float> &getPositions() const { return _positions; }
-  const std::vector<unsigned int> &getSelectedIds() const {
-    return _selected_ids;
+  std::size_t getFirstSelectedId() const {
+    // in the octree order, numVertices() if none
+    return _selected.next(0);
   }
   const vltools::Box3<float> &getBox() const { return _full_box; }
   float getFloor() const { return _num_points == 0 ? 0.0f : _full_box.min(2); }
@@ -465,7 +732,372 @@ public:
   }
 
 private:
+  void createBuffers() {
+    // buffers of the points and LOD centroids in the octree order
+    _num_points = _octree.getNumPoints();
+
+    _context->makeCurrent(_window);
+    // create a buffer for storing position vectors
+    glGenBuffers(1, &_buffer_positions);
+
+    // create a buffer for storing color vectors
+    glGenBuffers(1, &_buffer_colors);
+//    std::vector<float> default_colors(_num_points * 4);
+//    for(size_t i = 0; i < _num_points; ++i) {
+//      default_colors[i*4 + 0] = 1.0f; // R
+//      default_colors[i*4 + 1] = 1.0f; // G
+//      default_colors[i*4 + 2] = 1.0f; // B
+//      default_colors[i*4 + 3] = 1.0f; // A
+//    }
+//    glBindBuffer(GL_ARRAY_BUFFER, _buffer_colors);
+//    glBufferData(GL_ARRAY_BUFFER, sizeof(float) * default_colors.size(),
+//                 (GLvoid *) &default_colors[0], GL_STATIC_DRAW);
+
+    // create a buffer for storing per point scalars
+    glGenBuffers(1, &_buffer_scalars);
+
+    // create buffer for storing centroid sizes
+    glGenBuffers(1, &_buffer_sizes);
+
+    // create buffer for storing selection mask
+    glGenBuffers(1, &_buffer_selection_mask);
+
+    // create buffer for storing highlight mask, one byte per point/centroid
+    glGenBuffers(1, &_buffer_highlight_mask);
+    _has_highlight = false;
+
+    // create buffer for storing the ids drawn by pickNearPoint
+    glGenBuffers(1, &_buffer_ids);
+    _highlight_mask.clear();
+
+    // the selection of the previous points doesn't apply to these
+    _selected.reset(numVertices());
+    _num_selected = 0;
+
+    _attributes.reset();
+    allocateVertexBuffers();
+    _context->doneCurrent();
+    initColors();
+  }
+
+  void deleteBuffers() {
+    _context->makeCurrent(_window);
+    glDeleteBuffers(1, &_buffer_positions);
+    glDeleteBuffers(1, &_buffer_colors);
+    glDeleteBuffers(1, &_buffer_scalars);
+    glDeleteBuffers(1, &_buffer_sizes);
+    glDeleteBuffers(1, &_buffer_selection_mask);
+    glDeleteBuffers(1, &_buffer_highlight_mask);
+    glDeleteBuffers(1, &_buffer_ids);
+    _has_highlight = false;
+    _highlight_mask.clear();
+    _chunks.reset(0);
+    _pick_buffer.invalidate();
+    _context->doneCurrent();
+  }
+
+  void waitForBuild() {
+    // a build can't be interrupted, its result is dropped
+    if (!_build_thread.joinable()) return;
+    _build_thread.join();
+    _build_attributes.clear();
+    _build_attributes.shrink_to_fit();
+    _build_positions.clear();
+    _build_positions.shrink_to_fit();
+    _build_sizes.clear();
+    _build_sizes.shrink_to_fit();
+    _build_octree.buildTree(_build_positions, _build_sizes);
+  }
+
+  // per point arrays of uploadSpan
+  enum VertexArray {
+    POSITIONS = 1,
+    SIZES = 2,
+    ATTRIBUTES = 4,
+    SELECTION = 8,
+    HIGHLIGHT = 16,
+    IDS = 32,
+    ALL_ARRAYS = 63
+  };
+
+  std::size_t numVertices() const { return _positions.size() / 3; }
+
+  std::size_t vertexCapacity() const {
+    // points and centroids the buffers hold, the slots of the pool if paged
+    return _chunks.paged() ? _chunks.numSlots() * ChunkPool::CHUNK_SIZE
+                           : numVertices();
+  }
+
+  void allocateVertexBuffers() {
+    // assumes context is current, sizes the per point buffers for the chunk
+    // pool and uploads the resident chunks
+    _chunks.reset(numVertices(), _gpu_point_budget);
+    _dropped_points = 0;
+    _dropped_warned = false;
+    GLenum usage = _chunks.paged() ? GL_DYNAMIC_DRAW : GL_STATIC_DRAW;
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_sizes);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity() * sizeof(float), nullptr,
+                 usage);
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_selection_mask);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity() * sizeof(float), nullptr,
+                 GL_DYNAMIC_DRAW);
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_highlight_mask);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity(), nullptr, GL_DYNAMIC_DRAW);
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_ids);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity() * sizeof(quint32), nullptr,
+                 usage);
+    allocateAttributes();
+    uploadPositions();
+    uploadSpan(0, numVertices(), ALL_ARRAYS & ~POSITIONS);
+  }
+
+  void allocateAttributes() {
+    // assumes context is current, sized for the current attribute set
+    int k = (int) _attributes.currentIndex();
+    if (numVertices() == 0 || _attributes.size(k) == 1) return;
+    std::size_t stride = _attributes.dim(k) * _attributes.elementSize(k);
+    glBindBuffer(GL_ARRAY_BUFFER,
+                 _attributes.dim(k) == 1 ? _buffer_scalars : _buffer_colors);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity() * stride, nullptr,
+                 _chunks.paged() ? GL_DYNAMIC_DRAW : GL_STATIC_DRAW);
+  }
+
+  void uploadPositions() {
+    // assumes context is current, uploads points and LOD centroids
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_positions);
+    std::size_t size = _quantize_positions ? 4 * sizeof(quint16) : 3 * sizeof(float);
+    glBufferData(GL_ARRAY_BUFFER, vertexCapacity() * size, nullptr,
+                 _chunks.paged() ? GL_DYNAMIC_DRAW : GL_STATIC_DRAW);
+    if (_quantize_positions) _quantizer.fit(_positions);
+    uploadSpan(0, numVertices(), POSITIONS);
+    _pick_buffer.invalidate();
+  }
+
+  void uploadSpan(std::size_t first, std::size_t count, int arrays) {
+    // assumes context is current, uploads the points [first, first + count)
+    // of the arrays to the slots of their chunks, the ones not resident are
+    // uploaded when paged in
+    if (!_chunks.paged()) {
+      uploadRange(first, count, first, arrays);
+      return;
+    }
+    const std::size_t n = ChunkPool::CHUNK_SIZE;
+    for (std::size_t end = first + count; first < end;) {
+      std::size_t chunk = first / n;
+      std::size_t chunk_end = (std::min) ((chunk + 1) * n, end);
+      int slot = _chunks.slot(chunk);
+      if (slot != -1)
+        uploadRange(first, chunk_end - first, slot * n + first % n, arrays);
+      first = chunk_end;
+    }
+  }
+
+  void uploadRange(std::size_t first, std::size_t count, std::size_t offset,
+                   int arrays) {
+    // assumes context is current, the points [first, first + count) go to
+    // the buffers from offset
+    if (count == 0) return;
+    if (arrays & POSITIONS) {
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_positions);
+      if (_quantize_positions) {
+        std::vector<quint16> quantized(4 * count);
+        _quantizer.encode(&_positions[3 * first], count, &quantized[0]);
+        glBufferSubData(GL_ARRAY_BUFFER, 4 * sizeof(quint16) * offset,
+                        4 * sizeof(quint16) * count, (GLvoid *) &quantized[0]);
+      } else {
+        glBufferSubData(GL_ARRAY_BUFFER, 3 * sizeof(float) * offset,
+                        3 * sizeof(float) * count,
+                        (GLvoid *) &_positions[3 * first]);
+      }
+    }
+    if (arrays & SIZES) {
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_sizes);
+      glBufferSubData(GL_ARRAY_BUFFER, sizeof(float) * offset,
+                      sizeof(float) * count, (GLvoid *) &_sizes[first]);
+    }
+    int k = (int) _attributes.currentIndex();
+    const std::vector<unsigned char> &attr = _attributes.values(k);
+    std::size_t stride = _attributes.dim(k) * _attributes.elementSize(k);
+    if ((arrays & ATTRIBUTES) && _attributes.size(k) > 1 &&
+        attr.size() >= stride * (first + count)) {
+      glBindBuffer(GL_ARRAY_BUFFER,
+                   _attributes.dim(k) == 1 ? _buffer_scalars : _buffer_colors);
+      glBufferSubData(GL_ARRAY_BUFFER, stride * offset, stride * count,
+                      (GLvoid *) &attr[stride * first]);
+    }
+    if (arrays & SELECTION) {
+      std::vector<float> mask(count, 0.0f);
+      for (std::size_t i = _selected.next(first); i < first + count;
+           i = _selected.next(i + 1))
+        mask[i - first] = 1.0f;
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_selection_mask);
+      glBufferSubData(GL_ARRAY_BUFFER, sizeof(float) * offset,
+                      sizeof(float) * count, (GLvoid *) &mask[0]);
+    }
+    if ((arrays & HIGHLIGHT) && _has_highlight) {
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_highlight_mask);
+      glBufferSubData(GL_ARRAY_BUFFER, offset, count,
+                      (GLvoid *) &_highlight_mask[first]);
+    }
+    if (arrays & IDS) {
+      // a vertex is drawn at the offset of its slot when paged
+      std::vector<quint32> ids(count);
+      for (std::size_t i = 0; i < count; i++) ids[i] = (quint32) (first + i);
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_ids);
+      glBufferSubData(GL_ARRAY_BUFFER, sizeof(quint32) * offset,
+                      sizeof(quint32) * count, (GLvoid *) &ids[0]);
+    }
+  }
+
+  std::size_t pageIn(const Octree::Range *ranges, std::size_t num_ranges) {
+    // assumes context is current. Acquires the chunks of the ranges for a
+    // new draw, in their order (back to front), and maps the ranges to the
+    // slots into _draw_firsts and _draw_counts, split where they cross
+    // chunks. Parts whose chunk found no slot are left out, returns how
+    // many points they have
+    const std::size_t n = ChunkPool::CHUNK_SIZE;
+    _chunks.nextPass();
+    bool full = false;
+    std::size_t dropped = 0;
+    for (std::size_t i = 0; i < num_ranges; i++) {
+      std::size_t first = ranges[i].first;
+      std::size_t end = first + ranges[i].count;
+      while (first < end) {
+        std::size_t chunk = first / n;
+        std::size_t count = (std::min) (end, (chunk + 1) * n) - first;
+        std::size_t slot_first = first;
+        first += count;
+        if (full && _chunks.slot(chunk) == -1) {
+          dropped += count;
+          continue;
+        }
+        bool load;
+        int slot = _chunks.acquire(chunk, load);
+        if (slot == -1) {
+          full = true;
+          dropped += count;
+          continue;
+        }
+        if (load)
+          uploadRange(chunk * n, (std::min) (n, numVertices() - chunk * n),
+                      slot * n, ALL_ARRAYS);
+        slot_first = slot * n + slot_first % n;
+        if (!_draw_firsts.empty() &&
+            (std::size_t) (_draw_firsts.back() + _draw_counts.back()) ==
+                    slot_first) {
+          _draw_counts.back() += (GLsizei) count;
+        } else {
+          _draw_firsts.push_back((GLint) slot_first);
+          _draw_counts.push_back((GLsizei) count);
+        }
+      }
+    }
+    return dropped;
+  }
+
+  bool drawIds(const QtCamera &camera, int width, int height) {
+    // assumes context is current. Draws the ids of the points of the finest
+    // LOD into the pick buffer, the nearest one on top. Returns false if
+    // they can't all be drawn
+    if (!_pick_buffer.bind(width, height)) return false;
+    queryLOD(_lod_ranges, camera, 1.0f);
+    bool complete = _lod_ranges.empty() ||
+                    mapRanges(&_lod_ranges[0], _lod_ranges.size()) == 0;
+    if (complete && !_draw_firsts.empty()) {
+      glEnable(GL_PROGRAM_POINT_SIZE);
+      glEnable(GL_DEPTH_TEST);
+      glDepthMask(GL_TRUE);
+      glDisable(GL_BLEND);
+
+      _pick_program.bind();
+      _pick_program.setUniformValue("mvpMatrix",
+                                    camera.computeMVPMatrix(_full_box));
+      _pick_program.enableAttributeArray("position");
+      _pick_program.enableAttributeArray("id");
+      setPositionArray(_pick_program);
+      glBindBuffer(GL_ARRAY_BUFFER, _buffer_ids);
+      _pick_program.setAttributeArray("id", GL_UNSIGNED_BYTE, 0, 4);
+      drawPoints();
+      _pick_program.disableAttributeArray("position");
+      _pick_program.disableAttributeArray("id");
+      _pick_program.release();
+
+      glDisable(GL_PROGRAM_POINT_SIZE);
+    }
+    _pick_buffer.release();
+    return complete;
+  }
+
+  std::size_t mapRanges(const Octree::Range *ranges, std::size_t num_ranges) {
+    // assumes context is current. The vertices of the ranges to
+    // _draw_firsts and _draw_counts, in the octree order every range is one
+    // run of vertices. Returns how many points can't be drawn
+    _draw_firsts.clear();
+    _draw_counts.clear();
+    if (_chunks.paged()) {
+      // the points are drawn from the slots their chunks were paged into
+      return pageIn(ranges, num_ranges);
+    }
+    for (std::size_t i = 0; i < num_ranges; i++) {
+      _draw_firsts.push_back((GLint) ranges[i].first);
+      _draw_counts.push_back((GLsizei) ranges[i].count);
+    }
+    return 0;
+  }
+
+  void drawPoints() {
+    // assumes context is current and a program bound, draws the vertices
+    // mapped by mapRanges
+    if (_multi_draw_arrays) {
+      _multi_draw_arrays(GL_POINTS, &_draw_firsts[0], &_draw_counts[0],
+                         (GLsizei) _draw_firsts.size());
+    } else {
+      for (std::size_t i = 0; i < _draw_firsts.size(); i++)
+        glDrawArrays(GL_POINTS, _draw_firsts[i], _draw_counts[i]);
+    }
+  }
+
+  void setPositionArray(QOpenGLShaderProgram &program) {
+    // assumes context is current and program bound
+    glBindBuffer(GL_ARRAY_BUFFER, _buffer_positions);
+    program.setUniformValue("quantized_positions", (int) _quantize_positions);
+    if (_quantize_positions) {
+      // offsets and cell index are normalized, the shader scales them back
+      const double *corner = _quantizer.corner();
+      program.setUniformValue("position_corner",
+                              QVector3D(corner[0], corner[1], corner[2]));
+      program.setUniformValue("position_cell_size",
+                              (float) _quantizer.cellSize());
+      program.setAttributeArray("position", GL_UNSIGNED_SHORT, 0, 4);
+    } else {
+      program.setAttributeArray("position", GL_FLOAT, 0, 3);
+    }
+  }
+
+  static GLenum glType(PointAttributes::Encoding encoding) {
+    switch (encoding) {
+      case PointAttributes::UNORM8:
+      case PointAttributes::INDEX8:
+        return GL_UNSIGNED_BYTE;
+      case PointAttributes::UNORM16:
+      case PointAttributes::INDEX16:
+        return GL_UNSIGNED_SHORT;
+      case PointAttributes::FLOAT16:
+        return GL_HALF_FLOAT;
+      default:
+        return GL_FLOAT;
+    }
+  }
+
   void compileProgram() {
+    std::string decodePositionCode =
+            "vec3 decode_position() {\n"
+            "  // see QuantizedPositions, the cell index is x, y, z with 5 bits each\n"
+            "  if (quantized_positions == 0) return position.xyz;\n"
+            "  float cell = floor(position.w * 65535.0 + 0.5);\n"
+            "  vec3 cell_xyz = vec3(floor(cell / 1024.0), mod(floor(cell / 32.0), 32.0), mod(cell, 32.0));\n"
+            "  return position_corner + (cell_xyz + position.xyz) * position_cell_size;\n"
+            "}\n";
     std::string vsCode =
             "#version 120\n"
             // "precision highp float;\n"
@@ -487,11 +1119,16 @@ private:
             "uniform vec3 eye;\n"
             "uniform vec3 view;\n"
             "uniform float image_t;\n"
+            "uniform int quantized_positions;\n"
+            "uniform vec3 position_corner;\n"
+            "uniform float position_cell_size;\n"
             "\n"
-            "attribute vec3 position;\n"
+            "attribute vec4 position;\n"
             "attribute vec4 color;\n"
             "attribute float size;\n"
             "attribute float selected;\n"
+            "attribute float highlighted;\n"
+            "uniform vec4 highlight_color;\n"
             "\n"
             "varying vec4 frag_color;\n"
             "varying vec2 frag_center;\n"
@@ -500,17 +1137,20 @@ private:
             "\n"
             "attribute float scalar;\n"
             "varying float scalar_v;\n"
+            "\n" +
+            decodePositionCode +
             "\n"
             "void main() {\n"
-            "  vec4 p = mvpMatrix * vec4(position, 1.0);\n"
+            "  vec3 xyz = decode_position();\n"
+            "  vec4 p = mvpMatrix * vec4(xyz, 1.0);\n"
             "  frag_center = 0.5 * (p.xy / p.w + 1.0) * vec2(width, height);\n"
             "  gl_Position = p;\n"
             "  p /= p.w;\n"
             "  scalar_v = scalar;"
             "  float tex_coord = clamp((scalar - scalar_min) / (scalar_max - scalar_min), 0.0, 1.0);\n"
             "  tex_coord = (tex_coord - 0.5) * (color_map_n - 1.0) / color_map_n + 0.5;\n"
-            "  frag_color = color; // pass vertex color directly\n"
-            "  float d = abs(dot(position.xyz - eye,view));\n"
+            "  frag_color = mix(color, highlight_color, highlighted);\n"
+            "  float d = abs(dot(xyz - eye,view));\n"
             "  if (projection_mode == 1) d = 1.0;\n"
             "  if (size == 0.0) {\n"
             "    inner_radius = point_size / d * height / (2.0 * image_t);\n"
@@ -544,119 +1184,138 @@ private:
             "vec4 color_s = tex_coord != tex_coord ? vec4(0, 0, 0, 1) : texture1D(color_map, tex_coord);\n"
             "vec4 final_color = color_s * frag_color;\n"
             "float weight = clamp((outer_radius - length(frag_center - gl_FragCoord.xy)) / (outer_radius - inner_radius), 0, 1);\n"
-            "gl_FragColor = frag_color * vec4(1, 1, 1, weight);\n"
+            "gl_FragColor = final_color * vec4(1, 1, 1, weight);\n"
             "}\n";
     _context->makeCurrent(_window);
     _program.addShaderFromSourceCode(QOpenGLShader::Vertex, vsCode.c_str());
     _program.addShaderFromSourceCode(QOpenGLShader::Fragment, fsCode.c_str());
     _program.link();
+
+    // ids of pickNearPoint, the bytes of an id are normalized like a color
+    std::string pickVsCode =
+            "#version 120\n"
+            "\n"
+            "uniform mat4 mvpMatrix;\n"
+            "uniform int quantized_positions;\n"
+            "uniform vec3 position_corner;\n"
+            "uniform float position_cell_size;\n"
+            "\n"
+            "attribute vec4 position;\n"
+            "attribute vec4 id;\n"
+            "varying vec4 frag_id;\n"
+            "\n" +
+            decodePositionCode +
+            "\n"
+            "void main() {\n"
+            "  gl_Position = mvpMatrix * vec4(decode_position(), 1.0);\n"
+            "  frag_id = id;\n"
+            "  gl_PointSize = 1;\n"
+            "}\n";
+    std::string pickFsCode =
+            "#version 120\n"
+            "\n"
+            "varying vec4 frag_id;\n"
+            "\n"
+            "void main() {\n"
+            "  gl_FragColor = frag_id;\n"
+            "}\n";
+    _has_pick_program =
+            _pick_program.addShaderFromSourceCode(QOpenGLShader::Vertex,
+                                                  pickVsCode.c_str()) &&
+            _pick_program.addShaderFromSourceCode(QOpenGLShader::Fragment,
+                                                  pickFsCode.c_str()) &&
+            _pick_program.link();
     _context->doneCurrent();
   }
 
-  static void mergeIndices(std::vector<unsigned int> &x,
-                           const std::vector<unsigned int> &y,
-                           bool xor_merge = false) {
-    // assumes x and y are sorted in increasing order
-    std::vector<unsigned int> temp;
-    temp.reserve(x.size() + y.size());
-    std::size_t y_idx = 0;
-    for (std::size_t i = 0; i < x.size(); i++) {
-      while (y_idx < y.size() && y[y_idx] < x[i]) temp.push_back(y[y_idx++]);
-      if (y_idx == y.size()) {
-        temp.insert(temp.end(), &x[i], &x[i] + (x.size() - i));
-        break;
-      }
-      if (y[y_idx] == x[i]) {
-        y_idx++;
-        if (xor_merge) continue;
-      }
-      temp.push_back(x[i]);
-    }
-    if (y_idx < y.size())
-      temp.insert(temp.end(), &y[y_idx], &y[y_idx] + (y.size() - y_idx));
-    x.swap(temp);
-  }
-
-  static void removeIndices(std::vector<unsigned int> &x,
-                            const std::vector<unsigned int> &y) {
-    std::vector<unsigned int> temp;
-    temp.reserve(x.size());
-    std::size_t y_idx = 0;
-    for (std::size_t i = 0; i < x.size(); i++) {
-      while (y_idx < y.size() && y[y_idx] < x[i]) y_idx++;
-      if (y_idx == y.size()) {
-        temp.insert(temp.end(), &x[i], &x[i] + (x.size() - i));
-        break;
-      }
-      if (y[y_idx] == x[i])
-        y_idx++;
-      else
-        temp.push_back(x[i]);
-    }
-    x.swap(temp);
+  static unsigned int computeHighlightLOD(std::vector<unsigned char> &mask,
+                                          const Octree::Node *node) {
+    // returns the number of highlighted points under node, its centroid is
+    // highlighted by their fraction
+    if (node == nullptr) return 0;
+    unsigned int count = 0;
+    if (node->is_leaf)
+      for (unsigned int i = 0; i < node->point_count; i++)
+        count += mask[node->point_index + i] != 0;
+    else
+      for (unsigned int i = 0; i < 8; i++)
+        count += computeHighlightLOD(mask, node->children[i]);
+    mask[node->centroid_index] = (unsigned char) (
+            (255 * (quint64) count + node->point_count / 2) / node->point_count);
+    return count;
   }
 
   void updateSelectionMask() {
-    std::vector<float> selection_mask(_positions.size() / 3, 0.0f);
-    for (std::size_t i = 0; i < _selected_ids.size(); i++)
-      selection_mask[_selected_ids[i]] = 1.0f;
+    _num_selected = _selected.count(_num_points);
     _context->makeCurrent(_window);
-    glBindBuffer(GL_ARRAY_BUFFER, _buffer_selection_mask);
-    glBufferSubData(GL_ARRAY_BUFFER, 0, sizeof(float) * _positions.size() / 3,
-                    (GLvoid *) &selection_mask[0]);
+    uploadSpan(0, numVertices(), SELECTION);
     _context->doneCurrent();
   }
 
-  static std::size_t countSelected(const std::vector<unsigned int> &x,
-                                   unsigned int y) {
-    // note _selected_ids may contain centroid, we desire non-centroid ids
-    // find number of items in _selected_ids (sorted)
-    // that is less than _num_points
-    if (x.empty()) return 0;
-    std::size_t a = 0;
-    std::size_t b = x.size() - 1;
-    if (x[b] < y) return b + 1;
-    if (x[a] >= y) return 0;
-    // at this point, we know x.size() >= 2
-    // invariances:
-    // 1. x[b] >= y
-    // 2. x[a] < y
-    while (b > a + 1) {
-      std::size_t c = (a + b) / 2;
-      if (x[c] < y)
-        a = c;
-      else
-        b = c;
-    }
-    return a + 1;
-  }
-
   QOpenGLContext *_context;
   QWindow *_window;
   QOpenGLShaderProgram _program;
+  QOpenGLShaderProgram _pick_program;
+  bool _has_pick_program;
 
   float _point_size;
   std::size_t _num_points;
   std::vector<float> _positions;
   std::vector<float> _colors;
   std::vector<float> _sizes;
-  std::vector<unsigned int> _octree_ids;   // LOD-selected points dumped here
-  std::vector<unsigned int> _selected_ids; // maintain list of selected points
+  std::vector<Octree::Range> _lod_ranges;  // LOD-selected points dumped here
+  PointSelection _selected;                // points and centroids selected
+  std::size_t _num_selected;               // of the points only
+  std::vector<float> _streamed_positions;  // see appendPoints
+  std::vector<float> _streamed_colors;
   vltools::Box3<float> _full_box;
   GLuint _buffer_positions;
   GLuint _buffer_colors;
   GLuint _buffer_scalars;
   GLuint _buffer_sizes;
   GLuint _buffer_selection_mask;
-  GLuint _buffer_octree_ids;
+  GLuint _buffer_highlight_mask;
+  GLuint _buffer_ids;
   GLuint _texture_color_map;
   Octree _octree;
   PointAttributes _attributes;
 
+  // octree of a large cloud built in the background, see loadPoints
+  std::thread _build_thread;
+  std::vector<float> _build_positions;
+  std::vector<float> _build_sizes;
+  std::size_t _num_points_building;
+  Octree _build_octree;
+  std::vector<char> _build_attributes; // of streamed points, see appendPoints
+  std::function<void()> _on_built;
+  QString _octree_cache_path; // see setOctreeCache
+
   std::vector<float> _color_map;
   float _color_map_min;
   float _color_map_max;
   bool _color_map_auto;
+
+  bool _has_highlight;
+  QVector4D _highlight_color;
+
+  bool _quantize_positions;
+  QuantizedPositions _quantizer; // grid of the uploaded positions, if quantized
+
+  ChunkPool _chunks;                        // see setGpuPointBudget
+  std::size_t _gpu_point_budget;            // 0 if none
+  std::size_t _dropped_points;              // see getDroppedPoints
+  bool _dropped_warned;                     // once per allocation
+  // ranges of a draw into the vertex buffers, or into the slots if paged
+  std::vector<GLint> _draw_firsts;
+  std::vector<GLsizei> _draw_counts;
+  typedef void(QOPENGLF_APIENTRYP MultiDrawArrays)(GLenum, const GLint *,
+                                                   const GLsizei *, GLsizei);
+  MultiDrawArrays _multi_draw_arrays; // null if unsupported
+  // ids of the points drawn at _pick_mvp, see pickNearPoint
+  PickBuffer _pick_buffer;
+  QMatrix4x4 _pick_mvp;
+  bool _pick_complete; // else queryNearPoint searches the octree
+  std::vector<unsigned char> _highlight_mask; // see setHighlight
 };
 
 #endif // __POINTCLOUD_H__
@@ -0,0 +1,71 @@
+#ifndef __POINTSELECTION_H__
+#define __POINTSELECTION_H__
+#include <QtGlobal>
+#include <algorithm>
+#include <bit>
+#include <vector>
+
+// set of selected points and LOD centroids, one bit each in the octree order.
+// Ranges of them are added and removed a word at a time
+class PointSelection {
+public:
+  PointSelection() : _size(0) {}
+
+  void reset(std::size_t size) {
+    // size points and centroids, none selected
+    _size = size;
+    _bits.assign((size + 63) / 64, 0);
+  }
+
+  std::size_t size() const { return _size; }
+
+  bool contains(std::size_t i) const {
+    return (_bits[i >> 6] >> (i & 63)) & 1;
+  }
+
+  void insert(std::size_t first, std::size_t count) { set(first, count, true); }
+  void erase(std::size_t first, std::size_t count) { set(first, count, false); }
+
+  void clear() { std::fill(_bits.begin(), _bits.end(), 0); }
+
+  std::size_t count(std::size_t end) const {
+    // number selected below end
+    std::size_t n = 0;
+    for (std::size_t k = 0; k < end >> 6; k++) n += std::popcount(_bits[k]);
+    if (end & 63)
+      n += std::popcount(_bits[end >> 6] & ((1ull << (end & 63)) - 1));
+    return n;
+  }
+
+  std::size_t next(std::size_t i) const {
+    // first selected at or after i, size() if none
+    if (i >= _size) return _size;
+    std::size_t k = i >> 6;
+    quint64 word = _bits[k] & (~0ull << (i & 63));
+    while (word == 0) {
+      if (++k == _bits.size()) return _size;
+      word = _bits[k];
+    }
+    return (k << 6) + std::countr_zero(word);
+  }
+
+private:
+  void set(std::size_t first, std::size_t count, bool value) {
+    std::size_t end = first + count;
+    while (first < end) {
+      std::size_t k = first >> 6;
+      std::size_t n = (std::min) (end - first, 64 - (first & 63));
+      quint64 mask = (n == 64 ? ~0ull : (1ull << n) - 1) << (first & 63);
+      if (value)
+        _bits[k] |= mask;
+      else
+        _bits[k] &= ~mask;
+      first += n;
+    }
+  }
+
+  std::size_t _size;
+  std::vector<quint64> _bits;
+};
+
+#endif // __POINTSELECTION_H__
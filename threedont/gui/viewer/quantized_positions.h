@@ -0,0 +1,87 @@
+#ifndef __QUANTIZEDPOSITIONS_H__
+#define __QUANTIZEDPOSITIONS_H__
+#include <QtGlobal>
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+// positions as uint16 offsets inside the cells of a 32 x 32 x 32 grid over
+// the bounding cube of the points (the nodes at depth 5 of the octree), the
+// fourth component is the index of the cell: 8 bytes per point instead of 12
+// and about 21 bits of precision over the extent of the cloud. The vertex
+// shader of PointCloud and Viewer._quantize_positions use the same layout
+class QuantizedPositions {
+public:
+  static const unsigned int GRID_BITS = 5;
+  static const unsigned int GRID_SIZE = 1 << GRID_BITS;
+  static const unsigned int MAX_OFFSET = 65535;
+
+  QuantizedPositions() : _cell_size(1.0) {
+    _corner[0] = _corner[1] = _corner[2] = 0.0;
+  }
+
+  QuantizedPositions(const double *corner, double cell_size)
+      : _cell_size(cell_size > 0.0 ? cell_size : 1.0) {
+    for (int i = 0; i < 3; i++) _corner[i] = corner[i];
+  }
+
+  void fit(const std::vector<float> &positions) {
+    // grid over the bounding cube of xyz triplets
+    std::size_t n = positions.size() / 3;
+    double lo[3], hi[3];
+    for (int i = 0; i < 3; i++) {
+      lo[i] = n ? positions[i] : 0.0;
+      hi[i] = lo[i];
+    }
+    for (std::size_t j = 0; j < n; j++)
+      for (int i = 0; i < 3; i++) {
+        lo[i] = std::min(lo[i], (double) positions[3 * j + i]);
+        hi[i] = std::max(hi[i], (double) positions[3 * j + i]);
+      }
+    double cube_size = std::max(hi[0] - lo[0], std::max(hi[1] - lo[1], hi[2] - lo[2]));
+    for (int i = 0; i < 3; i++) _corner[i] = lo[i];
+    _cell_size = cube_size > 0.0 ? cube_size / GRID_SIZE : 1.0;
+  }
+
+  void encode(const std::vector<float> &positions,
+              std::vector<quint16> &quantized) const {
+    quantized.resize(4 * (positions.size() / 3));
+    encode(positions.data(), positions.size() / 3, quantized.data());
+  }
+
+  void encode(const float *positions, std::size_t n, quint16 *quantized) const {
+    for (std::size_t j = 0; j < n; j++) {
+      unsigned int cell = 0;
+      for (int i = 0; i < 3; i++) {
+        double t = (positions[3 * j + i] - _corner[i]) / _cell_size;
+        double c = std::min(std::max(std::floor(t), 0.0), GRID_SIZE - 1.0);
+        double offset = std::min(std::max(t - c, 0.0), 1.0);
+        quantized[4 * j + i] = (quint16) (offset * MAX_OFFSET + 0.5);
+        cell = (cell << GRID_BITS) | (unsigned int) c;
+      }
+      quantized[4 * j + 3] = (quint16) cell;
+    }
+  }
+
+  void decode(const quint16 *quantized, std::size_t n,
+              std::vector<float> &positions) const {
+    positions.resize(3 * n);
+    for (std::size_t j = 0; j < n; j++) {
+      unsigned int cell = quantized[4 * j + 3];
+      for (int i = 0; i < 3; i++) {
+        unsigned int c = (cell >> (GRID_BITS * (2 - i))) & (GRID_SIZE - 1);
+        double offset = (double) quantized[4 * j + i] / MAX_OFFSET;
+        positions[3 * j + i] = (float) (_corner[i] + (c + offset) * _cell_size);
+      }
+    }
+  }
+
+  const double *corner() const { return _corner; }
+  double cellSize() const { return _cell_size; }
+
+private:
+  double _corner[3];
+  double _cell_size;
+};
+
+#endif // __QUANTIZEDPOSITIONS_H__
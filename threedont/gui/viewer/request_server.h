@@ -0,0 +1,152 @@
+#ifndef __REQUESTSERVER_H__
+#define __REQUESTSERVER_H__
+#include "comm_funcs.h"
+#include <QByteArray>
+#include <QDebug>
+#include <QHash>
+#include <QHostAddress>
+#include <QTcpServer>
+#include <QTcpSocket>
+#include <cstring>
+#include <new>
+
+// receives the framed requests of the python client on its own thread, so
+// the gui stays interactive while large messages arrive. The body of every
+// request is read incrementally into its own buffer and handed whole to the
+// viewer with requestReceived, sendResponse writes the answer back. The
+// connections are identified by a number, a closed one is never reused
+class RequestServer : public QObject {
+  Q_OBJECT
+public:
+  RequestServer() : _server(nullptr), _next_connection(1) {}
+
+  ~RequestServer() { delete _server; }
+
+  // call listen and stop from the io thread, e.g. with a blocking queued
+  // QMetaObject::invokeMethod
+  quint16 listen() {
+    // returns the port on localhost, 0 if listening failed
+    _server = new QTcpServer();
+    if (!_server->listen(QHostAddress::LocalHost, 0)) {
+      qWarning() << "RequestServer:" << _server->errorString();
+      return 0;
+    }
+    connect(_server, SIGNAL(newConnection()), this, SLOT(accept()));
+    return _server->serverPort();
+  }
+
+  void stop() {
+    for (auto it = _connections.begin(); it != _connections.end(); ++it) {
+      it.value().socket->disconnect(this);
+      delete it.value().socket;
+    }
+    _connections.clear();
+    delete _server;
+    _server = nullptr;
+  }
+
+public slots:
+  void sendResponse(quint64 connection, quint32 requestId,
+                    const QByteArray &body) {
+    // responses to closed connections are dropped
+    auto it = _connections.find(connection);
+    if (it == _connections.end()) return;
+    comm::writeFrame(it.value().socket, requestId, body);
+  }
+
+signals:
+  void requestReceived(quint64 connection, quint32 requestId,
+                       const QByteArray &body);
+
+private slots:
+  void accept() {
+    while (QTcpSocket *socket = _server->nextPendingConnection()) {
+      quint64 connection = _next_connection++;
+      socket->setProperty("connection", connection);
+      _connections.insert(connection, Connection(socket));
+      connect(socket, SIGNAL(readyRead()), this, SLOT(read()));
+      connect(socket, SIGNAL(disconnected()), this, SLOT(close()));
+      connect(socket, SIGNAL(errorOccurred(QAbstractSocket::SocketError)),
+              this, SLOT(reportError()));
+    }
+  }
+
+  void read() {
+    QTcpSocket *socket = qobject_cast<QTcpSocket *>(sender());
+    if (!socket) return;
+    quint64 connection = socket->property("connection").toULongLong();
+    auto it = _connections.find(connection);
+    if (it == _connections.end()) return;
+    Connection &c = it.value();
+    while (socket->bytesAvailable() > 0) {
+      if (c.header_received < comm::FRAME_HEADER_SIZE) {
+        qint64 n = socket->read(c.header + c.header_received,
+                                comm::FRAME_HEADER_SIZE - c.header_received);
+        if (n <= 0) break;
+        c.header_received += n;
+        if (c.header_received < comm::FRAME_HEADER_SIZE) break;
+        quint64 length;
+        std::memcpy(&c.request_id, c.header, sizeof(quint32));
+        std::memcpy(&length, c.header + sizeof(quint32), sizeof(quint64));
+        try {
+          c.body = QByteArray((qsizetype) length, Qt::Uninitialized);
+        } catch (const std::bad_alloc &) {
+          qWarning() << "RequestServer: cannot allocate a request of" << length
+                     << "bytes, closing the connection";
+          socket->abort();
+          return;
+        }
+        c.body_received = 0;
+      }
+      if (c.body_received < c.body.size()) {
+        qint64 n = socket->read(c.body.data() + c.body_received,
+                                c.body.size() - c.body_received);
+        if (n <= 0) break;
+        c.body_received += n;
+      }
+      if (c.body_received == c.body.size()) {
+        // the viewer gets a shallow copy, the next request a new buffer
+        QByteArray body;
+        body.swap(c.body);
+        c.header_received = 0;
+        c.body_received = 0;
+        emit requestReceived(connection, c.request_id, body);
+      }
+    }
+  }
+
+  void close() {
+    QTcpSocket *socket = qobject_cast<QTcpSocket *>(sender());
+    if (!socket) return;
+    auto it = _connections.find(socket->property("connection").toULongLong());
+    if (it != _connections.end() && it.value().header_received > 0)
+      qWarning() << "RequestServer: connection closed in the middle of a request";
+    if (it != _connections.end()) _connections.erase(it);
+    socket->deleteLater();
+  }
+
+  void reportError() {
+    QTcpSocket *socket = qobject_cast<QTcpSocket *>(sender());
+    if (!socket || socket->error() == QAbstractSocket::RemoteHostClosedError)
+      return;
+    qWarning() << "RequestServer:" << socket->errorString();
+  }
+
+private:
+  struct Connection {
+    Connection(QTcpSocket *socket = nullptr)
+        : socket(socket), header_received(0), request_id(0), body_received(0) {}
+    QTcpSocket *socket;
+    char header[comm::FRAME_HEADER_SIZE];
+    qint64 header_received;
+    quint32 request_id;
+    QByteArray body;
+    qint64 body_received;
+  };
+
+  QTcpServer *_server;
+  QHash<quint64, Connection> _connections;
+  quint64 _next_connection;
+};
+
+#endif // __REQUESTSERVER_H__
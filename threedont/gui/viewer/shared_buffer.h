@@ -0,0 +1,67 @@
+#ifndef __SHAREDBUFFER_H__
+#define __SHAREDBUFFER_H__
+#include <QDebug>
+#include <cstddef>
+#include <string>
+
+#if defined(__unix__) || defined(__APPLE__)
+#define SHARED_BUFFER_SUPPORTED
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+// read only view of a POSIX shared memory segment created by the python side
+// (multiprocessing.shared_memory), the segment is mapped for the lifetime of
+// the object and never copied
+class SharedBuffer {
+public:
+  SharedBuffer(const std::string &name, std::size_t size)
+      : _data(nullptr), _size(0) {
+#ifdef SHARED_BUFFER_SUPPORTED
+    if (size == 0) return;
+    int fd = shm_open(("/" + name).c_str(), O_RDONLY, 0);
+    if (fd == -1) {
+      qDebug() << "SharedBuffer: cannot open" << name.c_str();
+      return;
+    }
+    struct stat info;
+    if (fstat(fd, &info) == -1 || (std::size_t) info.st_size < size) {
+      qDebug() << "SharedBuffer: segment" << name.c_str() << "is too small";
+      close(fd);
+      return;
+    }
+    void *data = mmap(nullptr, size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd); // the mapping keeps the segment alive
+    if (data == MAP_FAILED) {
+      qDebug() << "SharedBuffer: cannot map" << name.c_str();
+      return;
+    }
+    _data = (const char *) data;
+    _size = size;
+#else
+    Q_UNUSED(name);
+    Q_UNUSED(size);
+#endif
+  }
+
+  ~SharedBuffer() {
+#ifdef SHARED_BUFFER_SUPPORTED
+    if (_data != nullptr) munmap((void *) _data, _size);
+#endif
+  }
+
+  SharedBuffer(const SharedBuffer &) = delete;
+  SharedBuffer &operator=(const SharedBuffer &) = delete;
+
+  bool valid() const { return _data != nullptr; }
+  const char *data() const { return _data; }
+  std::size_t size() const { return _size; }
+
+private:
+  const char *_data;
+  std::size_t _size;
+};
+
+#endif // __SHAREDBUFFER_H__
@@ -1,21 +1,23 @@
 #ifndef __VIEWER_H__
 #define __VIEWER_H__
+#include <QBuffer>
 #include <QColor>
 #include <QCoreApplication>
 #include <QImage>
+#include <QList>
 #include <QMatrix4x4>
 #include <QMouseEvent>
 #include <QOpenGLContext>
 #include <QOpenGLDebugLogger>
 #include <QOpenGLShaderProgram>
 #include <QString>
-#include <QTcpServer>
-#include <QTcpSocket>
+#include <QThread>
 #include <QTimer>
 #include <QVector3D>
 #include <QWheelEvent>
 #include <QWindow>
 #include <QtCore/qmath.h>
+#include <cstring>
 #include <fstream>
 #include <iostream>
 #include <limits>
@@ -28,7 +30,10 @@
 #include "opengl_funcs.h"
 #include "point_cloud.h"
 #include "qt_camera.h"
+#include "quantized_positions.h"
+#include "request_server.h"
 #include "selection_box.h"
+#include "shared_buffer.h"
 #include "text.h"
 #include "timer.h"
 
@@ -65,26 +70,47 @@ public:
     _floor_grid = new FloorGrid(this, _context);
     _look_at = new LookAt(this, _context);
     _points = new PointCloud(this, _context);
+    _points->setBuildCallback([this] {
+      QMetaObject::invokeMethod(this, "finishBuild", Qt::QueuedConnection);
+    });
     _selection_box = new SelectionBox(this, _context);
     _text = new Text(this, _context, font);
     _dolly = new CameraDolly();
 
     // initalize various states
-    _socket_waiting_on_enter_key = nullptr;
+    _connection_waiting_on_enter_key = 0;
+    _request_waiting_on_enter_key = 0;
     _timer_fine_render_delay = nullptr;
     _fine_render_state = INACTIVE;
+    _max_chunk_size = INITIAL_CHUNK_SIZE;
+    _chunk_offset = 0;
+    _chunk_count = 0;
+    _refined_range = 0;
+    _frame_budget = 1.0 / 60.0;
+    _draw_rate = 0.0;
+    _refine_start = 0.0;
+    _refine_time = 0.0;
+    _refine_num_chunks = 0;
+    _refine_num_points = 0;
     _render_time = std::numeric_limits<double>::infinity();
     _show_text = true;
     _render_scheduled = false;
 
-    // set up TCP server for receiving commands from Python terminal (client)
-    _server = new QTcpServer();
-    if (!_server->listen(QHostAddress::LocalHost, 0)) {
-      qDebug() << _server->errorString().toLocal8Bit().constData();
-      exit(1);
-    }
-    connect(_server, SIGNAL(newConnection()), this, SLOT(reply()));
-    qDebug() << "Viewer: TCP server set up on port " << _server->serverPort();
+    // set up TCP server for receiving commands from Python terminal (client),
+    // the requests are received on the io thread and handled on this one
+    _io_thread = new QThread();
+    _requests = new RequestServer();
+    _requests->moveToThread(_io_thread);
+    connect(_requests, &RequestServer::requestReceived, this,
+            &Viewer::readRequest);
+    connect(this, &Viewer::responseReady, _requests,
+            &RequestServer::sendResponse);
+    _io_thread->start();
+    QMetaObject::invokeMethod(
+            _requests, [this] { return _requests->listen(); },
+            Qt::BlockingQueuedConnection, &_server_port);
+    if (_server_port == 0) exit(1);
+    qDebug() << "Viewer: TCP server set up on port " << _server_port;
   }
 
   ~Viewer() {
@@ -98,15 +124,25 @@ public:
 
     // deletion of context must occur after viewer objects
     delete _context;
-    delete _server;
+
+    // the sockets are closed on the thread they live in
+    QMetaObject::invokeMethod(
+            _requests, [this] { _requests->stop(); },
+            Qt::BlockingQueuedConnection);
+    _io_thread->quit();
+    _io_thread->wait();
+    delete _requests;
+    delete _io_thread;
   }
 
   int getServerPort() {
-    return _server->serverPort();
+    return _server_port;
   }
 
 signals:
   void singlePointSelected(unsigned int);
+  void responseReady(quint64 connection, quint32 requestId,
+                     const QByteArray &body);
 
 protected:
   void keyPressEvent(QKeyEvent *ev) override {
@@ -150,11 +186,10 @@ protected:
       renderPoints();
       renderPointsFine();
     } else if ((ev->key() == Qt::Key_Enter || ev->key() == Qt::Key_Return) &&
-               _socket_waiting_on_enter_key) {
-      const char *msg = "x";
-      comm::sendBytes(msg, 1, _socket_waiting_on_enter_key);
-      _socket_waiting_on_enter_key->disconnectFromHost();
-      _socket_waiting_on_enter_key = nullptr;
+               _connection_waiting_on_enter_key) {
+      emit responseReady(_connection_waiting_on_enter_key,
+                         _request_waiting_on_enter_key, QByteArray("x", 1));
+      _connection_waiting_on_enter_key = 0;
     } else {
       QWindow::keyPressEvent(ev);
       return;
@@ -185,7 +220,8 @@ protected:
     _dolly->stop();
     if (ev->buttons() & Qt::LeftButton) {
       _pressPos = ev->scenePosition();
-      if (ev->modifiers() & Qt::ControlModifier) {
+      // the preview of a cloud being indexed can't be selected
+      if (ev->modifiers() & Qt::ControlModifier && !_points->isBuilding()) {
         if (ev->modifiers() & Qt::ShiftModifier)
           _selection_box->click(win2ndc(_pressPos), SelectionBox::SUB);
         else
@@ -291,15 +327,49 @@ protected:
     renderPoints();
   }
 
+  Q_INVOKABLE void finishBuild() {
+    // the octree of the loaded cloud is ready, it replaces the preview and
+    // the requests that waited for it are handled in order
+    if (!_points->finishBuild()) return;
+    renderPoints();
+    renderPointsFine();
+    while (!_deferred_requests.isEmpty() && !_points->isBuilding()) {
+      DeferredRequest r = _deferred_requests.takeFirst();
+      respond(r.connection, r.request_id, r.body);
+    }
+  }
+
 private slots:
-  void reply() {
-    QTcpSocket *clientConnection = _server->nextPendingConnection();
-    connect(clientConnection, SIGNAL(disconnected()), clientConnection,
-            SLOT(deleteLater()));
+  void readRequest(quint64 connection, quint32 requestId,
+                   const QByteArray &body) {
+    // the client keeps the connection open and pipelines its requests on it,
+    // they arrive here whole and in order. While the octree of a large cloud
+    // is built they wait for it, they all refer to the full cloud
+    if (_points->isBuilding()) {
+      _deferred_requests.append(DeferredRequest{connection, requestId, body});
+      return;
+    }
+    respond(connection, requestId, body);
+  }
 
+private:
+  void respond(quint64 connection, quint32 requestId, const QByteArray &body) {
+    QByteArray requestData = body;
+    QBuffer request(&requestData);
+    request.open(QIODevice::ReadOnly);
+    QByteArray responseData;
+    QBuffer response(&responseData);
+    response.open(QIODevice::WriteOnly);
+    if (handleRequest(requestId, &request, &response, connection))
+      emit responseReady(connection, requestId, responseData);
+  }
+
+  bool handleRequest(quint32 requestId, QIODevice *request, QIODevice *response,
+                     quint64 connection) {
+    // returns false if the response is sent later
     // read first byte of incoming message
     char msgType;
-    comm::receiveBytes(&msgType, 1, clientConnection);
+    comm::receiveBytes(&msgType, 1, request);
     // qDebug() << "Viewer: received message type" << ((int) msgType);
 
     // switch on message type
@@ -307,22 +377,17 @@ private slots:
       case 1: { // load points
         // receive point count (next 4 bytes)
         qint32 numPoints;
-        comm::receiveBytes((char *) &numPoints, sizeof(qint32), clientConnection);
+        comm::receiveBytes((char *) &numPoints, sizeof(qint32), request);
         qDebug() << "Viewer: expecting" << numPoints << "points";
 
         // receive position vectors
         // (next 3 x numPoints x sizeof(float) bytes)
         std::vector<float> positions(3 * numPoints);
         comm::receiveBytes((char *) &positions[0],
-                           positions.size() * sizeof(float), clientConnection);
+                           positions.size() * sizeof(float), request);
         qDebug() << "Viewer: received positions";
 
-        _points->loadPoints(positions);
-        _camera = QtCamera(_points->getBox());
-        _camera.setAspectRatio((float) width() / height());
-        _floor_grid->setFloorLevel(_points->getFloor());
-        renderPoints();
-        renderPointsFine();
+        loadPoints(positions);
         break;
       }
       case 2: { // clear points
@@ -342,22 +407,22 @@ private slots:
         // receive length of property name string
         quint64 stringLength;
         comm::receiveBytes((char *) &stringLength, sizeof(quint64),
-                           clientConnection);
+                           request);
 
         // receive property name string
         std::string propertyName(stringLength, 'x');
         comm::receiveBytes((char *) &propertyName[0], (qint64) stringLength,
-                           clientConnection);
+                           request);
 
         //  receive length of payload
         quint64 payloadLength;
         comm::receiveBytes((char *) &payloadLength, sizeof(quint64),
-                           clientConnection);
+                           request);
 
-        // receive payload
+        // receive payload, empty e.g. for no selected points
         std::vector<char> payload(payloadLength, 0);
-        comm::receiveBytes(&payload[0], (qint64) payloadLength,
-                           clientConnection);
+        comm::receiveBytes(payload.data(), (qint64) payloadLength,
+                           request);
 
         // set viewer properties accordingly
         // ignore set requests with unexpected payload lengths
@@ -389,6 +454,20 @@ private slots:
         } else if (!strcmp(propertyName.c_str(), "show_info")) {
           if (payloadLength != sizeof(bool)) break;
           _show_text = *(bool *) &payload[0];
+        } else if (!strcmp(propertyName.c_str(), "frame_budget")) {
+          if (payloadLength != sizeof(float)) break;
+          float budget = *(float *) &payload[0];
+          if (budget > 0.0f) _frame_budget = budget;
+        } else if (!strcmp(propertyName.c_str(), "quantize_positions")) {
+          if (payloadLength != sizeof(bool)) break;
+          _points->setQuantizePositions(*(bool *) &payload[0]);
+        } else if (!strcmp(propertyName.c_str(), "gpu_point_budget")) {
+          if (payloadLength != sizeof(unsigned int)) break;
+          _points->setGpuPointBudget(*(unsigned int *) &payload[0]);
+        } else if (!strcmp(propertyName.c_str(), "octree_cache")) {
+          // utf-8 path, empty for none
+          _points->setOctreeCache(
+                  QString::fromUtf8(payload.data(), (qsizetype) payloadLength));
         } else if (!strcmp(propertyName.c_str(), "show_axis")) {
           if (payloadLength != sizeof(bool)) break;
           bool visible = *(bool *) &payload[0];
@@ -402,6 +481,11 @@ private slots:
           float *rgba = (float *) &payload[0];
           QVector4D floor_color(rgba[0], rgba[1], rgba[2], rgba[3]);
           _floor_grid->setFloorColor(floor_color);
+        } else if (!strcmp(propertyName.c_str(), "highlight_color")) {
+          if (payloadLength != 4 * sizeof(float)) break;
+          float *rgba = (float *) &payload[0];
+          QVector4D highlight_color(rgba[0], rgba[1], rgba[2], rgba[3]);
+          _points->setHighlightColor(highlight_color);
         } else if (!strcmp(propertyName.c_str(), "floor_grid_color")) {
           if (payloadLength != 4 * sizeof(float)) break;
           float *rgba = (float *) &payload[0];
@@ -427,7 +511,7 @@ private slots:
         } else if (!strcmp(propertyName.c_str(), "selected")) {
           quint64 num_selected = payloadLength / sizeof(unsigned int);
           if (payloadLength != num_selected * sizeof(unsigned int)) break;
-          unsigned int *ptr = (unsigned int *) &payload[0];
+          unsigned int *ptr = (unsigned int *) payload.data();
           std::vector<unsigned int> selected;
           selected.reserve(num_selected);
           for (quint64 i = 0; i < num_selected; i++)
@@ -437,7 +521,7 @@ private slots:
         } else if (!strcmp(propertyName.c_str(), "color_map")) {
           quint64 num_colors = payloadLength / sizeof(float) / 4;
           if (payloadLength != num_colors * sizeof(float) * 4) break;
-          float *ptr = (float *) &payload[0];
+          float *ptr = (float *) payload.data();
           std::vector<float> color_map(ptr, ptr + num_colors * 4);
           _points->setColorMap(color_map);
         } else if (!strcmp(propertyName.c_str(), "color_map_scale")) {
@@ -459,64 +543,75 @@ private slots:
         // receive length of property name string
         quint64 stringLength;
         comm::receiveBytes((char *) &stringLength, sizeof(quint64),
-                           clientConnection);
+                           request);
 
         // receive property name string
         std::string propertyName(stringLength, 'x');
         comm::receiveBytes((char *) &propertyName[0], stringLength,
-                           clientConnection);
+                           request);
 
         // send property
         if (!strcmp(propertyName.c_str(), "selected")) {
           std::vector<unsigned int> selected_ids;
           selected_ids.reserve(_points->getNumSelected());
           _points->getSelected(selected_ids);
-          comm::sendArray<unsigned int>(&selected_ids[0], selected_ids.size(),
-                                        clientConnection);
+          comm::sendArray<unsigned int>(selected_ids.data(), selected_ids.size(),
+                                        response);
         } else if (!strcmp(propertyName.c_str(), "eye")) {
           float eye[3];
           _camera.getCameraPosition(eye);
-          comm::sendArray<float>(&eye[0], 3, clientConnection);
+          comm::sendArray<float>(&eye[0], 3, response);
         } else if (!strcmp(propertyName.c_str(), "lookat")) {
           float lookat[3];
           _camera.getLookAtPosition(lookat);
-          comm::sendArray<float>(&lookat[0], 3, clientConnection);
+          comm::sendArray<float>(&lookat[0], 3, response);
         } else if (!strcmp(propertyName.c_str(), "view")) {
           float view[3];
           _camera.getViewVector(view);
-          comm::sendArray<float>(&view[0], 3, clientConnection);
+          comm::sendArray<float>(&view[0], 3, response);
         } else if (!strcmp(propertyName.c_str(), "right")) {
           float right[3];
           _camera.getRightVector(right);
-          comm::sendArray<float>(&right[0], 3, clientConnection);
+          comm::sendArray<float>(&right[0], 3, response);
         } else if (!strcmp(propertyName.c_str(), "up")) {
           float up[3];
           _camera.getUpVector(up);
-          comm::sendArray<float>(&up[0], 3, clientConnection);
+          comm::sendArray<float>(&up[0], 3, response);
         } else if (!strcmp(propertyName.c_str(), "phi")) {
-          comm::sendScalar<float>(_camera.getPhi(), clientConnection);
+          comm::sendScalar<float>(_camera.getPhi(), response);
         } else if (!strcmp(propertyName.c_str(), "theta")) {
-          comm::sendScalar<float>(_camera.getTheta(), clientConnection);
+          comm::sendScalar<float>(_camera.getTheta(), response);
         } else if (!strcmp(propertyName.c_str(), "r")) {
           comm::sendScalar<float>(_camera.getCameraDistance(),
-                                  clientConnection);
+                                  response);
         } else if (!strcmp(propertyName.c_str(), "mvp")) {
           QMatrix4x4 mvp = _camera.computeMVPMatrix(_points->getBox());
-          comm::sendMatrix<float>((float *) mvp.data(), 4, 4, clientConnection);
+          comm::sendMatrix<float>((float *) mvp.data(), 4, 4, response);
+        } else if (!strcmp(propertyName.c_str(), "frame_stats")) {
+          float stats[6] = {(float) _render_time,
+                            (float) _refine_time,
+                            (float) _refine_num_chunks,
+                            (float) _refine_num_points,
+                            (float) _draw_rate,
+                            (float) _frame_budget};
+          comm::sendArray<float>(&stats[0], 6, response);
+        } else if (!strcmp(propertyName.c_str(), "dropped_points")) {
+          comm::sendScalar<unsigned int>(
+                  (unsigned int) _points->getDroppedPoints(), response);
         } else if (!strcmp(propertyName.c_str(), "num_points")) {
           comm::sendScalar<unsigned int>((unsigned int) _points->getNumPoints(),
-                                         clientConnection);
+                                         response);
         } else if (!strcmp(propertyName.c_str(), "num_attributes")) {
           comm::sendScalar<unsigned int>(
-                  (unsigned int) _points->getNumAttributes(), clientConnection);
+                  (unsigned int) _points->getNumAttributes(), response);
         } else if (!strcmp(propertyName.c_str(), "curr_attribute_id")) {
           comm::sendScalar<unsigned int>(
                   (unsigned int) _points->getCurrentAttributeIndex(),
-                  clientConnection);
+                  response);
         } else {
           std::string msg =
                   "Unrecognized property name \"" + propertyName + "\"";
-          comm::sendError(&msg[0], msg.length(), clientConnection);
+          comm::sendError(&msg[0], msg.length(), response);
         }
         break;
       }
@@ -524,42 +619,43 @@ private slots:
         // receive length of property name string
         quint64 stringLength;
         comm::receiveBytes((char *) &stringLength, sizeof(quint64),
-                           clientConnection);
+                           request);
 
         // receive property name string
         std::string filename(stringLength, 'x');
-        comm::receiveBytes((char *) &filename[0], stringLength, clientConnection);
+        comm::receiveBytes((char *) &filename[0], stringLength, request);
         printScreen(filename);
         break;
       }
       case 7: { // wait for enter
-        // save current connection socket and return
-        _socket_waiting_on_enter_key = clientConnection;
-        return;
+        // save current connection and answer when enter is pressed
+        _connection_waiting_on_enter_key = connection;
+        _request_waiting_on_enter_key = requestId;
+        return false;
       }
       case 8: { // load camera path animation
         // receive number of poses (1 int)
         qint32 numPoses;
-        comm::receiveBytes((char *) &numPoses, sizeof(qint32), clientConnection);
+        comm::receiveBytes((char *) &numPoses, sizeof(qint32), request);
 
         // receive poses (6n floats)
         std::vector<float> poses(6 * numPoses);
         comm::receiveBytes((char *) &poses[0], 6 * numPoses * sizeof(float),
-                           clientConnection);
+                           request);
 
         // receive number of time stamps (1 int)
         qint32 numTimeStamps;
         comm::receiveBytes((char *) &numTimeStamps, sizeof(qint32),
-                           clientConnection);
+                           request);
 
         // receive time stamps (n floats)
         std::vector<float> ts(numTimeStamps);
         comm::receiveBytes((char *) &ts[0], numTimeStamps * sizeof(float),
-                           clientConnection);
+                           request);
 
         // receive interpolation code (1 byte)
         quint8 interp;
-        comm::receiveBytes((char *) &interp, sizeof(quint8), clientConnection);
+        comm::receiveBytes((char *) &interp, sizeof(quint8), request);
 
         // reorganize poses into vector of CameraPoses
         std::vector<CameraPose> cam_poses(poses.size() / 6);
@@ -581,12 +677,12 @@ private slots:
       case 9: { // playback camera path animation
         // receive playback time range (2 float)
         float tmin, tmax;
-        comm::receiveBytes((char *) &tmin, sizeof(float), clientConnection);
-        comm::receiveBytes((char *) &tmax, sizeof(float), clientConnection);
+        comm::receiveBytes((char *) &tmin, sizeof(float), request);
+        comm::receiveBytes((char *) &tmax, sizeof(float), request);
 
         // receive repeat flag (1 bool)
         bool repeat;
-        comm::receiveBytes((char *) &repeat, sizeof(bool), clientConnection);
+        comm::receiveBytes((char *) &repeat, sizeof(bool), request);
 
         // start playback
         _dolly->setStartTime(tmin);
@@ -601,26 +697,152 @@ private slots:
         //  receive length of payload
         quint64 payloadLength;
         comm::receiveBytes((char *) &payloadLength, sizeof(quint64),
-                           clientConnection);
+                           request);
 
         // receive payload
         std::vector<char> payload(payloadLength, 0);
         comm::receiveBytes(&payload[0], (qint64) payloadLength,
-                           clientConnection);
+                           request);
 
         _points->loadAttributes(payload);
         renderPoints();
         renderPointsFine();
         break;
       }
+      case 11: { // append points
+        // receive point count (4 bytes) and whether they are the last ones
+        qint32 numPoints;
+        comm::receiveBytes((char *) &numPoints, sizeof(qint32), request);
+        bool last;
+        comm::receiveBytes((char *) &last, sizeof(bool), request);
+
+        // receive positions and rgba colors
+        std::vector<float> positions(3 * numPoints);
+        std::vector<float> colors(4 * numPoints);
+        if (numPoints > 0) {
+          comm::receiveBytes((char *) &positions[0],
+                             positions.size() * sizeof(float), request);
+          comm::receiveBytes((char *) &colors[0],
+                             colors.size() * sizeof(float), request);
+        }
+
+        // only the first points move the camera, afterwards the user is navigating
+        bool first = _points->getNumPoints() == 0;
+        if (!_points->appendPoints(positions, colors, last)) break;
+        if (first) {
+          _camera = QtCamera(_points->getBox());
+          _camera.setAspectRatio((float) width() / height());
+        }
+        _floor_grid->setFloorLevel(_points->getFloor());
+        renderPoints();
+        renderPointsFine();
+        break;
+      }
+      case 12: { // load points from shared memory
+        // receive segment name and point count, answer whether it was mapped
+        std::string name = receiveString(request);
+        quint64 numPoints;
+        comm::receiveBytes((char *) &numPoints, sizeof(quint64), request);
+        SharedBuffer buffer(name, 3 * numPoints * sizeof(float));
+        char mapped = buffer.valid();
+        comm::sendBytes(&mapped, 1, response);
+        if (!mapped) break;
+
+        // the octree reorders its own copy of the positions
+        const float *begin = (const float *) buffer.data();
+        std::vector<float> positions(begin, begin + 3 * numPoints);
+        loadPoints(positions);
+        break;
+      }
+      case 13: { // set per point attributes from shared memory
+        // receive segment name and payload length, the payload has the
+        // typed layout of message 16
+        std::string name = receiveString(request);
+        quint64 payloadLength;
+        comm::receiveBytes((char *) &payloadLength, sizeof(quint64), request);
+        SharedBuffer buffer(name, payloadLength);
+        char mapped = buffer.valid();
+        comm::sendBytes(&mapped, 1, response);
+        if (!mapped) break;
+
+        _points->loadAttributes(buffer.data(), buffer.size(), true);
+        renderPoints();
+        renderPointsFine();
+        break;
+      }
+      case 15: { // highlight points
+        // receive length of the bitset, one bit per point
+        quint64 numBytes;
+        comm::receiveBytes((char *) &numBytes, sizeof(quint64), request);
+        std::vector<unsigned char> bits(numBytes);
+        if (numBytes > 0)
+          comm::receiveBytes((char *) &bits[0], (qint64) numBytes, request);
+
+        if (!_points->setHighlight(bits)) break;
+        renderPoints();
+        renderPointsFine();
+        break;
+      }
+      case 16: { // set per point attributes, typed
+        // like message 10, but every set also carries its encoding (and the
+        // palette of categorical sets) and values in that encoding
+        quint64 payloadLength;
+        comm::receiveBytes((char *) &payloadLength, sizeof(quint64), request);
+        std::vector<char> payload(payloadLength, 0);
+        if (payloadLength > 0)
+          comm::receiveBytes(&payload[0], (qint64) payloadLength, request);
+        if (payload.empty()) break;
+
+        _points->loadAttributes(&payload[0], payload.size(), true);
+        renderPoints();
+        renderPointsFine();
+        break;
+      }
+      case 17: { // load quantized points
+        // receive grid corner and cell size (4 doubles), point count, then
+        // 4 uint16 per point, see QuantizedPositions
+        double grid[4];
+        comm::receiveBytes((char *) grid, sizeof(grid), request);
+        quint64 numPoints;
+        comm::receiveBytes((char *) &numPoints, sizeof(quint64), request);
+        std::vector<quint16> quantized(4 * numPoints);
+        if (numPoints > 0)
+          comm::receiveBytes((char *) &quantized[0],
+                             quantized.size() * sizeof(quint16), request);
+
+        std::vector<float> positions;
+        QuantizedPositions(grid, grid[3])
+                .decode(quantized.data(), numPoints, positions);
+        loadPoints(positions);
+        break;
+      }
+      case 18: { // load quantized points from shared memory
+        // receive segment name, grid and point count as in message 17,
+        // answer whether it was mapped
+        std::string name = receiveString(request);
+        double grid[4];
+        comm::receiveBytes((char *) grid, sizeof(grid), request);
+        quint64 numPoints;
+        comm::receiveBytes((char *) &numPoints, sizeof(quint64), request);
+        SharedBuffer buffer(name, 4 * numPoints * sizeof(quint16));
+        char mapped = buffer.valid();
+        comm::sendBytes(&mapped, 1, response);
+        if (!mapped) break;
+
+        std::vector<float> positions;
+        QuantizedPositions(grid, grid[3])
+                .decode((const quint16 *) buffer.data(), numPoints, positions);
+        loadPoints(positions);
+        break;
+      }
       default: // unrecognized message type
         break;
         // do nothing
     }
-    clientConnection->write("1234");
-    clientConnection->disconnectFromHost();
+    return true;
   }
 
+private slots:
   void drawRefinedPointsDelayed() {
     if (_fine_render_state == INACTIVE)
       QTimer::singleShot(0, this, SLOT(drawRefinedPoints()));
@@ -642,14 +864,18 @@ private slots:
         qDebug() << "fine render: initialize" << std::endl;
         _max_chunk_size = 1;
         _chunk_offset = 0;
-        _refined_indices.clear();
-        for (int i = 0; i < 10; i++) _refined_indices.push_back(i);
+        _refined_range = 0;
+        _refined_ranges.assign(1, Octree::Range{0, 10});
 #else
         // get points at finest LOD, for the current image resolution
-        _points->queryLOD(_refined_indices, _camera, 1.0f);
+        _refine_start = vltools::getTime();
+        _points->queryLOD(_refined_ranges, _camera, 1.0f);
+        _refined_mvp = _camera.computeMVPMatrix(_points->getBox());
 
-        _max_chunk_size = 50000;
+        _max_chunk_size = budgetedChunkSize(INITIAL_CHUNK_SIZE);
         _chunk_offset = 0;
+        _chunk_count = 0;
+        _refined_range = 0;
 
         // draw background and grid
         _context->makeCurrent(this);
@@ -665,8 +891,21 @@ private slots:
         break;
       }
       case CHUNK: {
-        std::size_t chunk_size = _refined_indices.size() - _chunk_offset;
-        if (chunk_size > _max_chunk_size) chunk_size = _max_chunk_size;
+        // the chunk takes the next _max_chunk_size points of the ranges, the
+        // range it ends in is cut and its rest starts the next chunk
+        _chunk_ranges.clear();
+        std::size_t chunk_size = 0;
+        while (_refined_range < _refined_ranges.size() &&
+               chunk_size < _max_chunk_size) {
+          Octree::Range &r = _refined_ranges[_refined_range];
+          unsigned int count = (unsigned int) (std::min) (
+                  (std::size_t) r.count, _max_chunk_size - chunk_size);
+          _chunk_ranges.push_back(Octree::Range{r.first, count});
+          chunk_size += count;
+          r.first += count;
+          r.count -= count;
+          if (r.count == 0) _refined_range++;
+        }
 #ifdef TEST_FINE_RENDER
         double t = vltools::getTime();
         dummyCalculation(1000000);
@@ -674,14 +913,30 @@ private slots:
         qDebug() << "fine render: processed " << _chunk_offset << ", "
                  << chunk_size << ", " << t << std::endl;
 #else
+        if (_camera.computeMVPMatrix(_points->getBox()) != _refined_mvp) {
+          // the camera moved since the refinement started, the rest of its
+          // points would be drawn over a stale frame
+          _fine_render_state = INACTIVE;
+          break;
+        }
+        // the chunk is timed until the gpu has drawn it, so that its size
+        // follows the actual draw rate and no queued gpu work delays the
+        // events handled in between
         _context->makeCurrent(this);
-        if (chunk_size > 0)
-          _points->draw(&_refined_indices[_chunk_offset],
-                        (unsigned int) chunk_size, _camera, _selection_box);
+        double t = vltools::getTime();
+        if (chunk_size > 0) {
+          _points->draw(&_chunk_ranges[0], _chunk_ranges.size(), _camera,
+                        _selection_box);
+          glFinish();
+        }
+        t = vltools::getTime() - t;
         _context->doneCurrent();
+        updateDrawRate(chunk_size, t);
+        _max_chunk_size = budgetedChunkSize(_max_chunk_size);
 #endif
+        _chunk_count++;
         _chunk_offset += chunk_size;
-        if (_chunk_offset == _refined_indices.size())
+        if (_refined_range == _refined_ranges.size())
           _fine_render_state = FINALIZE;
         else
           _fine_render_state = CHUNK;
@@ -698,6 +953,9 @@ private slots:
         displayInfo();
         if (this->isExposed()) _context->swapBuffers(this);
         _context->doneCurrent();
+        _refine_time = vltools::getTime() - _refine_start;
+        _refine_num_chunks = _chunk_count;
+        _refine_num_points = _chunk_offset;
 #endif
         _fine_render_state = INACTIVE;
         break;
@@ -717,6 +975,7 @@ private slots:
       renderPointsFine();
       return;
     }
+    if (_fine_render_state != INACTIVE) _fine_render_state = TERMINATE;
     CameraPose pose = _dolly->getPose();
     _camera.setLookAtPosition(pose.lookAt());
     _camera.setPhi(pose.phi());
@@ -728,12 +987,51 @@ private slots:
   }
 
 private:
+  void updateDrawRate(std::size_t chunk_size, double t) {
+    // running estimate of the points drawn per second, chunks too small to
+    // outweigh the per draw overhead are left out
+    if (chunk_size < MIN_CHUNK_SIZE || t <= 0.0) return;
+    double rate = chunk_size / t;
+    _draw_rate = _draw_rate > 0.0 ? 0.5 * (_draw_rate + rate) : rate;
+  }
+
+  std::size_t budgetedChunkSize(std::size_t prev_chunk_size) {
+    // number of points drawn at the estimated rate within the frame budget,
+    // growing at most twofold from the previous chunk so that a single
+    // fast chunk can't overshoot the budget. Without an estimate yet the
+    // previous size is kept
+    if (_draw_rate <= 0.0) return prev_chunk_size;
+    double n = _draw_rate * _frame_budget;
+    n = qBound((double) MIN_CHUNK_SIZE, n, 2.0 * (double) prev_chunk_size);
+    return (std::size_t) n;
+  }
+
   void dummyCalculation(int n) {
     _dummy_accumulator /= (float) n;
     for (int i = 0; i < n; i++)
       _dummy_accumulator += sqrtf(pow(6.9f, log((float) i)));
   }
 
+  static std::string receiveString(QIODevice *request) {
+    // string packed as length (quint64) followed by its characters
+    quint64 stringLength;
+    comm::receiveBytes((char *) &stringLength, sizeof(quint64), request);
+    std::string string(stringLength, 'x');
+    if (stringLength > 0)
+      comm::receiveBytes(&string[0], (qint64) stringLength, request);
+    return string;
+  }
+
+  void loadPoints(std::vector<float> &positions) {
+    _points->clearStreamedPoints();
+    _points->loadPoints(positions);
+    _camera = QtCamera(_points->getBox());
+    _camera.setAspectRatio((float) width() / height());
+    _floor_grid->setFloorLevel(_points->getFloor());
+    renderPoints();
+    renderPointsFine();
+  }
+
   void printScreen(std::string filename) {
     _context->makeCurrent(this);
     int w = width() * this->devicePixelRatio();
@@ -776,14 +1074,18 @@ private:
     cursor_y += _text->renderText(cursor_x, cursor_y, lookat_text).height();
 
     // display # points loaded
-    QString numpoints_text = QString::asprintf("%d points loaded", (int) _points->getNumPoints());
+    QString numpoints_text =
+            _points->isBuilding()
+                    ? QString::asprintf("%d points loaded, indexing",
+                                        (int) _points->getNumPointsBuilding())
+                    : QString::asprintf("%d points loaded", (int) _points->getNumPoints());
     cursor_y += _text->renderText(cursor_x, cursor_y, numpoints_text).height();
 
     // display # points selected
     std::size_t num_selected = _points->getNumSelected();
     QString selected_text;
     if (num_selected == 1) {
-      unsigned int selected_id = _points->getSelectedIds()[0];
+      unsigned int selected_id = (unsigned int) _points->getFirstSelectedId();
       const float *pos = &_points->getPositions()[3 * selected_id];
       cursor_y += _text->renderText(cursor_x, cursor_y, selected_text).height();
       selected_text = QString::asprintf("   z = %.3f", pos[2]);
@@ -849,7 +1151,7 @@ private:
     _text->renderText(cursor_x, cursor_y, attr_text).height();
 
     // display port number
-    QString port_text = QString::asprintf("port %d", _server->serverPort());
+    QString port_text = QString::asprintf("port %d", _server_port);
     QSizeF port_text_size = _text->computeTextSize(port_text);
     cursor_x = width() - pad - port_text_size.width();
     cursor_y = height() - pad - port_text_size.height();
@@ -898,7 +1200,15 @@ private:
     return QPointF(v.x(), v.y());
   }
 
-  QTcpServer *_server;
+  QThread *_io_thread;
+  RequestServer *_requests;
+  quint16 _server_port;
+  struct DeferredRequest {
+    quint64 connection;
+    quint32 request_id;
+    QByteArray body;
+  };
+  QList<DeferredRequest> _deferred_requests; // see readRequest
   QPointF _pressPos;
   QOpenGLContext *_context;
 
@@ -919,11 +1229,27 @@ private:
                          TERMINATE };
   FineRenderState _fine_render_state;
   QTimer *_timer_fine_render_delay;
-  std::size_t _chunk_offset;
+  // the refined points are drawn in chunks sized to take about _frame_budget
+  // seconds each at _draw_rate points per second, the events that arrive
+  // in the meantime are handled between chunks
+  static const std::size_t INITIAL_CHUNK_SIZE = 50000;
+  static const std::size_t MIN_CHUNK_SIZE = 4096;
+  std::size_t _chunk_offset; // points drawn so far
   std::size_t _max_chunk_size;
-  std::vector<unsigned int> _refined_indices;
-
-  QTcpSocket *_socket_waiting_on_enter_key;
+  std::size_t _chunk_count;
+  double _frame_budget;
+  double _draw_rate;
+  std::vector<Octree::Range> _refined_ranges;
+  std::size_t _refined_range; // first range not drawn entirely
+  std::vector<Octree::Range> _chunk_ranges;
+  QMatrix4x4 _refined_mvp;
+  double _refine_start;
+  double _refine_time;         // of the last completed refinement
+  std::size_t _refine_num_chunks;
+  std::size_t _refine_num_points;
+
+  quint64 _connection_waiting_on_enter_key; // 0 if none
+  quint32 _request_waiting_on_enter_key;
   double _render_time;
   bool _show_text;
 